@@ -1,20 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import uuid
 from datetime import datetime
 import os
 import sys
+import base64
+import hmac
+import json
+import threading
+import time
 import traceback
+from types import SimpleNamespace
 
-def create_app():
+# Production CORS configuration
+CORS_ORIGINS = [
+    'https://ai-chat-memory-gumx.vercel.app',
+    'http://localhost:3000'
+]
+
+def create_app(gemini_client=None, vector_store=None, session_store=None):
+    """Build the Flask app.
+
+    ``gemini_client``/``vector_store``/``session_store`` can be passed in
+    (e.g. a fake streaming client) instead of being constructed from config.
+    """
     app = Flask(__name__)
     
-    # Production CORS configuration
-    CORS_ORIGINS = [
-        'https://ai-chat-memory-gumx.vercel.app',
-        'http://localhost:3000'
-    ]
-    
     CORS(app, 
         origins=CORS_ORIGINS,
         supports_credentials=True,
@@ -24,10 +34,37 @@ def create_app():
     )
     
     # Global variables
-    gemini_client = None
-    vector_store = None
     dependencies_loaded = False
-    sessions = {}
+    
+    # Token-budgeted memory context for each prompt
+    from config import Config
+    from utils.context_builder import ContextBuilder
+    from utils.history_import import HistoryImporter
+    from utils.log import SAMPLED, get_logger
+    from utils.metrics import metrics
+    log = get_logger('app')
+    context_builder = ContextBuilder(Config.CONTEXT_TOKEN_BUDGET, Config.CONTEXT_RECENT_TURNS,
+                                     Config.CONTEXT_REPLY_TOKENS)
+    
+    def forget_sessions(session_ids):
+        """Delete the turns of expired sessions (stored under their ids), off the request thread"""
+        def forget():
+            if vector_store is None:
+                return
+            try:
+                deleted = sum(vector_store.delete_user(session_id) for session_id in session_ids)
+                log.info(f"🧹 Deleted {deleted} conversations of {len(session_ids)} expired sessions")
+            except Exception as e:
+                log.exception(f"❌ Deleting the turns of expired sessions failed: {e}")
+        threading.Thread(target=forget, name="session-cleanup", daemon=True).start()
+    
+    # Bounded session bookkeeping; the turns themselves live in the vector store
+    if session_store is None:
+        from utils.session_store import create_session_store
+        session_store = create_session_store(
+            Config.SESSION_STORE, Config.SESSION_DB_PATH, Config.SESSION_MAX, Config.SESSION_IDLE_TTL,
+            Config.SESSION_MAX_BYTES,
+            on_expire=forget_sessions if Config.SESSION_EXPIRY_DELETES_TURNS else None)
 
     def initialize_dependencies():
         nonlocal gemini_client, vector_store, dependencies_loaded
@@ -35,15 +72,20 @@ def create_app():
             print("🚀 Initializing AI Chat dependencies...")
             
             # Import and initialize Gemini client
-            from utils.gemini_client import GeminiClient
-            gemini_client = GeminiClient()
+            if gemini_client is None:
+                from utils.gemini_client import GeminiClient
+                gemini_client = GeminiClient()
             print("✅ Gemini client initialized")
             
             # Import and initialize vector store
-            from utils.vector_store import VectorStore
-            vector_store = VectorStore()
+            if vector_store is None:
+                from utils.sharded_store import create_vector_store
+                vector_store = create_vector_store()
             print("✅ Vector store initialized")
             
+            # Exposed so gunicorn's worker_exit hook can flush pending writes
+            app.extensions['vector_store'] = vector_store
+            
             dependencies_loaded = True
             print("✅ All dependencies loaded successfully")
             return True
@@ -76,9 +118,14 @@ def create_app():
             'timestamp': datetime.now().isoformat(),
             'service': 'AI Chat with Memory Backend',
             'dependencies_loaded': dependencies_loaded,
-            'sessions_count': len(sessions),
+            'sessions_count': len(session_store),
             'gemini_available': gemini_client is not None,
-            'vector_store_available': vector_store is not None
+            'vector_store_available': vector_store is not None,
+            'session_store': session_store.stats(),
+            'persistence': vector_store.persistence_stats() if vector_store is not None else None,
+            'response_cache': getattr(gemini_client, 'cache_stats', lambda: None)(),
+            'gemini_scheduler': getattr(gemini_client, 'scheduler_stats', lambda: None)(),
+            'gemini_latency': getattr(gemini_client, 'latency_stats', lambda: None)()
         }), 200
 
     @app.route('/api/test')
@@ -86,7 +133,7 @@ def create_app():
         return jsonify({
             'message': 'Backend is running!',
             'dependencies_loaded': dependencies_loaded,
-            'sessions_count': len(sessions),
+            'sessions_count': len(session_store),
             'timestamp': datetime.now().isoformat()
         }), 200
 
@@ -98,6 +145,88 @@ def create_app():
             'timestamp': datetime.now().isoformat()
         }), 200
 
+    def parse_chat_request():
+        """Validate a chat request; returns (message, session_id, error_response)"""
+        if not dependencies_loaded:
+            return None, None, (jsonify({
+                'error': 'Service initializing. Please try again in a moment.',
+                'dependencies_loaded': False
+            }), 503)
+        
+        # Parse JSON data
+        if not request.is_json:
+            return None, None, (jsonify({'error': 'Content-Type must be application/json'}), 400)
+            
+        data = request.get_json()
+        if not data:
+            return None, None, (jsonify({'error': 'No JSON data received'}), 400)
+            
+        user_message = data.get('message', '').strip()
+        if not user_message:
+            return None, None, (jsonify({'error': 'Message is required'}), 400)
+        
+        try:
+            retrieval_weights(data)
+        except ValueError as e:
+            return None, None, (jsonify({'error': f'Invalid retrieval settings: {e}'}), 400)
+        
+        return user_message, data.get('session_id'), None
+
+    def get_or_create_session(session_id, data):
+        """Returns (session_id, session); unknown or evicted sessions get a new id"""
+        session = session_store.get(session_id) if session_id else None
+        # Create new session if doesn't exist
+        if session is None:
+            session_id, session = session_store.create()
+            log.info(f"🆕 Created new session: {session_id}", extra=SAMPLED)
+        
+        # Per-session response cache opt-out ("cache": false sticks for the session)
+        if 'cache' in data:
+            session['cache_enabled'] = bool(data['cache'])
+            session_store.set(session_id, cache_enabled=session['cache_enabled'])
+        return session_id, session
+
+    def retrieval_weights(data):
+        """Ranking for this request: the configured weights with any "retrieval" overrides.
+        
+        e.g. {"retrieval": {"recency": 0.8, "half_life_hours": 24}}; raises ValueError if invalid.
+        """
+        return vector_store.weights.override(data.get('retrieval'))
+
+    def find_context(session_id, user_message, weights=None):
+        """Returns (context, context_stats) for the prompt"""
+        # Search for relevant context, plus the latest turns of this session
+        with metrics.timer('chat_stage_seconds', stage='search'):
+            retrieved = vector_store.search_similar(session_id, user_message, Config.CONTEXT_RESULTS,
+                                                    weights)
+            recent = vector_store.get_user_conversations(session_id, Config.CONTEXT_RECENT_TURNS)
+        with metrics.timer('chat_stage_seconds', stage='context'):
+            context, context_stats = context_builder.build(user_message, retrieved, recent)
+        
+        if context:
+            log.debug(f"📚 Using {context_stats['turns_used']} conversation contexts "
+                      f"({context_stats['context_tokens']} tokens, {context_stats['tokens_saved']} saved)")
+        else:
+            log.debug("🆕 No relevant context found - starting fresh conversation")
+        return context, context_stats
+
+    def record_turn(session_id, user_message, ai_response, context, context_stats):
+        """Store a completed turn and return the response metadata"""
+        with metrics.timer('chat_stage_seconds', stage='persist'):
+            # Store conversation in memory
+            vector_store.add_conversation(session_id, user_message, ai_response)
+            message_count = session_store.add_turn(session_id)
+        
+        return {
+            'session_id': session_id,
+            'context_used': bool(context),
+            'context_tokens': context_stats['context_tokens'],
+            'tokens_saved': context_stats['tokens_saved'],
+            'conversation_count': vector_store.get_conversation_count(session_id),
+            'session_message_count': message_count,
+            'timestamp': datetime.now().isoformat()
+        }
+
     # Main chat endpoint with comprehensive error handling
     @app.route('/api/chat', methods=['POST', 'OPTIONS'])
     def handle_chat():
@@ -105,106 +234,222 @@ def create_app():
         if request.method == 'OPTIONS':
             return '', 200
             
+        started = time.perf_counter()
         try:
-            print(f"📨 Received chat request from {request.remote_addr}")
-            
-            if not dependencies_loaded:
-                return jsonify({
-                    'error': 'Service initializing. Please try again in a moment.',
-                    'dependencies_loaded': False
-                }), 503
-            
-            # Parse JSON data
-            if not request.is_json:
-                return jsonify({'error': 'Content-Type must be application/json'}), 400
-                
-            data = request.get_json()
-            if not data:
-                return jsonify({'error': 'No JSON data received'}), 400
-                
-            user_message = data.get('message', '').strip()
-            session_id = data.get('session_id')
-            
-            if not user_message:
-                return jsonify({'error': 'Message is required'}), 400
-            
-            print(f"💬 Processing message: {user_message[:100]}...")
-            
-            # Create new session if doesn't exist
-            if not session_id or session_id not in sessions:
-                session_id = str(uuid.uuid4())
-                sessions[session_id] = {
-                    'created_at': datetime.now().isoformat(),
-                    'conversation_history': [],
-                    'message_count': 0
-                }
-                print(f"🆕 Created new session: {session_id}")
-            
-            # Search for relevant context
-            context = vector_store.search_similar_conversations(session_id, user_message)
-            
-            if context:
-                context_lines = context.split('\n\n')
-                print(f"📚 Found {len(context_lines)} relevant conversation contexts")
-            else:
-                print("🆕 No relevant context found - starting fresh conversation")
+            log.info(f"📨 Received chat request from {request.remote_addr}", extra=SAMPLED)
             
-            # Generate AI response
-            print("🤖 Generating AI response...")
-            ai_response = gemini_client.generate_response(user_message, context)
-            print(f"✅ Response generated ({len(ai_response)} characters)")
+            user_message, session_id, error_response = parse_chat_request()
+            if error_response:
+                metrics.inc('chat_requests_total', endpoint='chat', status=error_response[1])
+                return error_response
             
-            # Store conversation in memory
-            vector_store.add_conversation(session_id, user_message, ai_response)
+            log.debug(f"💬 Processing message: {user_message[:100]}...")
             
-            # Update session history
-            sessions[session_id]['conversation_history'].append({
-                'user': user_message,
-                'assistant': ai_response,
-                'timestamp': datetime.now().isoformat()
-            })
-            sessions[session_id]['message_count'] += 1
+            data = request.get_json()
+            session_id, session = get_or_create_session(session_id, data)
+            context, context_stats = find_context(session_id, user_message, retrieval_weights(data))
+            
+            # Generate AI response
+            with metrics.timer('chat_stage_seconds', stage='generate'):
+                ai_response = gemini_client.generate_response(
+                    user_message, context, use_cache=session['cache_enabled'])
             
             # Prepare response
-            response_data = {
-                'response': ai_response,
-                'session_id': session_id,
-                'context_used': bool(context),
-                'conversation_count': vector_store.get_conversation_count(session_id),
-                'session_message_count': sessions[session_id]['message_count'],
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            print(f"✅ Chat request completed successfully")
+            response_data = {'response': ai_response}
+            response_data.update(record_turn(session_id, user_message, ai_response, context,
+                                             context_stats))
+            
+            elapsed = time.perf_counter() - started
+            metrics.observe('chat_request_seconds', elapsed, endpoint='chat')
+            metrics.inc('chat_requests_total', endpoint='chat', status=200)
+            log.info(f"✅ Chat request completed in {elapsed * 1000:.0f} ms "
+                     f"({len(ai_response)} characters)", extra=SAMPLED)
             return jsonify(response_data), 200
             
         except Exception as e:
-            print(f"❌ Chat endpoint error: {str(e)}")
-            traceback.print_exc()
+            metrics.inc('chat_requests_total', endpoint='chat', status=500)
+            log.exception(f"❌ Chat endpoint error: {str(e)}")
             return jsonify({
                 'error': 'Internal server error',
                 'message': 'Please try again in a moment'
             }), 500
 
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    # Streaming chat endpoint (server-sent events)
+    @app.route('/api/chat/stream', methods=['POST', 'OPTIONS'])
+    def handle_chat_stream():
+        """Stream the reply as SSE: one `start`, many `token`, then `done` (or `error`).
+        
+        The turn is only stored once the stream has finished, so a client
+        that disconnects mid-answer leaves no partial turn behind.
+        """
+        if request.method == 'OPTIONS':
+            return '', 200
+            
+        started = time.perf_counter()
+        try:
+            log.info(f"📨 Received streaming chat request from {request.remote_addr}", extra=SAMPLED)
+            
+            user_message, session_id, error_response = parse_chat_request()
+            if error_response:
+                metrics.inc('chat_requests_total', endpoint='stream', status=error_response[1])
+                return error_response
+            
+            data = request.get_json()
+            session_id, session = get_or_create_session(session_id, data)
+            context, context_stats = find_context(session_id, user_message, retrieval_weights(data))
+        except Exception as e:
+            metrics.inc('chat_requests_total', endpoint='stream', status=500)
+            log.exception(f"❌ Chat stream error: {str(e)}")
+            return jsonify({
+                'error': 'Internal server error',
+                'message': 'Please try again in a moment'
+            }), 500
+        
+        def generate():
+            yield sse('start', {'session_id': session_id, 'context_used': bool(context)})
+            try:
+                parts = []
+                use_cache = session['cache_enabled']
+                with metrics.timer('chat_stage_seconds', stage='generate'):
+                    for chunk in gemini_client.generate_response_stream(user_message, context,
+                                                                        use_cache=use_cache):
+                        if not parts:
+                            metrics.observe('chat_first_token_seconds', time.perf_counter() - started)
+                        parts.append(chunk)
+                        yield sse('token', {'text': chunk})
+                ai_response = ''.join(parts)
+                yield sse('done', record_turn(session_id, user_message, ai_response, context,
+                                              context_stats))
+                elapsed = time.perf_counter() - started
+                metrics.observe('chat_request_seconds', elapsed, endpoint='stream')
+                metrics.inc('chat_requests_total', endpoint='stream', status=200)
+                log.info(f"✅ Streamed response in {elapsed * 1000:.0f} ms "
+                         f"({len(ai_response)} characters)", extra=SAMPLED)
+            except Exception as e:
+                metrics.inc('chat_requests_total', endpoint='stream', status=500)
+                log.exception(f"❌ Chat stream error: {str(e)}")
+                yield sse('error', {'error': 'Internal server error'})
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     # Session management endpoints
     @app.route('/api/session/<session_id>', methods=['GET'])
     def get_session(session_id):
-        if session_id in sessions:
-            session_data = sessions[session_id].copy()
+        session_data = session_store.get(session_id)
+        if session_data is not None:
             # Don't send full history to client for privacy
             session_data['conversation_history'] = []
             return jsonify(session_data), 200
         else:
             return jsonify({'error': 'Session not found'}), 404
 
+    def import_auth_error(authorization):
+        """(status, message) if the request may not import history, else None"""
+        if not Config.IMPORT_TOKEN:
+            return 404, 'Import is disabled (set IMPORT_TOKEN)'
+        if not hmac.compare_digest(authorization or '', f'Bearer {Config.IMPORT_TOKEN}'):
+            return 401, 'Invalid import token'
+        if not dependencies_loaded:
+            return 503, 'Service initializing. Please try again in a moment.'
+        return None
+
+    @app.route('/api/import', methods=['POST'])
+    def import_history():
+        """Bulk-load JSONL history (see HistoryImporter), read from the body in chunks"""
+        auth_error = import_auth_error(request.headers.get('Authorization'))
+        if auth_error:
+            return jsonify({'error': auth_error[1]}), auth_error[0]
+        importer = HistoryImporter(vector_store, Config.IMPORT_CHUNK_SIZE)
+        try:
+            stats = importer.import_lines(request.stream)
+        except Exception as e:
+            log.exception(f"❌ Import failed: {str(e)}")
+            return jsonify({'error': 'Import failed', **importer.stats()}), 500
+        log.info(f"📥 Imported {stats['imported']} turns ({stats['skipped']} skipped)")
+        return jsonify(stats), 200
+
+    # Fields a history page may return (?fields=... picks a subset)
+    HISTORY_FIELDS = ('id', 'timestamp', 'user_message', 'assistant_response', 'text')
+    HISTORY_DEFAULT_FIELDS = ('id', 'timestamp', 'user_message', 'assistant_response')
+
+    @app.route('/api/session/<session_id>/history', methods=['GET'])
+    def get_session_history(session_id):
+        """Cursor-paginated history, newest first: ?limit=20&cursor=<next_cursor>&fields=a,b"""
+        if not dependencies_loaded:
+            return jsonify({'error': 'Service initializing. Please try again in a moment.'}), 503
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        cursor = request.args.get('cursor')
+        try:
+            # Opaque to clients: the (timestamp, id) of the previous page's last turn
+            before = json.loads(base64.urlsafe_b64decode(cursor.encode())) if cursor else None
+            if before is not None and not (isinstance(before, list) and len(before) == 2
+                                           and all(isinstance(part, str) for part in before)):
+                raise ValueError(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        fields = request.args.get('fields')
+        fields = tuple(f for f in fields.split(',') if f) if fields else HISTORY_DEFAULT_FIELDS
+        unknown = [f for f in fields if f not in HISTORY_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown)}",
+                            'allowed_fields': list(HISTORY_FIELDS)}), 400
+        
+        page, next_before = vector_store.get_history_page(session_id, before, limit)
+        return jsonify({
+            'session_id': session_id,
+            'items': [{f: conv.get(f) for f in fields} for conv in page],
+            'next_cursor': (base64.urlsafe_b64encode(json.dumps(list(next_before)).encode()).decode()
+                            if next_before is not None else None)
+        }), 200
+
     @app.route('/api/session/<session_id>', methods=['DELETE'])
     def delete_session(session_id):
-        if session_id in sessions:
-            del sessions[session_id]
-            return jsonify({'message': 'Session deleted'}), 200
+        existed = session_store.delete(session_id)
+        # The session's turns are tombstoned: gone from search now, from disk at compaction
+        deleted = vector_store.delete_user(session_id) if vector_store is not None else 0
+        if existed or deleted:
+            return jsonify({'message': 'Session deleted', 'conversations_deleted': deleted}), 200
         else:
             return jsonify({'error': 'Session not found'}), 404
 
+    # Scrape-time gauges for store and cache sizes
+    def store_stat(key):
+        return vector_store.get_stats().get(key) if vector_store is not None else None
+
+    metrics.gauge('vector_store_conversations', lambda: store_stat('conversations'),
+                  'Conversations held by this worker')
+    metrics.gauge('vector_store_users', lambda: store_stat('users'), 'Distinct users in the vector store')
+    metrics.gauge('vector_store_deleted_rows', lambda: store_stat('deleted_rows'),
+                  'Deleted conversations waiting for compaction')
+    metrics.gauge('vector_store_open_shards', lambda: (store_stat('shards') or {}).get('open'),
+                  'Vector store shards open in this worker')
+    metrics.gauge('write_behind_queue_depth',
+                  lambda: (vector_store.persistence_stats().get('queue_depth')
+                           if vector_store is not None else None),
+                  'Turns waiting for the write-behind flusher')
+    metrics.gauge('sessions_active', lambda: len(session_store), 'Sessions in the session store')
+    metrics.gauge('response_cache_entries',
+                  lambda: (getattr(gemini_client, 'cache_stats', lambda: None)() or {}).get('entries'),
+                  'Entries in the in-memory response cache')
+    metrics.gauge('gemini_scheduler_waiting',
+                  lambda: (getattr(gemini_client, 'scheduler_stats', lambda: None)() or {}).get('waiting'),
+                  'Gemini calls waiting for quota budget')
+    metrics.describe('chat_stage_seconds', 'Time spent per request stage')
+    metrics.describe('chat_request_seconds', 'End-to-end chat request latency')
+    metrics.describe('chat_first_token_seconds', 'Time to the first streamed token')
+    metrics.describe('chat_requests_total', 'Chat requests by endpoint and status')
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     # Global error handlers
     @app.errorhandler(404)
     def not_found(error):
@@ -218,13 +463,25 @@ def create_app():
     def internal_error(error):
         return jsonify({'error': 'Internal server error'}), 500
 
+    # The chat pipeline, shared with the asyncio front end in asgi.py
+    app.extensions['chat'] = SimpleNamespace(
+        dependencies_loaded=dependencies_loaded, gemini_client=gemini_client,
+        vector_store=vector_store, session_store=session_store,
+        get_or_create_session=get_or_create_session, retrieval_weights=retrieval_weights,
+        find_context=find_context, record_turn=record_turn, import_auth_error=import_auth_error)
+
     print("✅ Flask app configured successfully")
     return app
 
-# Create app instance for Gunicorn
-app = create_app()
+def __getattr__(name):
+    """The app instance for Gunicorn (app:app), built on first use so importing create_app is cheap"""
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
+    app = create_app()
     port = int(os.environ.get('PORT', 5000))
     print(f"🚀 Starting AI Chat with Memory Backend on port {port}")
     print(f"🌍 Environment: {os.environ.get('RAILWAY_ENVIRONMENT', 'production')}")
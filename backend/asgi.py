@@ -0,0 +1,300 @@
+"""Asyncio (ASGI) front end for the chat API.
+
+    gunicorn -c gunicorn_asgi.conf.py asgi:app        (or: uvicorn asgi:app)
+
+The two chat endpoints run on the event loop: while a turn waits on
+Gemini it holds no thread, so one worker can keep hundreds of chats in
+flight. Retrieval, context building and persistence are CPU/disk work
+and run in the default thread pool. History import (/api/import) is
+handled here too, so a large upload is parsed as it arrives instead of
+being buffered whole. Every other route (health, sessions, history,
+metrics) is served by the regular Flask app in a thread, so both modes
+expose the same API.
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+from app import CORS_ORIGINS, create_app
+from config import Config
+from utils.history_import import HistoryImporter
+from utils.log import SAMPLED, get_logger
+from utils.metrics import metrics
+
+log = get_logger('asgi')
+
+CORS_HEADERS = [
+    (b'access-control-allow-methods', b'GET, POST, PUT, DELETE, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization, X-Requested-With'),
+    (b'access-control-max-age', b'600'),
+]
+
+
+class ASGIApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.chat = flask_app.extensions['chat']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        route = (scope['method'], scope['path'].rstrip('/'))
+        if route in (('POST', '/api/chat'), ('POST', '/api/chat/stream')):
+            body = await self._read_body(receive)
+            handler = self._chat if route[1] == '/api/chat' else self._chat_stream
+            return await handler(scope, body, send)
+        if route == ('POST', '/api/import'):
+            return await self._import(scope, receive, send)
+        if route in (('OPTIONS', '/api/chat'), ('OPTIONS', '/api/chat/stream')):
+            return await self._respond(scope, send, 200, b'', b'text/plain', preflight=True)
+        body = await self._read_body(receive)
+        await self._call_flask(scope, body, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Flush write-behind turns before the worker exits
+                vector_store = self.chat.vector_store
+                if vector_store is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, vector_store.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _import(self, scope, receive, send):
+        """POST /api/import, fed from the body as it arrives rather than buffered whole"""
+        auth_error = self.chat.import_auth_error(
+            dict(scope['headers']).get(b'authorization', b'').decode('latin-1'))
+        if auth_error:
+            return await self._json(scope, send, auth_error[0], {'error': auth_error[1]})
+        importer = HistoryImporter(self.chat.vector_store, Config.IMPORT_CHUNK_SIZE)
+        loop = asyncio.get_running_loop()
+        try:
+            partial = b''
+            more = True
+            while more:
+                message = await receive()
+                more = message.get('more_body', False)
+                lines = (partial + message.get('body', b'')).split(b'\n')
+                partial = lines.pop() if more else b''
+                for line in lines:
+                    if importer.add_line(line):
+                        await loop.run_in_executor(None, importer.flush)
+            await loop.run_in_executor(None, importer.flush)
+        except Exception as e:
+            log.exception(f"❌ Import failed: {str(e)}")
+            return await self._json(scope, send, 500, {'error': 'Import failed', **importer.stats()})
+        stats = importer.stats()
+        log.info(f"📥 Imported {stats['imported']} turns ({stats['skipped']} skipped)")
+        await self._json(scope, send, 200, stats)
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _headers(self, scope, content_type, preflight=False):
+        headers = [(b'content-type', content_type)]
+        origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+        if origin in CORS_ORIGINS:
+            headers += [(b'access-control-allow-origin', origin.encode('latin-1')),
+                        (b'access-control-allow-credentials', b'true'), (b'vary', b'Origin')]
+            if preflight:
+                headers += CORS_HEADERS
+        return headers
+
+    async def _respond(self, scope, send, status, body, content_type=b'application/json',
+                       preflight=False):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': self._headers(scope, content_type, preflight)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _json(self, scope, send, status, data):
+        await self._respond(scope, send, status, json.dumps(data).encode('utf-8'))
+
+    async def _parse(self, scope, body, send):
+        """Same validation as the Flask parse_chat_request; returns (message, data) or None"""
+        if not self.chat.dependencies_loaded:
+            await self._json(scope, send, 503, {
+                'error': 'Service initializing. Please try again in a moment.',
+                'dependencies_loaded': False})
+            return None
+        content_type = dict(scope['headers']).get(b'content-type', b'')
+        if not content_type.startswith(b'application/json'):
+            await self._json(scope, send, 400, {'error': 'Content-Type must be application/json'})
+            return None
+        try:
+            data = json.loads(body or b'null')
+        except ValueError:
+            data = None
+        if not data or not isinstance(data, dict):
+            await self._json(scope, send, 400, {'error': 'No JSON data received'})
+            return None
+        user_message = str(data.get('message', '')).strip()
+        if not user_message:
+            await self._json(scope, send, 400, {'error': 'Message is required'})
+            return None
+        try:
+            self.chat.retrieval_weights(data)
+        except ValueError as e:
+            await self._json(scope, send, 400, {'error': f'Invalid retrieval settings: {e}'})
+            return None
+        return user_message, data
+
+    async def _prepare(self, user_message, data):
+        """Session lookup and retrieval, off the event loop"""
+        def prepare():
+            session_id, session = self.chat.get_or_create_session(data.get('session_id'), data)
+            context, context_stats = self.chat.find_context(session_id, user_message,
+                                                            self.chat.retrieval_weights(data))
+            return session_id, session, context, context_stats
+        return await asyncio.get_running_loop().run_in_executor(None, prepare)
+
+    async def _record(self, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, self.chat.record_turn, *args)
+
+    async def _chat(self, scope, body, send):
+        started = time.perf_counter()
+        try:
+            parsed = await self._parse(scope, body, send)
+            if parsed is None:
+                metrics.inc('chat_requests_total', endpoint='chat', status=400)
+                return
+            user_message, data = parsed
+            session_id, session, context, context_stats = await self._prepare(user_message, data)
+
+            with metrics.timer('chat_stage_seconds', stage='generate'):
+                ai_response = await self.chat.gemini_client.generate_response_async(
+                    user_message, context, use_cache=session['cache_enabled'])
+
+            response_data = {'response': ai_response}
+            response_data.update(await self._record(session_id, user_message, ai_response,
+                                                    context, context_stats))
+            elapsed = time.perf_counter() - started
+            metrics.observe('chat_request_seconds', elapsed, endpoint='chat')
+            metrics.inc('chat_requests_total', endpoint='chat', status=200)
+            log.info(f"✅ Chat request completed in {elapsed * 1000:.0f} ms "
+                     f"({len(ai_response)} characters)", extra=SAMPLED)
+            await self._json(scope, send, 200, response_data)
+        except Exception as e:
+            metrics.inc('chat_requests_total', endpoint='chat', status=500)
+            log.exception(f"❌ Chat endpoint error: {str(e)}")
+            await self._json(scope, send, 500, {'error': 'Internal server error',
+                                                'message': 'Please try again in a moment'})
+
+    async def _chat_stream(self, scope, body, send):
+        started = time.perf_counter()
+        try:
+            parsed = await self._parse(scope, body, send)
+            if parsed is None:
+                metrics.inc('chat_requests_total', endpoint='stream', status=400)
+                return
+            user_message, data = parsed
+            session_id, session, context, context_stats = await self._prepare(user_message, data)
+        except Exception as e:
+            metrics.inc('chat_requests_total', endpoint='stream', status=500)
+            log.exception(f"❌ Chat stream error: {str(e)}")
+            return await self._json(scope, send, 500, {'error': 'Internal server error',
+                                                       'message': 'Please try again in a moment'})
+
+        def sse(event, data):
+            text = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            return {'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True}
+
+        headers = self._headers(scope, b'text/event-stream') + [
+            (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send(sse('start', {'session_id': session_id, 'context_used': bool(context)}))
+        try:
+            parts = []
+            with metrics.timer('chat_stage_seconds', stage='generate'):
+                async for chunk in self.chat.gemini_client.generate_response_stream_async(
+                        user_message, context, use_cache=session['cache_enabled']):
+                    if not parts:
+                        metrics.observe('chat_first_token_seconds', time.perf_counter() - started)
+                    parts.append(chunk)
+                    await send(sse('token', {'text': chunk}))
+            ai_response = ''.join(parts)
+            await send(sse('done', await self._record(session_id, user_message, ai_response,
+                                                      context, context_stats)))
+            metrics.observe('chat_request_seconds', time.perf_counter() - started, endpoint='stream')
+            metrics.inc('chat_requests_total', endpoint='stream', status=200)
+        except Exception as e:
+            metrics.inc('chat_requests_total', endpoint='stream', status=500)
+            log.exception(f"❌ Chat stream error: {str(e)}")
+            await send(sse('error', {'error': 'Internal server error'}))
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _call_flask(self, scope, body, send):
+        """Serve a non-chat route with the Flask app in a worker thread"""
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+            'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+        def call():
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = int(status.split(' ', 1)[0])
+                started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                      for k, v in headers]
+            result = self.flask_app(environ, start_response)
+            try:
+                return started, b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        started, content = await asyncio.get_running_loop().run_in_executor(None, call)
+        await send({'type': 'http.response.start', 'status': started['status'],
+                    'headers': started['headers']})
+        await send({'type': 'http.response.body', 'body': content})
+
+
+def create_asgi_app(flask_app=None, **kwargs):
+    """ASGI app around ``flask_app``, or around ``create_app(**kwargs)`` (same dependencies and config)"""
+    return ASGIApp(flask_app if flask_app is not None else create_app(**kwargs))
+
+
+def __getattr__(name):
+    """asgi:app wraps the module-level Flask app, so both entry points share one store.
+
+    Built on first use: importing this module (tests, benchmarks) doesn't
+    open the production store.
+    """
+    if name == 'app':
+        import app as flask_module
+        globals()['app'] = ASGIApp(flask_module.app)
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,71 @@
+"""Recall vs latency of the IVF index against exact cosine search.
+
+Run from backend/:  python -m benchmarks.bench_ann --rows 50000
+
+Embeddings are drawn from a mixture of clusters (closer to real chat
+topics than uniform noise); queries are noisy copies of stored rows.
+Recall@k is the share of the exact top-k that the ANN path also returns.
+"""
+import argparse
+import time
+import numpy as np
+from utils.ann_index import IVFIndex, _normalize
+
+
+def synthetic_embeddings(rows, dim, topics, rng):
+    centers = rng.normal(size=(topics, dim))
+    labels = rng.integers(0, topics, rows)
+    return _normalize(centers[labels] + 0.6 * rng.normal(size=(rows, dim)))
+
+
+def exact_top_k(embeddings, query, k):
+    scores = embeddings @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def ann_top_k(index, embeddings, query, k):
+    rows = index.candidates(query)
+    scores = embeddings[rows] @ query
+    top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+    return rows[top[np.argsort(-scores[top])]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = synthetic_embeddings(args.rows, args.dim, args.topics, rng)
+    picks = rng.integers(0, args.rows, args.queries)
+    queries = _normalize(embeddings[picks] + 0.3 * rng.normal(size=(args.queries, args.dim)))
+
+    start = time.perf_counter()
+    index = IVFIndex(args.dim)
+    index.train(embeddings, np.arange(args.rows))
+    print(f"trained {len(index.centroids)} lists over {args.rows} rows "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    truth = [exact_top_k(embeddings, q, args.k) for q in queries]
+    exact_ms = (time.perf_counter() - start) / args.queries * 1000
+    print(f"{'path':>10} {'ms/query':>9} {'recall@' + str(args.k):>9}")
+    print(f"{'exact':>10} {exact_ms:>9.3f} {1.0:>9.3f}")
+
+    for n_probe in args.probes:
+        index.n_probe = n_probe
+        start = time.perf_counter()
+        found = [ann_top_k(index, embeddings, q, args.k) for q in queries]
+        ms = (time.perf_counter() - start) / args.queries * 1000
+        recall = np.mean([len(np.intersect1d(f, t)) / args.k for f, t in zip(found, truth)])
+        print(f"{'probe=' + str(n_probe):>10} {ms:>9.3f} {recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
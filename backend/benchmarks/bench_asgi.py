@@ -0,0 +1,142 @@
+"""/api/chat under concurrent load: ASGI (asyncio) path vs the sync Flask path.
+
+Run from backend/:  python -m benchmarks.bench_asgi --concurrency 1 10 100 300 --out asgi.json
+
+Both apps are driven in-process from one event loop with the same fake
+GeminiClient (a slow model by default, 500 ms). The "asgi" rows call the
+ASGI app directly; the "flask" rows push each request through a pool of
+--flask-threads threads, like a gunicorn sync worker with threads=2, so
+requests beyond that queue up exactly as they would in production.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.bench_chat import FakeGeminiClient
+from benchmarks.common import latency_summary, synthetic_queries, synthetic_turns, write_results
+
+
+async def asgi_post(app, path, payload):
+    body = json.dumps(payload).encode("utf-8")
+    scope = {"type": "http", "method": "POST", "path": path, "query_string": b"",
+             "headers": [(b"content-type", b"application/json")]}
+    sent = False
+    response = {}
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] = response.get("body", b"") + message.get("body", b"")
+
+    await app(scope, receive, send)
+    if response["status"] != 200:
+        raise RuntimeError(f"status {response['status']}")
+    return json.loads(response["body"])
+
+
+def flask_post(flask_app, path, payload):
+    response = flask_app.test_client().post(path, json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"status {response.status_code}")
+    return response.get_json()
+
+
+async def run(post, concurrency, requests, sessions, queries):
+    """``requests`` chats from ``concurrency`` clients spread over ``sessions`` sessions"""
+    session_ids = [None] * sessions
+    timings = []
+    errors = 0
+    next_request = 0
+
+    async def client():
+        nonlocal errors, next_request
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+            slot = i % sessions
+            start = time.perf_counter()
+            try:
+                payload = await post({"message": queries[i % len(queries)],
+                                      "session_id": session_ids[slot]})
+            except Exception:
+                errors += 1
+                continue
+            timings.append(time.perf_counter() - start)
+            session_ids[slot] = payload["session_id"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return dict(latency_summary(timings), concurrency=concurrency, errors=errors,
+                throughput_rps=round(len(timings) / wall, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100, 300])
+    parser.add_argument("--requests", type=int, default=600, help="requests per concurrency level")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, nargs="+", default=[500.0],
+                        help="fake model latency: fixed value, or lo hi for uniform random")
+    parser.add_argument("--flask-threads", type=int, default=2)
+    parser.add_argument("--servers", nargs="+", default=["asgi", "flask"], choices=["asgi", "flask"])
+    parser.add_argument("--preload", type=int, default=10000, help="turns in the store before the run")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    from app import create_app
+    from asgi import create_asgi_app
+    from benchmarks.bench_store import bulk_load, quiet
+    from utils.vector_store import VectorStore
+
+    latency = (args.latency_ms[0], args.latency_ms[-1])
+    queries = synthetic_queries(500)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        with quiet():
+            if args.preload:
+                bulk_load(VectorStore(data_dir=tmp), synthetic_turns(args.preload,
+                                                                     max(1, args.preload // 50)))
+            app = create_asgi_app(create_app(gemini_client=FakeGeminiClient(latency),
+                                             vector_store=VectorStore(data_dir=tmp)))
+        flask_pool = ThreadPoolExecutor(max_workers=args.flask_threads)
+
+        async def post_asgi(payload):
+            return await asgi_post(app, "/api/chat", payload)
+
+        async def post_flask(payload):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(flask_pool, flask_post, app.flask_app, "/api/chat", payload)
+
+        posts = {"asgi": post_asgi, "flask": post_flask}
+        # The app logs every request; keep that out of the report
+        with open(os.devnull, "w") as devnull:
+            for server in args.servers:
+                for concurrency in args.concurrency:
+                    with contextlib.redirect_stdout(devnull):
+                        result = asyncio.run(run(posts[server], concurrency, args.requests,
+                                                 args.sessions, queries))
+                    result["server"] = server
+                    print(f"{server:>5} concurrency {concurrency:>4}  p50 {result.get('p50_ms', 0):9.2f}ms  "
+                          f"p99 {result.get('p99_ms', 0):9.2f}ms  {result['throughput_rps']:8.2f} req/s  "
+                          f"errors {result['errors']}")
+                    results.append(result)
+        flask_pool.shutdown()
+        app.flask_app.extensions["chat"].vector_store.close()
+    write_results("asgi", vars(args), results, args.out)
+
+
+if __name__ == "__main__":
+    main()
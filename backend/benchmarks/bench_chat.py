@@ -0,0 +1,139 @@
+"""End-to-end /api/chat latency and throughput under concurrent load.
+
+Run from backend/:  python -m benchmarks.bench_chat --concurrency 1 8 32 --out chat.json
+
+The Flask app is served by a threaded werkzeug server on a free local
+port with a fake GeminiClient, so the numbers measure our own request
+path (session store, retrieval, context building, persistence) plus a
+controlled model latency: fixed (--latency-ms) or uniform random
+(--latency-ms lo hi).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import latency_summary, synthetic_queries, synthetic_turns, write_results
+
+
+class FakeGeminiClient:
+    """Stands in for GeminiClient: sleeps for the configured latency, echoes a reply"""
+
+    def __init__(self, latency_ms=(50, 50)):
+        self.latency_ms = latency_ms
+
+    def _sleep(self):
+        time.sleep(random.uniform(*self.latency_ms) / 1000)
+
+    def generate_response(self, prompt, context="", use_cache=True):
+        self._sleep()
+        return f"Fake answer to '{prompt}' using {len(context)} characters of context."
+
+    def generate_response_stream(self, prompt, context="", use_cache=True):
+        self._sleep()
+        # Keep the separators so the chunks join back into the full response
+        yield from re.findall(r'\S+\s*', self.generate_response(prompt, context))
+
+    async def generate_response_async(self, prompt, context="", use_cache=True):
+        await asyncio.sleep(random.uniform(*self.latency_ms) / 1000)
+        return f"Fake answer to '{prompt}' using {len(context)} characters of context."
+
+    async def generate_response_stream_async(self, prompt, context="", use_cache=True):
+        for chunk in re.findall(r'\S+\s*', await self.generate_response_async(prompt, context)):
+            yield chunk
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def post_chat(url, message, session_id):
+    body = json.dumps({"message": message, "session_id": session_id}).encode("utf-8")
+    request = urllib.request.Request(url, body, {"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        payload = json.load(response)
+    return time.perf_counter() - start, payload
+
+
+def run(url, concurrency, requests, sessions, queries):
+    """``requests`` chats from ``concurrency`` threads spread over ``sessions`` sessions"""
+    session_ids = [None] * sessions
+    lock = threading.Lock()
+    errors = 0
+
+    def one(i):
+        nonlocal errors
+        slot = i % sessions
+        try:
+            elapsed, payload = post_chat(url, queries[i % len(queries)], session_ids[slot])
+        except Exception:
+            with lock:
+                errors += 1
+            return None
+        session_ids[slot] = payload["session_id"]
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = [t for t in pool.map(one, range(requests)) if t is not None]
+    wall = time.perf_counter() - start
+    return dict(latency_summary(timings), concurrency=concurrency, errors=errors,
+                throughput_rps=round(len(timings) / wall, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400, help="requests per concurrency level")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, nargs="+", default=[50.0],
+                        help="fake model latency: fixed value, or lo hi for uniform random")
+    parser.add_argument("--preload", type=int, default=10000, help="turns in the store before the run")
+    parser.add_argument("--mode", default="append", choices=["append", "sqlite", "json"])
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    from app import create_app
+    from benchmarks.bench_store import bulk_load, quiet
+    from utils.vector_store import VectorStore
+
+    latency = (args.latency_ms[0], args.latency_ms[-1])
+    queries = synthetic_queries(500)
+    with tempfile.TemporaryDirectory() as tmp:
+        with quiet():
+            if args.preload:
+                bulk_load(VectorStore(data_dir=tmp, storage_mode=args.mode),
+                          synthetic_turns(args.preload, max(1, args.preload // 50)))
+            app = create_app(gemini_client=FakeGeminiClient(latency),
+                             vector_store=VectorStore(data_dir=tmp, storage_mode=args.mode))
+        server = serve(app)
+        url = f"http://127.0.0.1:{server.server_port}/api/chat"
+        results = []
+        # The app logs every request; keep that out of the report
+        with open(os.devnull, "w") as devnull:
+            for concurrency in args.concurrency:
+                with contextlib.redirect_stdout(devnull):
+                    result = run(url, concurrency, args.requests, args.sessions, queries)
+                print(f"concurrency {concurrency:>4}  p50 {result.get('p50_ms', 0):8.2f}ms  "
+                      f"p95 {result.get('p95_ms', 0):8.2f}ms  p99 {result.get('p99_ms', 0):8.2f}ms  "
+                      f"{result['throughput_rps']:8.2f} req/s  errors {result['errors']}")
+                results.append(result)
+        server.shutdown()
+    write_results("chat", vars(args), results, args.out)
+
+
+if __name__ == "__main__":
+    main()
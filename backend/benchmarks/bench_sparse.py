@@ -0,0 +1,72 @@
+"""Memory and scoring time of sparse CSR embeddings vs the dense path.
+
+Run from backend/:  python -m benchmarks.bench_sparse --rows 100000
+
+Texts are synthetic chat turns drawn from a word list, embedded with the
+hashing embedder; both layouts hold the same vectors.
+"""
+import argparse
+import time
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from utils.embedders import HashingEmbedder
+from utils.embedding_buffer import EmbeddingBuffer, SparseEmbeddings
+
+WORDS = ("python flask memory vector search cats dogs travel music recipe "
+         "budget deadline weather football movie garden coffee running "
+         "database deploy server error quota model prompt answer question").split()
+
+
+def synthetic_texts(rows, rng):
+    lengths = rng.integers(8, 40, rows)
+    return [" ".join(rng.choice(WORDS, n)) + f" turn{i}" for i, n in enumerate(lengths)]
+
+
+def time_scoring(matrix, queries, rows_per_user, rng):
+    timings = []
+    for query in queries:
+        rows = np.sort(rng.choice(matrix.shape[0], rows_per_user, replace=False))
+        start = time.perf_counter()
+        cosine_similarity(query, matrix[rows])
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--user-rows", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embedder = HashingEmbedder(args.dim)
+    texts = synthetic_texts(args.rows, rng)
+
+    dense = EmbeddingBuffer(args.dim, dtype=np.float32)
+    sparse = SparseEmbeddings("unused.npz", args.dim)
+    dense_s = sparse_s = 0.0
+    for start in range(0, args.rows, args.batch):
+        block = embedder.embed_sparse(texts[start:start + args.batch])
+        t = time.perf_counter()
+        dense.extend(block.toarray())
+        dense_s += time.perf_counter() - t
+        t = time.perf_counter()
+        sparse.extend(block)
+        sparse_s += time.perf_counter() - t
+
+    queries = [embedder.embed_sparse([" ".join(rng.choice(WORDS, 6))]) for _ in range(args.queries)]
+    dense_ms = time_scoring(dense.rows, [q.toarray() for q in queries], args.user_rows, rng)
+    sparse_ms = time_scoring(sparse.rows, queries, args.user_rows, rng)
+
+    d, s = dense.stats(), sparse.stats()
+    print(f"rows={args.rows} dim={args.dim} avg nnz/row={s['nnz'] / args.rows:.1f}")
+    print(f"{'layout':>8} {'MB used':>9} {'append s':>9} {'score ms':>9}")
+    print(f"{'dense':>8} {d['bytes_used'] / 1e6:>9.1f} {dense_s:>9.2f} {dense_ms:>9.3f}")
+    print(f"{'sparse':>8} {s['bytes_used'] / 1e6:>9.1f} {sparse_s:>9.2f} {sparse_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
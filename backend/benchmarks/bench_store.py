@@ -0,0 +1,107 @@
+"""Add, search, startup and memory of VectorStore on synthetic corpora.
+
+Run from backend/:  python -m benchmarks.bench_store --sizes 1000 10000 100000 --out store.json
+
+For each storage mode and corpus size a store is bulk-loaded with
+synthetic turns over many users, then reopened (startup), searched and
+appended to one turn at a time. Startup is timed twice: parsing every
+row from storage (snapshots off) and warm from the snapshot written when
+the bulk load closed the store. The "json" mode rewrites every file on
+each add, so keep --adds small if you include it at large sizes.
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.common import (latency_summary, rss_mb, synthetic_queries, synthetic_turns,
+                               write_results)
+from config import Config
+from utils.vector_store import VectorStore
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the store's per-turn prints so they don't dominate the timings' output"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bulk_load(store, turns, batch_size=1000):
+    texts = [conversation["text"] for conversation, _ in turns]
+    store.embedder.fit(texts[:5000])
+    for start in range(0, len(turns), batch_size):
+        batch = turns[start:start + batch_size]
+        embeddings = store.embedder.embed(texts[start:start + batch_size])
+        store._persist([(c, m, e) for (c, m), e in zip(batch, embeddings)])
+    store.close()
+
+
+def run(mode, size, users, queries, adds):
+    result = {"mode": mode, "rows": size, "users": users}
+    turns = synthetic_turns(size, users)
+    with tempfile.TemporaryDirectory() as tmp, quiet():
+        start = time.perf_counter()
+        bulk_load(VectorStore(data_dir=tmp, storage_mode=mode), turns)
+        result["bulk_load_s"] = round(time.perf_counter() - start, 3)
+
+        Config.SNAPSHOT = False
+        start = time.perf_counter()
+        VectorStore(data_dir=tmp, storage_mode=mode).close()
+        result["cold_startup_s"] = round(time.perf_counter() - start, 4)
+        Config.SNAPSHOT = True
+
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        store = VectorStore(data_dir=tmp, storage_mode=mode)
+        result["startup_s"] = round(time.perf_counter() - start, 4)
+        # The first search pays for lazy imports and restoring the embedder state
+        start = time.perf_counter()
+        store.search_similar_conversations("user-0", queries[0])
+        result["first_search_s"] = round(time.perf_counter() - start, 4)
+        result["rss_delta_mb"] = round(rss_mb() - rss_before, 1)
+        result["embeddings"] = store.get_stats()["embeddings"]
+
+        rng = np.random.default_rng(2)
+        timings = []
+        for query in queries:
+            user_id = f"user-{rng.integers(users)}"
+            start = time.perf_counter()
+            store.search_similar_conversations(user_id, query)
+            timings.append(time.perf_counter() - start)
+        result["search"] = latency_summary(timings)
+
+        timings = []
+        for i in range(adds):
+            start = time.perf_counter()
+            store.add_conversation(f"user-{rng.integers(users)}", queries[i % len(queries)],
+                                   f"benchmark reply {i}")
+            timings.append(time.perf_counter() - start)
+        result["add"] = latency_summary(timings)
+        store.close()
+    print(f"{mode:>7} {size:>8} rows  startup {result['startup_s']:.3f}s "
+          f"(cold {result['cold_startup_s']:.3f}s)  "
+          f"search p50 {result['search']['p50_ms']:.2f}ms  add p50 {result['add']['p50_ms']:.2f}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--modes", nargs="+", default=["append", "sqlite"],
+                        choices=["append", "sqlite", "json"])
+    parser.add_argument("--turns-per-user", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--adds", type=int, default=200)
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    queries = synthetic_queries(args.queries)
+    results = [run(mode, size, max(1, size // args.turns_per_user), queries, args.adds)
+               for mode in args.modes for size in args.sizes]
+    write_results("store", vars(args), results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Search latency for one user as the number of other users grows.
+
+Run from backend/:  python -m benchmarks.bench_user_partition
+
+With the per-user index, latency should stay roughly flat across rows
+because only the target user's embeddings are scored.
+"""
+import argparse
+import tempfile
+import time
+import uuid
+import numpy as np
+from utils.vector_store import VectorStore
+
+TARGET_USER = "target-user"
+
+
+def populate(store, target_turns, other_users, turns_per_user, rng):
+    """Fill a store in memory with random embeddings (no disk writes)"""
+    conversations, metadata = [], []
+    owners = [TARGET_USER] * target_turns
+    for u in range(other_users):
+        owners.extend([f"user-{u}"] * turns_per_user)
+    rng.shuffle(owners)
+    for i, user_id in enumerate(owners):
+        conversation_id = str(uuid.uuid4())
+        text = f"User: message {i}\nAssistant: reply {i}"
+        conversations.append({"id": conversation_id, "user_id": user_id,
+                              "timestamp": "", "text": text})
+        metadata.append({"id": conversation_id, "user_id": user_id, "timestamp": ""})
+    store.conversations = conversations
+    store.metadata = metadata
+    store.embeddings = rng.random((len(owners), store.dim))
+    store._rebuild_user_index()
+    store.embedder.fit([c["text"] for c in conversations[:1000]])
+
+
+def time_search(store, repeats):
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        store.search_similar_conversations(TARGET_USER, f"message {i}")
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--target-turns", type=int, default=200)
+    parser.add_argument("--turns-per-user", type=int, default=10)
+    parser.add_argument("--other-users", type=int, nargs="+", default=[0, 100, 1000, 5000])
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'other users':>12} {'total rows':>11} {'median ms':>10}")
+    for other_users in args.other_users:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = VectorStore(data_dir=tmp)
+            populate(store, args.target_turns, other_users, args.turns_per_user, rng)
+            ms = time_search(store, args.repeats)
+            print(f"{other_users:>12} {len(store.conversations):>11} {ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
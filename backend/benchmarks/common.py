@@ -0,0 +1,103 @@
+"""Shared helpers for the benchmark scripts: synthetic corpora, stats, JSON output."""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+
+TOPICS = {
+    "python": "python list dict decorator generator class import module function loop",
+    "cooking": "pasta sauce oven recipe garlic onion boil bake salt flour",
+    "travel": "flight hotel passport train museum beach booking city map luggage",
+    "fitness": "running squat protein stretch cardio marathon gym rest sleep weights",
+    "music": "guitar chord piano melody song album rhythm concert band tempo",
+    "finance": "budget savings invest stock bond tax loan interest retirement fund",
+}
+FILLER = "the a and to of in it is that for you with this how what can do i my".split()
+
+
+def synthetic_turns(rows, users, seed=0, start=None):
+    """``rows`` deterministic (conversation, metadata) pairs spread over ``users`` users.
+
+    Each user favours two topics so similarity search has real structure;
+    timestamps increase monotonically like a live store's.
+    """
+    rng = np.random.default_rng(seed)
+    topic_names = list(TOPICS)
+    user_topics = [rng.choice(len(topic_names), 2, replace=False) for _ in range(users)]
+    start = start or datetime(2024, 1, 1)
+    turns = []
+    for i in range(rows):
+        u = int(rng.integers(users))
+        topic = TOPICS[topic_names[user_topics[u][int(rng.integers(2))]]].split()
+        question = " ".join(rng.choice(topic, 4).tolist() + rng.choice(FILLER, 3).tolist())
+        answer = " ".join(rng.choice(topic + FILLER, int(rng.integers(15, 60))).tolist())
+        conversation_id = str(uuid.UUID(int=int(rng.integers(2 ** 62)) << 64 | i))
+        timestamp = (start + timedelta(seconds=30 * i)).isoformat()
+        conversation = {"id": conversation_id, "user_id": f"user-{u}", "timestamp": timestamp,
+                        "user_message": question, "assistant_response": answer,
+                        "text": f"User: {question}\nAssistant: {answer}"}
+        meta = {"id": conversation_id, "user_id": f"user-{u}", "timestamp": timestamp}
+        turns.append((conversation, meta))
+    return turns
+
+
+def synthetic_queries(count, seed=1):
+    rng = np.random.default_rng(seed)
+    words = " ".join(TOPICS.values()).split()
+    return [" ".join(rng.choice(words, 5).tolist()) for _ in range(count)]
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean in milliseconds for a list of durations in seconds"""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_results(name, params, results, out=None):
+    """Print the results and, with ``out``, write them as JSON tagged with the commit"""
+    report = {
+        "benchmark": name,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {out}")
+    return report
@@ -0,0 +1,62 @@
+"""Compare two benchmark JSON files (e.g. from two commits).
+
+Run from backend/:  python -m benchmarks.compare before.json after.json [--threshold 10]
+
+Every latency/time metric present in both files is listed with its
+relative change; changes worse than --threshold percent are flagged and
+make the exit status non-zero, so this can gate CI.
+"""
+import argparse
+import json
+import sys
+
+# Metrics where bigger is better; everything else numeric is a cost
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+def _key(result):
+    return tuple((k, result[k]) for k in ("mode", "rows", "concurrency") if k in result)
+
+
+def _flatten(result, prefix=""):
+    for name, value in result.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and (
+                name.endswith(("_ms", "_s", "_mb", "_rps"))):
+            yield prefix + name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+
+    baseline = {_key(r): dict(_flatten(r)) for r in before["results"]}
+    regressions = 0
+    for result in after["results"]:
+        old = baseline.get(_key(result))
+        if old is None:
+            continue
+        label = " ".join(f"{k}={v}" for k, v in _key(result))
+        for metric, value in _flatten(result):
+            if metric not in old or not old[metric]:
+                continue
+            change = (value - old[metric]) / old[metric] * 100
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            flag = "  REGRESSION" if worse > args.threshold else ""
+            regressions += bool(flag)
+            print(f"{label:<28} {metric:<22} {old[metric]:>12.3f} {value:>12.3f} {change:>+8.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""Apply the retention limits and compact the store once, in the foreground.
+
+The server does the same in the background every MAINTENANCE_INTERVAL
+seconds; run this after lowering a limit, or with the server stopped:
+    RETENTION_MAX_AGE_DAYS=90 python compact.py
+"""
+import time
+from utils.sharded_store import create_vector_store
+
+if __name__ == "__main__":
+    start = time.time()
+    store = create_vector_store()
+    deleted = store.apply_retention()
+    reclaimed = store.compact()
+    store.close()
+    print(f"Retention deleted {deleted}, compaction reclaimed {reclaimed} conversations "
+          f"in {time.time() - start:.1f}s")
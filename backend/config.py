@@ -6,4 +6,111 @@ load_dotenv()
 class Config:
     GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
-    CHROMA_DB_PATH = "./chroma_db"
\ No newline at end of file
+    CHROMA_DB_PATH = "./chroma_db"
+
+    # Gemini model probe result is cached on disk and reused for this many seconds; failed
+    # probes (demo mode, demoted models) only for MODEL_RETRY_BACKOFF, then they're tried again
+    MODEL_CACHE_FILE = os.getenv('MODEL_CACHE_FILE', os.path.join(CHROMA_DB_PATH, "model_cache.json"))
+    MODEL_PROBE_TTL = int(os.getenv('MODEL_PROBE_TTL', '21600'))
+    MODEL_RETRY_BACKOFF = int(os.getenv('MODEL_RETRY_BACKOFF', '60'))
+
+    # LRU+TTL cache of model responses; set RESPONSE_CACHE_DISK_PATH for a shared on-disk tier
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+    RESPONSE_CACHE_DISK_PATH = os.getenv('RESPONSE_CACHE_DISK_PATH', '')
+
+    # Client-side Gemini budget: calls queue briefly instead of hitting 429s
+    GEMINI_RPM = int(os.getenv('GEMINI_RPM', '15'))
+    GEMINI_TPM = int(os.getenv('GEMINI_TPM', '1000000'))
+    GEMINI_MAX_QUEUE_WAIT = float(os.getenv('GEMINI_MAX_QUEUE_WAIT', '10'))
+    GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '2'))
+    GEMINI_EXPECTED_OUTPUT_TOKENS = int(os.getenv('GEMINI_EXPECTED_OUTPUT_TOKENS', '512'))
+    # Give up on a Gemini call after this many seconds and answer with a fallback
+    # (streams: if opening one, or any gap between two chunks, takes longer)
+    GEMINI_CALL_DEADLINE = float(os.getenv('GEMINI_CALL_DEADLINE', '30'))
+    # Hedging: resend to the next model if the current one is slower than its p95
+    GEMINI_HEDGE = os.getenv('GEMINI_HEDGE', 'true').lower() == 'true'
+    GEMINI_HEDGE_DELAY = float(os.getenv('GEMINI_HEDGE_DELAY', '5'))
+    GEMINI_HEDGE_MIN_DELAY = float(os.getenv('GEMINI_HEDGE_MIN_DELAY', '0.5'))
+    GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', '20'))
+
+    # Memory context per prompt: token budget, session turns always considered,
+    # tokens kept of each past reply, similar turns retrieved
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '800'))
+    CONTEXT_RECENT_TURNS = int(os.getenv('CONTEXT_RECENT_TURNS', '2'))
+    CONTEXT_REPLY_TOKENS = int(os.getenv('CONTEXT_REPLY_TOKENS', '120'))
+    CONTEXT_RESULTS = int(os.getenv('CONTEXT_RESULTS', '3'))
+
+    # Chat sessions: "memory" (per worker) or "sqlite" (shared by workers, survives recycles).
+    # Sessions past SESSION_MAX/SESSION_MAX_BYTES are only evicted from the cache; their turns stay
+    # (left to the RETENTION_* limits). Set SESSION_EXPIRY_DELETES_TURNS to also delete the turns of
+    # sessions that expire after SESSION_IDLE_TTL, on a background thread
+    SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+    SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join(CHROMA_DB_PATH, "sessions.db"))
+    SESSION_MAX = int(os.getenv('SESSION_MAX', '10000'))
+    SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', '86400'))
+    SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', str(16 * 1024 * 1024)))
+    SESSION_EXPIRY_DELETES_TURNS = os.getenv('SESSION_EXPIRY_DELETES_TURNS', 'false').lower() == 'true'
+
+    # Logging: LOG_LEVEL for everything; per-request INFO lines are kept at LOG_SAMPLE_RATE
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+
+    # Vector store persistence: "append" (segment log), "sqlite" (indexed, shared by workers)
+    # or "json" (legacy full rewrite)
+    VECTOR_STORE_MODE = os.getenv('VECTOR_STORE_MODE', 'append')
+    EMBEDDING_DIM = 384
+    # Users hash-partitioned over this many independent stores under shards-<N>/ (1 = one store);
+    # a shard is opened on first use and closed after SHARD_IDLE_TTL idle seconds (0 = never)
+    VECTOR_STORE_SHARDS = int(os.getenv('VECTOR_STORE_SHARDS', '1'))
+    SHARD_IDLE_TTL = float(os.getenv('SHARD_IDLE_TTL', '900'))
+    # "hashing" (stateless, no fit step) or "tfidf" (persisted vocabulary fitted on stored turns)
+    EMBEDDER = os.getenv('EMBEDDER', 'hashing')
+    # TF-IDF is refitted and the store re-embedded (on a background thread) once the corpus grows
+    # this many times over, or once new turns have this much larger a share of out-of-vocabulary
+    # words than the fit corpus
+    TFIDF_REFIT_GROWTH = float(os.getenv('TFIDF_REFIT_GROWTH', '2'))
+    TFIDF_REFIT_OOV = float(os.getenv('TFIDF_REFIT_OOV', '0.2'))
+    # "dense" (memory-mapped float32) or "sparse" (CSR, append mode only)
+    EMBEDDING_FORMAT = os.getenv('EMBEDDING_FORMAT', 'dense')
+    # Roll the active log into an immutable segment after this many turns
+    LOG_ROLL_THRESHOLD = int(os.getenv('LOG_ROLL_THRESHOLD', '1000'))
+    # Merge segments into one once there are more than this many
+    MAX_SEGMENTS = int(os.getenv('MAX_SEGMENTS', '8'))
+    # Per-user IVF index for users with at least this many turns (0 disables)
+    ANN_MIN_ROWS = int(os.getenv('ANN_MIN_ROWS', '10000'))
+    # Number of closest IVF lists scanned per query
+    ANN_PROBE = int(os.getenv('ANN_PROBE', '8'))
+    # Write-behind persistence: queue turns in memory, flush from a background thread
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'false').lower() == 'true'
+    WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '1.0'))
+    WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', '64'))
+    # fsync the log every N turns (0 = leave flushing to the OS)
+    FSYNC_EVERY = int(os.getenv('FSYNC_EVERY', '0'))
+    # Retention: keep at most N turns per user / in total, and none older than N days (0 = no limit)
+    RETENTION_MAX_TURNS_PER_USER = int(os.getenv('RETENTION_MAX_TURNS_PER_USER', '0'))
+    RETENTION_MAX_TURNS = int(os.getenv('RETENTION_MAX_TURNS', '0'))
+    RETENTION_MAX_AGE_DAYS = float(os.getenv('RETENTION_MAX_AGE_DAYS', '0'))
+    # Compact the store once this fraction of its rows are deleted
+    COMPACT_DEAD_RATIO = float(os.getenv('COMPACT_DEAD_RATIO', '0.2'))
+    # Seconds between background retention/compaction passes (0 disables the thread)
+    MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '600'))
+    # Binary snapshot (snapshot.bin) the store warm-starts from instead of parsing every row:
+    # rewritten in the background every SNAPSHOT_INTERVAL seconds when rows changed, and on close
+    SNAPSHOT = os.getenv('SNAPSHOT', 'true').lower() == 'true'
+    SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '300'))
+    # Retrieval ranking: score = (similarity*cosine + keyword*bm25) * recency decay;
+    # turns at or below the threshold are left out (each can be overridden per /api/chat request)
+    RETRIEVAL_SIMILARITY_WEIGHT = float(os.getenv('RETRIEVAL_SIMILARITY_WEIGHT', '1.0'))
+    RETRIEVAL_KEYWORD_WEIGHT = float(os.getenv('RETRIEVAL_KEYWORD_WEIGHT', '0.3'))
+    RETRIEVAL_RECENCY_WEIGHT = float(os.getenv('RETRIEVAL_RECENCY_WEIGHT', '0.3'))
+    RETRIEVAL_HALF_LIFE_HOURS = float(os.getenv('RETRIEVAL_HALF_LIFE_HOURS', '168'))
+    RETRIEVAL_THRESHOLD = float(os.getenv('RETRIEVAL_THRESHOLD', '0.1'))
+    # Users whose keyword/recency features are kept in memory (least recently searched go first)
+    RETRIEVAL_FEATURE_USERS = int(os.getenv('RETRIEVAL_FEATURE_USERS', '1000'))
+    # Bulk history import (POST /api/import, import_history.py): turns per add_conversations
+    # call, and the bearer token the endpoint requires (unset = endpoint disabled)
+    IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '1000'))
+    IMPORT_TOKEN = os.getenv('IMPORT_TOKEN', '')
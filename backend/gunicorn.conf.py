@@ -2,7 +2,9 @@ import os
 
 # Railway-specific Gunicorn configuration
 bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
-workers = 1
+# The vector store's embeddings are memory-mapped and its log is shared
+# through the data directory, so extra workers share the page cache.
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
 worker_class = "sync"
 threads = 2
 timeout = 120
@@ -19,4 +21,12 @@ proc_name = "ai-chat-memory"
 # Server mechanics
 preload_app = True
 max_requests = 1000
-max_requests_jitter = 100
\ No newline at end of file
+max_requests_jitter = 100
+
+
+def worker_exit(server, worker):
+    """Flush write-behind turns before the worker goes away (recycle or shutdown)"""
+    from app import app
+    vector_store = app.extensions.get('vector_store')
+    if vector_store is not None:
+        vector_store.close()
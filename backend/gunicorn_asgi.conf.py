@@ -0,0 +1,24 @@
+import os
+
+# Async serving mode:  gunicorn -c gunicorn_asgi.conf.py asgi:app
+# Each uvicorn worker runs one event loop; a chat waiting on Gemini holds
+# no thread, so a worker keeps many chats in flight. Vector store shutdown
+# is handled by the ASGI lifespan in asgi.py.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+keepalive = 5
+
+# Logging
+loglevel = "info"
+accesslog = "-"
+errorlog = "-"
+
+# Process naming
+proc_name = "ai-chat-memory-asgi"
+
+# Server mechanics
+preload_app = True
+max_requests = 1000
+max_requests_jitter = 100
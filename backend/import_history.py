@@ -0,0 +1,27 @@
+"""Bulk-load chat history from a JSONL file, one turn per line:
+    {"user_id": "...", "message": "...", "response": "...", "timestamp": "2024-05-01T12:00:00"}
+
+    python import_history.py history.jsonl
+
+The file is read IMPORT_CHUNK_SIZE turns at a time, so memory stays flat
+for any file size. With EMBEDDER=tfidf the store refits its vocabulary
+as the imported corpus grows.
+"""
+import sys
+import time
+from config import Config
+from utils.history_import import HistoryImporter
+from utils.sharded_store import create_vector_store
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python import_history.py history.jsonl")
+        sys.exit(2)
+    start = time.time()
+    store = create_vector_store()
+    with open(sys.argv[1], 'rb') as f:
+        stats = HistoryImporter(store, Config.IMPORT_CHUNK_SIZE).import_lines(f)
+    store.close()
+    print(f"Imported {stats['imported']} turns ({stats['skipped']} skipped) in {time.time() - start:.1f}s")
+    for error in stats['errors']:
+        print(f"  {error}")
@@ -0,0 +1,126 @@
+"""Move the vector store to a different shard count. Stop the server first:
+
+    python rebalance_shards.py --to 8                (from VECTOR_STORE_SHARDS)
+    python rebalance_shards.py --from 8 --to 16
+    python rebalance_shards.py --from 8 --to 1       (back to a plain store)
+
+Live turns of each source shard are spooled to one JSONL file per
+destination shard, then every destination is built from its spool with
+add_conversations, so only one shard is loaded at a time. Ids and
+timestamps are kept; deleted turns are left behind. The new layout is
+built in shards-<N>.tmp and renamed into place at the end (moving to
+1 shard puts the files straight into the data directory), and the
+source is not modified: set VECTOR_STORE_SHARDS=<N>, restart, then
+remove the old directory.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from config import Config
+from utils.sharded_store import existing_layouts, shard_dir, shard_of, shard_root
+from utils.vector_store import VectorStore
+
+
+def source_dirs(data_dir, shards):
+    if shards == 1:
+        return [data_dir]
+    return [shard_dir(data_dir, shards, shard) for shard in range(shards)]
+
+
+def spool(data_dir, shards, target, spool_dir):
+    """Write every live turn to spool_dir/<destination shard>.jsonl; returns the count"""
+    files = [open(os.path.join(spool_dir, f"{shard:03d}.jsonl"), 'w', encoding='utf-8')
+             for shard in range(target)]
+    moved = 0
+    try:
+        for path in source_dirs(data_dir, shards):
+            if not os.path.isdir(path):
+                continue
+            store = VectorStore(path)
+            for user_id, rows in store.user_index.items():
+                out = files[shard_of(user_id, target)]
+                for row in rows:
+                    out.write(json.dumps(store.conversations[row], ensure_ascii=False) + "\n")
+                moved += len(rows)
+            store.close()
+            print(f"Spooled {path}")
+    finally:
+        for f in files:
+            f.close()
+    return moved
+
+
+def build(spool_file, path):
+    """Load one destination shard from its spool; returns the count"""
+    store = VectorStore(path)
+    chunk = []
+    with open(spool_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            conversation = json.loads(line)
+            chunk.append({"id": conversation["id"], "user_id": conversation["user_id"],
+                          "message": conversation["user_message"],
+                          "response": conversation["assistant_response"],
+                          "timestamp": conversation["timestamp"]})
+            if len(chunk) >= Config.IMPORT_CHUNK_SIZE:
+                store.add_conversations(chunk)
+                chunk = []
+    store.add_conversations(chunk)
+    # The first chunk fitted the vocabulary; refit it on the whole shard
+    if store.embedder.stateful and store.conversations:
+        store.reembed()
+    count = store.get_conversation_count()
+    store.close()
+    return count
+
+
+def place(building, data_dir, target):
+    """Move the finished layout into place: shards-<N>, or data_dir itself for 1 shard"""
+    if target > 1:
+        os.rename(building, shard_root(data_dir, target))
+        return
+    built = os.path.join(building, "000")
+    for name in os.listdir(built):
+        os.rename(os.path.join(built, name), os.path.join(data_dir, name))
+    shutil.rmtree(building)
+
+
+def rebalance(data_dir, source, target):
+    """Rebuild the store under ``data_dir`` with ``target`` shards; returns the count moved"""
+    if target < 1 or target == source:
+        sys.exit("--to must be at least 1 and differ from --from")
+    if target > 1 and os.path.exists(shard_root(data_dir, target)):
+        sys.exit(f"{shard_root(data_dir, target)} already exists")
+    if target == 1 and 1 in existing_layouts(data_dir):
+        sys.exit(f"{data_dir} already holds an unsharded store")
+
+    building = shard_root(data_dir, target) + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    spool_dir = tempfile.mkdtemp(prefix="rebalance-", dir=data_dir)
+    try:
+        moved = spool(data_dir, source, target, spool_dir)
+        built = 0
+        for shard in range(target):
+            built += build(os.path.join(spool_dir, f"{shard:03d}.jsonl"), os.path.join(building, f"{shard:03d}"))
+        if built != moved:
+            sys.exit(f"Spooled {moved} turns but the new shards hold {built}; {building} kept for inspection")
+        place(building, data_dir, target)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebalance the vector store to a new shard count")
+    parser.add_argument("--from", dest="source", type=int, default=Config.VECTOR_STORE_SHARDS)
+    parser.add_argument("--to", dest="target", type=int, required=True)
+    args = parser.parse_args()
+
+    start = time.time()
+    moved = rebalance(Config.CHROMA_DB_PATH, args.source, args.target)
+    print(f"Moved {moved} conversations from {args.source} to {args.target} shards "
+          f"in {time.time() - start:.1f}s")
+    print(f"Set VECTOR_STORE_SHARDS={args.target} and restart; the old layout can then be removed")
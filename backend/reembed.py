@@ -0,0 +1,13 @@
+"""Rebuild all stored embeddings with the configured embedder.
+
+Run after changing EMBEDDER (or to refit the TF-IDF vocabulary):
+    EMBEDDER=hashing python reembed.py
+"""
+import time
+from utils.sharded_store import create_vector_store
+
+if __name__ == "__main__":
+    start = time.time()
+    store = create_vector_store()
+    store.reembed()
+    print(f"Done in {time.time() - start:.1f}s")
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from utils.vector_store import VectorStore  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def quiet_background(monkeypatch):
+    """No background maintenance, snapshots or write-behind unless a test asks for them"""
+    monkeypatch.setattr(Config, "MAINTENANCE_INTERVAL", 0)
+    monkeypatch.setattr(Config, "SNAPSHOT_INTERVAL", 0)
+    monkeypatch.setattr(Config, "WRITE_BEHIND", False)
+
+
+@pytest.fixture
+def make_turns():
+    def make(n, users=3, tag="turn"):
+        return [{"user_id": f"u{i % users}", "message": f"{tag} question {i} about topic {i % 5}",
+                 "response": f"answer {i}"} for i in range(n)]
+    return make
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """open_store(mode) -> a VectorStore in tmp_path; every store opened is closed afterwards"""
+    stores = []
+
+    def open_(mode="append", embedder="hashing", data_dir=None):
+        store = VectorStore(str(data_dir or tmp_path / "store"), mode, embedder)
+        stores.append(store)
+        return store
+    yield open_
+    for store in stores:
+        store.close()
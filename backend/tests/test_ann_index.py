@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from config import Config
+from utils.ann_index import IVFIndex
+
+DIM = 32
+
+
+def clustered(n, clusters=20, seed=0):
+    """Unit vectors around ``clusters`` random centres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, DIM))
+    vectors = centres[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, DIM))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def top_k(vectors, row_ids, query, k):
+    scores = vectors @ query
+    return set(np.asarray(row_ids)[np.argsort(-scores)[:k]])
+
+
+def test_candidates_are_a_fraction_of_the_rows():
+    vectors = clustered(2000)
+    row_ids = np.arange(2000) * 3
+    index = IVFIndex(DIM, n_probe=4)
+    index.train(vectors, row_ids)
+    assert len(index) == 2000 and index.trained_rows == 2000 and index.max_row == 5997
+    assert len(index.centroids) == int(np.sqrt(2000))
+    candidates = index.candidates(vectors[0])
+    assert 0 < len(candidates) < 2000 // 2
+    assert set(candidates) <= set(row_ids) and row_ids[0] in candidates
+
+
+def test_recall_against_exact_search():
+    vectors = clustered(3000, seed=1)
+    queries = clustered(50, seed=2)
+    index = IVFIndex(DIM, n_probe=8)
+    index.train(vectors, np.arange(3000))
+    recall = []
+    for query in queries:
+        exact = top_k(vectors, np.arange(3000), query, 10)
+        candidates = index.candidates(query)
+        approximate = top_k(vectors[candidates], candidates, query, 10)
+        recall.append(len(exact & approximate) / 10)
+    assert np.mean(recall) >= 0.9
+
+
+def test_added_rows_are_found_and_trigger_a_retrain():
+    vectors = clustered(400)
+    index = IVFIndex(DIM)
+    index.train(vectors[:200], np.arange(200))
+    assert not index.needs_retrain()
+    index.add(vectors[200:], np.arange(200, 400))
+    assert len(index) == 400 and index.needs_retrain()
+    for row in (250, 399):
+        assert row in index.candidates(vectors[row])
+
+
+def test_remap_follows_compaction():
+    vectors = clustered(100)
+    index = IVFIndex(DIM)
+    index.train(vectors, np.arange(100))
+    # Every odd row is dropped; the rest move down
+    keep = np.arange(100) % 2 == 0
+    new_rows = np.cumsum(keep) - 1
+    new_rows[~keep] = -1
+    index.remap(new_rows)
+    assert list(index.row_ids) == list(range(50))
+    assert 5 in index.candidates(vectors[10])
+
+
+def test_save_and_load(tmp_path):
+    vectors = clustered(300)
+    index = IVFIndex(DIM, n_probe=3)
+    index.train(vectors, np.arange(300))
+    index.save(str(tmp_path / "index.npz"))
+    loaded = IVFIndex.load(str(tmp_path / "index.npz"), DIM, n_probe=3)
+    assert loaded.trained_rows == 300
+    assert np.array_equal(loaded.candidates(vectors[7]), index.candidates(vectors[7]))
+
+
+@pytest.fixture
+def ann_store(open_store, monkeypatch):
+    monkeypatch.setattr(Config, "ANN_MIN_ROWS", 100)
+    return open_store("append")
+
+
+def search_ids(store, user_id, query, n=5):
+    return [c["id"] for c in store.search_similar(user_id, query, n)]
+
+
+def test_small_users_are_searched_exactly(ann_store, make_turns):
+    ann_store.add_conversations(make_turns(300, users=3))
+    ann_store.add_conversations([{"user_id": "small", "message": f"small question {i}", "response": "ok"}
+                                 for i in range(20)])
+    assert search_ids(ann_store, "small", "small question 3", 1)
+    assert "small" not in ann_store.ann_indexes
+    rows = np.asarray(ann_store.user_index["small"])
+    assert ann_store._ann_candidates("small", rows, ann_store.embedder.embed(["small question"])) is None
+
+
+def test_large_users_match_exact_search(ann_store, monkeypatch, make_turns):
+    ann_store.add_conversations(make_turns(600, users=2))
+    queries = [f"question about topic {t}" for t in range(5)] + ["turn question 17", "answer 402"]
+    approximate = [search_ids(ann_store, "u0", query) for query in queries]
+    assert "u0" in ann_store.ann_indexes
+    monkeypatch.setattr(Config, "ANN_MIN_ROWS", 0)
+    exact = [search_ids(ann_store, "u0", query) for query in queries]
+    recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact)])
+    assert recall >= 0.8
+    assert [a[0] for a in approximate] == [e[0] for e in exact]
+
+
+def test_index_rows_are_remapped_after_compaction(ann_store, make_turns):
+    ann_store.add_conversations(make_turns(600, users=3))
+    search_ids(ann_store, "u0", "question about topic 1")
+    ann_store.delete_user("u1")
+    ann_store.compact()
+    index = ann_store.ann_indexes["u0"]
+    assert sorted(index.row_ids) == sorted(ann_store.user_index["u0"])
+    found = ann_store.search_similar("u0", "turn question 300 about topic 0", 3)
+    assert found[0]["user_message"] == "turn question 300 about topic 0"
+    assert all(c["user_id"] == "u0" for c in found)
@@ -0,0 +1,134 @@
+import json
+import time
+
+import pytest
+
+from app import create_app
+from benchmarks.bench_chat import FakeGeminiClient
+from config import Config
+
+
+@pytest.fixture
+def store(open_store):
+    return open_store("sqlite")
+
+
+@pytest.fixture
+def client(monkeypatch, store):
+    monkeypatch.setattr(Config, "SESSION_STORE", "memory")
+    monkeypatch.setattr(Config, "IMPORT_TOKEN", "secret")
+    app = create_app(gemini_client=FakeGeminiClient((0, 0)), vector_store=store)
+    return app.test_client()
+
+
+def chat(client, message, session_id=None, **extra):
+    response = client.post('/api/chat', json=dict(extra, message=message, session_id=session_id))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_health(client):
+    assert client.get('/api/ping').get_json()['message'] == 'pong'
+    assert client.get('/api/health').status_code == 200
+    assert client.get('/nowhere').get_json() == {'error': 'Endpoint not found'}
+
+
+def test_chat_keeps_a_session_and_uses_its_memory(client):
+    first = chat(client, "my favourite colour is teal")
+    session_id = first['session_id']
+    assert first['response'].startswith("Fake answer") and not first['context_used']
+    second = chat(client, "what is my favourite colour?", session_id)
+    assert second['session_id'] == session_id
+    assert second['context_used'] and second['conversation_count'] == 2
+    assert second['session_message_count'] == 2
+    # Unknown sessions get a new id instead of an error
+    assert chat(client, "hello", "no-such-session")['session_id'] != "no-such-session"
+
+
+@pytest.mark.parametrize("body, error", [
+    ({}, 'No JSON data received'),
+    ({'message': '   '}, 'Message is required'),
+    ({'message': 'hi', 'retrieval': {'recency': 'lots'}}, 'Invalid retrieval settings'),
+])
+def test_bad_chat_requests(client, body, error):
+    response = client.post('/api/chat', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith(error)
+    assert client.post('/api/chat', data="hi").status_code == 400
+
+
+def test_stream_sends_tokens_then_stores_the_turn(client, store):
+    response = client.post('/api/chat/stream', json={'message': "tell me a story"})
+    events = [block.split("\n") for block in response.get_data(as_text=True).strip().split("\n\n")]
+    names = [lines[0][len("event: "):] for lines in events]
+    data = [json.loads(lines[1][len("data: "):]) for lines in events]
+    assert names[0] == 'start' and names[-1] == 'done' and set(names[1:-1]) == {'token'}
+    text = ''.join(item['text'] for item in data[1:-1])
+    assert text == "Fake answer to 'tell me a story' using 0 characters of context."
+    session_id = data[0]['session_id']
+    assert [c['assistant_response'] for c in store.get_user_conversations(session_id)] == [text]
+
+
+def test_history_pages(client):
+    session_id = chat(client, "question 0")['session_id']
+    for i in range(1, 5):
+        chat(client, f"question {i}", session_id)
+    messages, cursor = [], None
+    while True:
+        query = {'limit': 2, 'fields': 'user_message'}
+        if cursor:
+            query['cursor'] = cursor
+        page = client.get(f'/api/session/{session_id}/history', query_string=query).get_json()
+        assert all(item.keys() == {'user_message'} for item in page['items'])
+        messages += [item['user_message'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert messages == [f"question {i}" for i in range(4, -1, -1)]
+    assert client.get(f'/api/session/{session_id}/history?cursor=bogus').status_code == 400
+    assert client.get(f'/api/session/{session_id}/history?limit=x').status_code == 400
+    assert client.get(f'/api/session/{session_id}/history?fields=secret').status_code == 400
+
+
+def test_session_lookup_and_delete(client, store):
+    session_id = chat(client, "remember me")['session_id']
+    assert client.get(f'/api/session/{session_id}').status_code == 200
+    deleted = client.delete(f'/api/session/{session_id}').get_json()
+    assert deleted['conversations_deleted'] == 1
+    assert store.get_conversation_count(session_id) == 0
+    assert client.get(f'/api/session/{session_id}').status_code == 404
+    assert client.delete(f'/api/session/{session_id}').status_code == 404
+
+
+def test_import_needs_the_token(client, store):
+    lines = "\n".join(json.dumps({"user_id": "imported", "message": f"m{i}", "response": "r",
+                                  "timestamp": f"2024-01-01T00:00:0{i}"}) for i in range(3))
+    assert client.post('/api/import', data=lines).status_code == 401
+    response = client.post('/api/import', data=lines + "\nnot json",
+                           headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert response.get_json()['imported'] == 3 and response.get_json()['skipped'] == 1
+    assert store.get_conversation_count("imported") == 3
+
+
+def test_metrics(client):
+    chat(client, "count me")
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'chat_requests_total' in body and 'vector_store_conversations' in body
+
+
+@pytest.mark.parametrize("deletes", [False, True])
+def test_expired_session_turns_are_only_deleted_when_configured(monkeypatch, store, deletes):
+    monkeypatch.setattr(Config, "SESSION_STORE", "memory")
+    monkeypatch.setattr(Config, "SESSION_IDLE_TTL", 0.05)
+    monkeypatch.setattr(Config, "SESSION_EXPIRY_DELETES_TURNS", deletes)
+    client = create_app(gemini_client=FakeGeminiClient((0, 0)), vector_store=store).test_client()
+    session_id = chat(client, "remember me")['session_id']
+    time.sleep(0.1)
+    assert chat(client, "hello again", session_id)['session_id'] != session_id
+    # Deleted on a background thread
+    for _ in range(100):
+        if store.get_conversation_count(session_id) == 0:
+            break
+        time.sleep(0.01)
+    assert store.get_conversation_count(session_id) == (0 if deletes else 1)
@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+
+from asgi import create_asgi_app
+from benchmarks.bench_chat import FakeGeminiClient
+from config import Config
+
+
+def call(app, method, path, chunks=(b"",), headers=(), query=b""):
+    """Run one request through ``app`` in-process; returns (status, headers, body)"""
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": [(name.encode(), value.encode()) for name, value in headers]}
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    response = {"body": b""}
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = dict(message["headers"])
+        else:
+            response["body"] += message.get("body", b"")
+
+    asyncio.run(app(scope, receive, send))
+    return response["status"], response["headers"], response["body"]
+
+
+def post(app, path, payload):
+    status, _, body = call(app, "POST", path, [json.dumps(payload).encode()],
+                           [("content-type", "application/json")])
+    return status, body
+
+
+@pytest.fixture
+def app(monkeypatch, open_store):
+    monkeypatch.setattr(Config, "SESSION_STORE", "memory")
+    monkeypatch.setattr(Config, "IMPORT_TOKEN", "secret")
+    return create_asgi_app(gemini_client=FakeGeminiClient((0, 0)), vector_store=open_store("sqlite"))
+
+
+def test_chat_runs_on_the_event_loop(app):
+    status, body = post(app, "/api/chat", {"message": "my favourite colour is teal"})
+    first = json.loads(body)
+    assert status == 200 and first["response"].startswith("Fake answer")
+    status, body = post(app, "/api/chat/", {"message": "what colour?", "session_id": first["session_id"]})
+    assert status == 200 and json.loads(body)["conversation_count"] == 2
+    status, body = post(app, "/api/chat", {"message": "  "})
+    assert status == 400 and json.loads(body)["error"] == "Message is required"
+    status, _, _ = call(app, "POST", "/api/chat", [b"{}"], [("content-type", "text/plain")])
+    assert status == 400
+
+
+def test_other_routes_are_served_by_flask(app):
+    status, headers, body = call(app, "GET", "/api/ping")
+    assert status == 200 and json.loads(body)["message"] == "pong"
+    assert headers[b"content-type"].startswith(b"application/json")
+    session_id = json.loads(post(app, "/api/chat", {"message": "remember me"})[1])["session_id"]
+    status, _, body = call(app, "GET", f"/api/session/{session_id}/history", query=b"limit=1")
+    assert status == 200 and json.loads(body)["items"][0]["user_message"] == "remember me"
+    assert call(app, "GET", "/nowhere")[0] == 404
+
+
+def test_stream_sends_sse_events_and_stores_the_turn(app):
+    status, headers, body = call(app, "POST", "/api/chat/stream", [b'{"message": "tell me a story"}'],
+                                 [("content-type", "application/json")])
+    assert status == 200 and headers[b"content-type"] == b"text/event-stream"
+    events = [block.split("\n") for block in body.decode().strip().split("\n\n")]
+    names = [lines[0][len("event: "):] for lines in events]
+    data = [json.loads(lines[1][len("data: "):]) for lines in events]
+    assert names[0] == "start" and names[-1] == "done" and set(names[1:-1]) == {"token"}
+    text = "".join(item["text"] for item in data[1:-1])
+    assert text == "Fake answer to 'tell me a story' using 0 characters of context."
+    store = app.chat.vector_store
+    assert [c["assistant_response"] for c in store.get_user_conversations(data[0]["session_id"])] == [text]
+
+
+def test_import_is_read_as_it_arrives(app):
+    lines = [json.dumps({"user_id": "imported", "message": f"m{i}", "response": "r",
+                         "timestamp": f"2024-01-01T00:00:0{i}"}) for i in range(3)]
+    body = ("\n".join(lines) + "\nnot json").encode()
+    # Split mid-line: the importer has to carry the partial line over
+    chunks = [body[:25], body[25:60], body[60:]]
+    assert call(app, "POST", "/api/import", chunks)[0] == 401
+    status, _, response = call(app, "POST", "/api/import", chunks, [("authorization", "Bearer secret")])
+    assert status == 200 and json.loads(response)["imported"] == 3 and json.loads(response)["skipped"] == 1
+    assert app.chat.vector_store.get_conversation_count("imported") == 3
+
+
+def test_shutdown_flushes_the_store(monkeypatch, tmp_path, open_store):
+    monkeypatch.setattr(Config, "SESSION_STORE", "memory")
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(Config, "WRITE_BEHIND_INTERVAL", 60)
+    store = open_store("append", data_dir=tmp_path / "wb")
+    app = create_asgi_app(gemini_client=FakeGeminiClient((0, 0)), vector_store=store)
+    session_id = json.loads(post(app, "/api/chat", {"message": "keep me"})[1])["session_id"]
+    assert store.write_queue.pending()
+
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+    asyncio.run(app({"type": "lifespan"}, receive, send))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    monkeypatch.setattr(Config, "WRITE_BEHIND", False)
+    assert open_store("append", data_dir=tmp_path / "wb").get_conversation_count(session_id) == 1
@@ -0,0 +1,56 @@
+from utils.context_builder import ContextBuilder, estimate_tokens
+
+
+def turn(id, message, response):
+    return {"id": id, "user_message": message, "assistant_response": response,
+            "text": f"User: {message}\nAssistant: {response}"}
+
+
+FILLER = " ".join(f"Unrelated sentence number {i} about nothing much." for i in range(40))
+
+
+def test_token_estimate():
+    assert estimate_tokens("Hello, world!") == 4
+    assert estimate_tokens("") == estimate_tokens(None) == 0
+
+
+def test_context_stays_within_the_budget():
+    retrieved = [turn(f"r{i}", f"distinct question {i} on subject {i * 7}", f"short answer {i}")
+                 for i in range(30)]
+    context, stats = ContextBuilder(budget=60).build("question", retrieved)
+    assert stats["context_tokens"] <= 60
+    assert 0 < stats["turns_used"] < 30
+    # Best-ranked turns are the ones kept
+    assert "distinct question 0 " in context and "distinct question 29" not in context
+
+
+def test_long_replies_keep_their_relevant_sentences():
+    reply = FILLER + " The boiling point of water is 100 degrees. " + FILLER
+    context, stats = ContextBuilder(reply_tokens=40).build("boiling point of water", [turn("r0", "physics", reply)])
+    assert "The boiling point of water is 100 degrees." in context
+    assert "Unrelated sentence number 3 " not in context and context.endswith("...")
+    assert stats["context_tokens"] < estimate_tokens(reply)
+
+
+def test_tokens_saved_counts_what_was_cut():
+    long_turn = turn("r0", "physics", FILLER + " Water boils at 100 degrees.")
+    short_turn = turn("r1", "greeting", "Hello there.")
+    duplicate = turn("r2", "physics", "Again.")
+    context, stats = ContextBuilder(reply_tokens=20).build("water boils", [long_turn, short_turn, duplicate])
+    raw = sum(estimate_tokens(c["text"]) for c in (long_turn, short_turn, duplicate))
+    assert stats["turns_used"] == 2
+    assert stats["context_tokens"] == estimate_tokens(context)
+    assert stats["tokens_saved"] == raw - stats["context_tokens"]
+    # Nothing to cut: nothing saved
+    _, stats = ContextBuilder().build("hi", [short_turn])
+    assert stats["tokens_saved"] == 0
+
+
+def test_recent_turns_come_last_in_order_and_are_not_repeated():
+    recent = [turn("c", "third message", "three"), turn("b", "second message", "two"),
+              turn("a", "first message", "one")]
+    retrieved = [turn("b", "second message", "two"), turn("x", "an older topic", "old")]
+    context, stats = ContextBuilder(recent_turns=2).build("message", retrieved, recent)
+    assert stats["turns_used"] == 3
+    assert [line for line in context.split("\n") if line.startswith("User:")] == [
+        "User: an older topic", "User: second message", "User: third message"]
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from config import Config
+from utils.embedders import HashingEmbedder, TfidfEmbedder, create_embedder
+
+CORPUS = [f"User: how do I cook {food}\nAssistant: slowly, with {spice}"
+          for food in ("rice", "pasta", "beans", "lentils") for spice in ("salt", "pepper", "garlic")]
+
+
+@pytest.fixture
+def tfidf(tmp_path):
+    return TfidfEmbedder(64, str(tmp_path / "tfidf_state.json"), refit_growth=2.0, refit_oov=0.2)
+
+
+def test_hashing_is_stateless_and_deterministic():
+    embedder = create_embedder("hashing", 64, None)
+    assert isinstance(embedder, HashingEmbedder) and not embedder.stateful
+    first = embedder.embed(["cook rice with salt"])
+    assert np.array_equal(first, HashingEmbedder(64).embed(["cook rice with salt"]))
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert not embedder.needs_refit(10 ** 6)
+
+
+def test_unknown_embedder_is_rejected():
+    with pytest.raises(ValueError):
+        create_embedder("word2vec", 64, None)
+
+
+def test_tfidf_never_fits_on_a_query(tfidf):
+    assert not np.any(tfidf.embed(["cook rice with salt"]))
+    assert not tfidf.fitted
+    assert tfidf.needs_refit(1)
+
+
+def test_tfidf_state_is_persisted_and_reloaded(tfidf, tmp_path):
+    tfidf.fit(CORPUS)
+    assert json.loads((tmp_path / "tfidf_state.json").read_text())["rows"] == len(CORPUS)
+    reloaded = TfidfEmbedder(64, tfidf.state_file)
+    reloaded.load(lambda: pytest.fail("the corpus isn't needed when the state file exists"))
+    assert np.allclose(reloaded.embed(["cook pasta with garlic"]), tfidf.embed(["cook pasta with garlic"]))
+
+
+def test_tfidf_refits_after_the_corpus_grows(tfidf):
+    tfidf.fit(CORPUS)
+    assert not tfidf.needs_refit(len(CORPUS) + 1)
+    assert tfidf.needs_refit(2 * len(CORPUS))
+
+
+def test_tfidf_refits_when_new_turns_bring_new_words(tfidf, monkeypatch):
+    monkeypatch.setattr(TfidfEmbedder, "OOV_MIN_TOKENS", 20)
+    tfidf.fit(CORPUS)
+    tfidf.observe(["how do I cook rice with pepper"] * 10)
+    assert not tfidf.needs_refit(len(CORPUS) + 10)
+    tfidf.observe([f"quantum entanglement spectroscopy telescope {i}" for i in range(10)])
+    assert tfidf.needs_refit(len(CORPUS) + 20)
+
+
+def test_other_workers_pick_up_a_refit(tfidf):
+    tfidf.fit(CORPUS[:4])
+    other = TfidfEmbedder(64, tfidf.state_file)
+    other.load(lambda: [])
+    other.embed(["warm up"])
+    assert not other.refresh()
+    tfidf.fit(CORPUS)
+    assert other.refresh()
+    assert other.fitted_rows == len(CORPUS)
+
+
+def test_store_fits_on_stored_turns_only(open_store, monkeypatch, make_turns):
+    monkeypatch.setattr(Config, "TFIDF_REFIT_GROWTH", 2.0)
+    store = open_store("append", "tfidf")
+    assert store.search_similar("u0", "question about topic 1", 3) == []
+    assert not store.embedder.fitted
+    store.add_conversations(make_turns(6))
+    store.wait_for_refit()
+    assert store.embedder.fitted_rows == 6
+    store.add_conversations(make_turns(3, tag="more"))
+    store.wait_for_refit()
+    assert store.embedder.fitted_rows == 6
+    store.add_conversations(make_turns(3, tag="later"))
+    store.wait_for_refit()
+    assert store.embedder.fitted_rows == 12
+    found = store.search_similar("u0", "question about topic 3", 1)
+    assert found and found[0]["user_id"] == "u0"
+
+
+def write_baseline_store(data_dir, turns):
+    """The three files the original store wrote: TF-IDF fitted at startup, no embedder.json"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    data_dir.mkdir(parents=True)
+    conversations = [{"id": f"old-{i}", "user_id": turn["user_id"], "timestamp": f"2024-01-01T00:00:{i:02d}",
+                      "user_message": turn["message"], "assistant_response": turn["response"],
+                      "text": f"User: {turn['message']}\nAssistant: {turn['response']}"}
+                     for i, turn in enumerate(turns)]
+    vectorizer = TfidfVectorizer(max_features=384, stop_words='english')
+    embeddings = vectorizer.fit_transform([c["text"] for c in conversations]).toarray()
+    embeddings = np.pad(embeddings, ((0, 0), (0, 384 - embeddings.shape[1])))
+    (data_dir / "conversations.json").write_text(json.dumps(conversations))
+    (data_dir / "metadata.json").write_text(json.dumps(
+        [{key: c[key] for key in ("id", "user_id", "timestamp")} for c in conversations]))
+    np.save(data_dir / "embeddings.npy", embeddings)
+
+
+@pytest.mark.parametrize("mode", ("json", "sqlite", "append"))
+def test_baseline_store_is_reembedded(tmp_path, open_store, make_turns, mode):
+    write_baseline_store(tmp_path / "store", make_turns(12))
+    store = open_store(mode, "hashing")
+    assert json.loads((tmp_path / "store" / "embedder.json").read_text())["name"] == "hashing"
+    expected = HashingEmbedder(Config.EMBEDDING_DIM).embed([c["text"] for c in store.conversations])
+    assert np.allclose(np.asarray(store.embeddings, dtype=np.float32), expected, atol=1e-6)
+    found = store.search_similar("u1", "answer 10", 1)
+    assert [c["id"] for c in found] == ["old-10"]
+    store.close()
+    # Recorded: the next start doesn't re-embed again
+    assert not json.loads((tmp_path / "store" / "embedder.json").read_text()).get("legacy")
+
+
+def test_refit_runs_in_the_background(open_store, monkeypatch, make_turns):
+    store = open_store("append", "tfidf")
+    store.add_conversations(make_turns(6))
+    store.wait_for_refit()
+    vocabulary = store.embedder.vectorizer.vocabulary_
+    release = threading.Event()
+    fit = TfidfEmbedder.fit
+
+    def slow_fit(self, texts, save=True):
+        release.wait(5)
+        fit(self, texts, save)
+    monkeypatch.setattr(TfidfEmbedder, "fit", slow_fit)
+
+    # Doubling the corpus starts a refit; the write returns without waiting for it
+    started = time.perf_counter()
+    store.add_conversations(make_turns(6, tag="fresh"))
+    assert time.perf_counter() - started < 1
+    assert store._refit_thread.is_alive()
+    # Meanwhile searches use the current vocabulary and vectors
+    assert store.embedder.vectorizer.vocabulary_ is vocabulary
+    assert store.search_similar("u0", "turn question about topic 3", 1)
+    store.add_conversation("u1", "written during the refit", "ok")
+
+    release.set()
+    store.wait_for_refit()
+    # The turn written meanwhile may or may not have made it into the fit corpus
+    assert store.embedder.fitted_rows in (12, 13)
+    assert "fresh" in store.embedder.vectorizer.vocabulary_
+    # Rows written while the refit ran were caught up under the new vocabulary
+    expected = store.embedder.embed([c["text"] for c in store.conversations])
+    assert np.allclose(np.asarray(store.embeddings), expected, atol=1e-6)
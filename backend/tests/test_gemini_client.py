@@ -0,0 +1,228 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from config import Config
+from utils.gemini_client import FREE_TIER_MODELS, GeminiClient
+
+
+class FakeGenAI:
+    """Stands in for google.generativeai: every call sleeps briefly and is counted"""
+
+    def __init__(self, fail_probes=()):
+        self.calls = 0
+        self.probes = []
+        self.fail_probes = set(fail_probes)
+        self.delays = {}  # model name -> seconds a call takes (0.1 otherwise)
+        self.chunk_delays = [0, 0]  # seconds before each streamed chunk
+        self.error = None  # raised by every call when set
+        self._lock = threading.Lock()
+
+    def GenerativeModel(self, name):
+        genai = self
+
+        class Model:
+            def generate_content(self, prompt, generation_config=None, stream=False):
+                if generation_config is not None:
+                    genai.probes.append(name)
+                    if name in genai.fail_probes:
+                        raise RuntimeError(f"{name} unavailable")
+                    return SimpleNamespace(text="OK")
+                with genai._lock:
+                    genai.calls += 1
+                if genai.error is not None:
+                    raise genai.error
+                if stream:
+                    return self._stream()
+                time.sleep(genai.delays.get(name, 0.1))
+                return SimpleNamespace(text=f"answer from {name}", usage_metadata=None)
+
+            def _stream(self):
+                for i, delay in enumerate(genai.chunk_delays):
+                    time.sleep(delay)
+                    yield SimpleNamespace(text=f"chunk {i} ")
+        return Model()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "GOOGLE_API_KEY", "test-key")
+    monkeypatch.setattr(Config, "MODEL_CACHE_FILE", str(tmp_path / "model_cache.json"))
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", False)
+    client = GeminiClient()
+    client._genai = FakeGenAI()
+    return client
+
+
+def concurrently(fn, n=4):
+    results = [None] * n
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, fn())) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_prompts_share_one_call(client):
+    results = concurrently(lambda: client.generate_response("same question"))
+    assert client._genai.calls == 1
+    assert len(set(results)) == 1 and results[0].startswith("answer from")
+    assert client.scheduler.coalesced == 3
+
+
+def test_no_coalescing_without_cache(client):
+    concurrently(lambda: client.generate_response("same question", use_cache=False))
+    assert client._genai.calls == 4
+    assert client.scheduler.coalesced == 0
+
+
+def test_no_coalescing_without_cache_async(client):
+    async def ask(use_cache):
+        return await asyncio.gather(*(client.generate_response_async("q", use_cache=use_cache)
+                                      for _ in range(3)))
+    asyncio.run(ask(False))
+    assert client._genai.calls == 3
+    asyncio.run(ask(True))
+    assert client._genai.calls == 4
+
+
+def test_response_cache(client, monkeypatch):
+    monkeypatch.setattr(Config, "RESPONSE_CACHE_ENABLED", True)
+    cached = GeminiClient()
+    cached._genai = client._genai
+    first = cached.generate_response("Hello  there")
+    assert cached.generate_response("hello there") == first
+    assert client._genai.calls == 1
+    cached.generate_response("hello there", use_cache=False)
+    assert client._genai.calls == 2
+
+
+def test_demo_mode_is_retried_after_the_backoff(client, monkeypatch):
+    monkeypatch.setattr(Config, "MODEL_RETRY_BACKOFF", 0.2)
+    client._genai.fail_probes = set(FREE_TIER_MODELS)
+    assert client.model is None
+    probes = len(client._genai.probes)
+    assert probes == len(FREE_TIER_MODELS)
+
+    # Still backing off: the negative result is reused, nothing is probed
+    client._genai.fail_probes = set()
+    assert client.model is None
+    assert len(client._genai.probes) == probes
+
+    time.sleep(0.25)
+    client.model
+    client._reprobe_thread.join()
+    assert client.model is not None
+    assert client._model_name == "gemini-2.0-flash-001"
+
+
+def test_demo_mode_is_retried_after_the_backoff_async(client, monkeypatch):
+    monkeypatch.setattr(Config, "MODEL_RETRY_BACKOFF", 0.2)
+    client._genai.fail_probes = set(FREE_TIER_MODELS)
+    assert asyncio.run(client._ensure_model_async()) is None
+    probes = len(client._genai.probes)
+    client._genai.fail_probes = set()
+    assert asyncio.run(client._ensure_model_async()) is None
+    assert len(client._genai.probes) == probes
+
+    time.sleep(0.25)
+    asyncio.run(client._ensure_model_async())
+    client._reprobe_thread.join()
+    assert asyncio.run(client._ensure_model_async()) is not None
+    assert client._model_name == "gemini-2.0-flash-001"
+
+
+def test_cached_negative_probe_expires_with_the_backoff(tmp_path, client, monkeypatch):
+    monkeypatch.setattr(Config, "MODEL_RETRY_BACKOFF", 60)
+    client._save_cache({"model": None, "checked_at": time.time() - 120, "demoted": {}})
+    assert client.model is not None
+    assert client._genai.probes == ["gemini-2.0-flash-001"]
+
+
+def test_demoted_model_is_skipped_only_for_the_backoff(client, monkeypatch):
+    monkeypatch.setattr(Config, "MODEL_RETRY_BACKOFF", 60)
+    client._save_cache({"model": None, "checked_at": 0,
+                        "demoted": {"gemini-2.0-flash-001": time.time() - 10,
+                                    "gemini-2.0-flash-lite-001": time.time() - 120}})
+    client.model
+    assert client._model_name == "gemini-2.0-flash-lite-001"
+
+
+def test_server_quota_errors_back_off_instead_of_demoting(client):
+    client.scheduler.max_retries = 0
+    client._genai.error = RuntimeError("429 Resource exhausted. Please retry in 30s.")
+    assert "upgrade to a paid plan" in client.generate_response("hello")
+    assert client._model_name == "gemini-2.0-flash-001" and client._reprobe_thread is None
+    # The next request is held back locally instead of hitting the server again
+    assert "upgrade to a paid plan" in client.generate_response("hello again")
+    assert client._genai.calls == 1 and client.scheduler.rejections == 1
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_stalled_stream_is_cut_at_the_deadline(client, monkeypatch, use_async):
+    monkeypatch.setattr(Config, "GEMINI_CALL_DEADLINE", 0.2)
+    client._genai.chunk_delays = [0, 0, 1]
+
+    def stream(prompt):
+        if not use_async:
+            return list(client.generate_response_stream(prompt))
+
+        async def collect():
+            return [chunk async for chunk in client.generate_response_stream_async(prompt)]
+        return asyncio.run(collect())
+    # What was already sent stands; nothing canned is appended to it
+    assert stream("tell me a story") == ["chunk 0 ", "chunk 1 "]
+    assert client.deadline_exceeded == 1
+    # Stalled before the first chunk: the whole answer is the fallback
+    client._genai.chunk_delays = [1]
+    assert "API Error: No chunk within" in "".join(stream("tell me another"))
+    assert client.deadline_exceeded == 2
+
+
+def ask(client, prompt, use_async):
+    if use_async:
+        return asyncio.run(client.generate_response_async(prompt))
+    return client.generate_response(prompt)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_slow_primary_is_hedged_to_the_next_model(client, monkeypatch, use_async):
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", True)
+    monkeypatch.setattr(Config, "GEMINI_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(Config, "GEMINI_CALL_DEADLINE", 2)
+    client._genai.delays = {"gemini-2.0-flash-001": 1}
+    started = time.monotonic()
+    assert ask(client, "hello", use_async) == "answer from gemini-2.0-flash-lite-001"
+    assert time.monotonic() - started < 0.5
+    assert client.hedges_fired == 1 and client.hedges_won == 1
+    assert client.deadline_exceeded == 0
+    # The hedge only answered this request: the primary stays selected
+    assert client._model_name == "gemini-2.0-flash-001"
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_fast_primary_sends_no_hedge(client, monkeypatch, use_async):
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", True)
+    monkeypatch.setattr(Config, "GEMINI_HEDGE_DELAY", 0.5)
+    assert ask(client, "hello", use_async) == "answer from gemini-2.0-flash-001"
+    assert client.hedges_fired == 0 and client._genai.calls == 1
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_no_answer_within_the_deadline_falls_back(client, monkeypatch, use_async):
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", True)
+    monkeypatch.setattr(Config, "GEMINI_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(Config, "GEMINI_CALL_DEADLINE", 0.2)
+    client._genai.delays = {name: 1 for name in FREE_TIER_MODELS}
+    started = time.monotonic()
+    assert "API Error: No response within" in ask(client, "hello", use_async)
+    assert time.monotonic() - started < 0.5
+    assert client.hedges_fired == 1 and client.hedges_won == 0
+    assert client.deadline_exceeded == 1
+    # Slow isn't broken: nothing is demoted
+    assert client._reprobe_thread is None
@@ -0,0 +1,91 @@
+import pytest
+
+from config import Config
+
+MODES = ("json", "sqlite", "append")
+
+
+def history_turns(n):
+    # Timestamps repeat, so ties have to be broken by id
+    return [{"user_id": "u0", "message": f"turn {i}", "response": "ok",
+             "timestamp": f"2024-05-01T12:00:{i % 4:02d}"} for i in range(n)]
+
+
+def all_pages(store, limit):
+    keys, before = [], None
+    while True:
+        page, before = store.get_history_page("u0", before, limit)
+        assert len(page) <= limit
+        keys += [(conv["timestamp"], conv["id"]) for conv in page]
+        if before is None:
+            return keys
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_pages_follow_timestamp_then_id(open_store, mode):
+    store = open_store(mode)
+    store.add_conversations(history_turns(13))
+    # Imported later, but older than everything else
+    store.add_conversations([{"user_id": "u0", "message": "imported", "response": "ok",
+                              "timestamp": "2023-01-01T00:00:00"}])
+    keys = all_pages(store, 5)
+    assert keys == sorted(keys, reverse=True)
+    assert len(set(keys)) == 14
+    assert store.get_history_page("u0", limit=20)[0][-1]["user_message"] == "imported"
+    assert [c["id"] for c in store.get_user_conversations("u0", 4)] == [i for _, i in keys[:4]]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_cursor_survives_new_turns_and_compaction(open_store, mode):
+    store = open_store(mode)
+    store.add_conversations([{"user_id": "u1", "message": "other", "response": "ok"}] * 3)
+    store.add_conversations(history_turns(10))
+    first, before = store.get_history_page("u0", None, 4)
+    store.add_conversations([{"user_id": "u0", "message": "newer", "response": "ok"}])
+    # Compaction renumbers every row behind u1's
+    store.delete_user("u1")
+    store.compact()
+    rest, _ = store.get_history_page("u0", before, 20)
+    assert [c["id"] for c in first + rest] == [i for _, i in sorted(
+        ((c["timestamp"], c["id"]) for c in first + rest), reverse=True)]
+    assert len(first) + len(rest) == 10
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_queued_turns_are_merged_in_order(open_store, monkeypatch, mode):
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(Config, "WRITE_BEHIND_INTERVAL", 60)
+    store = open_store(mode)
+    store.add_conversations(history_turns(6))
+    for i in range(3):
+        store.add_conversation("u0", f"queued {i}", "ok")
+    assert len(store._pending_turns("u0")) == 3
+    keys = all_pages(store, 4)
+    assert keys == sorted(keys, reverse=True) and len(set(keys)) == 9
+    store.flush()
+    assert all_pages(store, 4) == keys
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_turns_being_flushed_count_once(open_store, monkeypatch, mode):
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(Config, "WRITE_BEHIND_INTERVAL", 60)
+    store = open_store(mode)
+    store.add_conversations(history_turns(4))
+    for i in range(3):
+        store.add_conversation("u0", f"queued {i}", "ok")
+    store.add_conversation("u1", "queued elsewhere", "ok")
+    seen = {}
+    persist = store.write_queue.flush_fn
+
+    def persist_and_read(batch):
+        # The rows are stored, but the batch only leaves the queue once this returns
+        persist(batch)
+        seen.update(queued=len(store._pending_turns()), user=store.get_conversation_count("u0"),
+                    total=store.get_conversation_count(),
+                    ids=[c["id"] for c in store.get_user_conversations("u0", 10)])
+    store.write_queue.flush_fn = persist_and_read
+    store.flush()
+    assert seen["queued"] == 4
+    assert seen["user"] == 7 and seen["total"] == 8
+    assert len(seen["ids"]) == len(set(seen["ids"])) == 7
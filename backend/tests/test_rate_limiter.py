@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.rate_limiter import QuotaRejected, QuotaScheduler, is_quota_error, parse_retry_delay
+
+
+class QuotaError(Exception):
+    pass
+
+
+def flaky(failures, error=QuotaError("429 Resource exhausted")):
+    """A call that raises ``error`` ``failures`` times, then answers"""
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    fn.calls = calls
+    return fn
+
+
+def test_quota_errors_are_recognised():
+    assert is_quota_error(QuotaError("429 Too Many Requests"))
+    assert is_quota_error(QuotaError("RESOURCE_EXHAUSTED"))
+    assert not is_quota_error(ValueError("bad prompt"))
+    assert parse_retry_delay(QuotaError("Please retry in 1.5s.")) == 1.5
+    assert parse_retry_delay(QuotaError("retry_delay { seconds: 7 }")) == 7
+    assert parse_retry_delay(QuotaError("429")) is None
+
+
+def test_calls_beyond_the_budget_wait_or_are_rejected():
+    scheduler = QuotaScheduler(rpm=60, max_wait=0.5)
+    for _ in range(60):
+        scheduler.acquire(1)
+    started = time.monotonic()
+    # One request per second is refilled: the next call waits for it
+    scheduler.acquire(1, max_wait=2)
+    assert 0.5 < time.monotonic() - started < 1.5
+    with pytest.raises(QuotaRejected):
+        scheduler.acquire(1)
+    assert scheduler.rejections == 1
+
+
+def test_token_budget_limits_large_prompts():
+    scheduler = QuotaScheduler(rpm=1000, tpm=100, max_wait=0)
+    scheduler.acquire(80)
+    with pytest.raises(QuotaRejected):
+        scheduler.acquire(80)
+    # An overestimate is handed back once the real usage is known
+    scheduler.record_usage(80, 10)
+    scheduler.acquire(80)
+
+
+def test_quota_errors_are_retried_with_backoff():
+    scheduler = QuotaScheduler(max_retries=2, backoff=0.05)
+    fn = flaky(2)
+    assert scheduler.run(fn, 1) == "ok"
+    assert len(fn.calls) == 3 and scheduler.retries == 2
+    assert fn.calls[1] - fn.calls[0] >= 0.05
+    assert fn.calls[2] - fn.calls[1] >= 0.1
+
+
+def test_retries_give_up():
+    scheduler = QuotaScheduler(max_retries=1, backoff=0.01)
+    with pytest.raises(QuotaError):
+        scheduler.run(flaky(5), 1)
+    # Other errors aren't retried at all
+    fn = flaky(1, ValueError("bad prompt"))
+    with pytest.raises(ValueError):
+        scheduler.run(fn, 1)
+    assert len(fn.calls) == 1
+
+
+def test_a_call_that_gives_up_still_holds_back_the_others():
+    scheduler = QuotaScheduler(max_retries=0, max_wait=0.5)
+    with pytest.raises(QuotaError):
+        scheduler.run(flaky(1, QuotaError("429 Please retry in 2s.")), 1)
+    assert scheduler.stats()["blocked_for_s"] > 1.5
+    with pytest.raises(QuotaRejected):
+        scheduler.acquire(1)
+
+
+def test_concurrent_identical_calls_share_one_request():
+    scheduler = QuotaScheduler()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return "shared"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(scheduler.call("key", fn, 1))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["shared"] * 4 and len(calls) == 1
+    assert scheduler.coalesced == 3
+    # The flight is over: the next call runs again
+    scheduler.call("key", fn, 1)
+    assert len(calls) == 2
+
+
+def test_followers_see_the_leaders_error():
+    scheduler = QuotaScheduler()
+
+    def fn():
+        time.sleep(0.05)
+        raise ValueError("upstream down")
+    errors = []
+
+    def call():
+        try:
+            scheduler.call("key", fn, 1)
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3 and scheduler.calls == 1
+
+
+def test_async_calls_are_coalesced_per_key():
+    scheduler = QuotaScheduler()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.call_async(key, fn, 1) for key in ("a", "a", "a", "b")))
+    results = asyncio.run(main())
+    assert len(calls) == 2 and scheduler.coalesced == 2
+    assert results[0] == results[1] == results[2]
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from utils.retention import RetentionPolicy
+from utils.scoring import parse_times
+from utils.snapshot import Snapshot
+
+MODES = ["append", "sqlite", "json"]
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def days_ago(days):
+    return (NOW - timedelta(days=days)).isoformat()
+
+
+def test_policy_limits():
+    user_index = {"a": [0, 2, 4], "b": [1, 3, 5]}
+    times = parse_times([days_ago(d) for d in (1, 40, 2, 3, 50, 4)])
+    assert RetentionPolicy().expired(user_index, times, NOW) == {}
+    assert RetentionPolicy(max_turns_per_user=2).expired(user_index, times, NOW) == {"a": [0], "b": [1]}
+    assert RetentionPolicy(max_turns=4).expired(user_index, times, NOW) == {"a": [0], "b": [1]}
+    # Imported history can be older than rows stored before it
+    assert RetentionPolicy(max_age_days=30).expired(user_index, times, NOW) == {"a": [4], "b": [1]}
+
+
+def add_aged(store, ages, user_id="u0"):
+    store.add_conversations([{"user_id": user_id, "message": f"turn {i}", "response": "ok",
+                              "timestamp": (datetime.now() - timedelta(days=age)).isoformat()}
+                             for i, age in enumerate(ages)])
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_age_retention(open_store, mode):
+    store = open_store(mode)
+    store.retention = RetentionPolicy(max_age_days=30)
+    add_aged(store, [1, 45, 2, 60])
+    assert store.apply_retention() == 2
+    assert store.get_conversation_count("u0") == 2
+    assert sorted(c["user_message"] for c in store.get_user_conversations("u0")) == ["turn 0", "turn 2"]
+    assert store.apply_retention() == 0
+
+
+def test_age_retention_after_warm_start_reads_numeric_times(open_store, monkeypatch):
+    store = open_store("append")
+    add_aged(store, [1, 45, 2, 60])
+    store.close()
+
+    warm = open_store("append")
+    assert warm.warm_start
+    assert warm.metadata.snapshot.times().dtype == np.dtype('datetime64[s]')
+    monkeypatch.setattr(Snapshot, "metadata", lambda self, row: pytest.fail("decoded a snapshot row"))
+    warm.retention = RetentionPolicy(max_age_days=30)
+    assert warm.apply_retention() == 2
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_per_user_cap(open_store, make_turns, mode):
+    store = open_store(mode)
+    store.retention = RetentionPolicy(max_turns_per_user=3)
+    store.add_conversations(make_turns(12, users=2))
+    assert store.apply_retention() == 6
+    assert store.get_conversation_count("u0") == store.get_conversation_count("u1") == 3
+    newest = [c["user_message"] for c in store.get_user_conversations("u0")]
+    assert sorted(newest) == sorted(f"turn question {i} about topic {i % 5}" for i in (6, 8, 10))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from utils.scoring import RowFeatures, ScoreWeights, hybrid_scores
+
+
+def conversations(n):
+    return [{"text": f"row {i} about cats", "timestamp": f"2024-05-0{1 + i % 9}T12:00:00"} for i in range(n)]
+
+
+def test_override_validates():
+    weights = ScoreWeights().override({"keyword": 0.5})
+    assert weights.keyword == 0.5
+    with pytest.raises(ValueError):
+        ScoreWeights().override({"recency": 2})
+    with pytest.raises(ValueError):
+        ScoreWeights().override({"bogus": 1})
+
+
+def test_recency_only_scales_relevance():
+    weights = ScoreWeights(recency=1.0, half_life_hours=1.0)
+    times = np.array(["2024-05-01T12:00:00", "2024-05-01T11:00:00"], dtype='datetime64[s]')
+    scores = hybrid_scores(weights, np.array([[0.0, 0.8]]), times=times, now=np.datetime64("2024-05-01T12:00:00"))
+    assert scores[0, 0] == 0
+    assert scores[0, 1] == pytest.approx(0.4)
+
+
+def test_row_features_keep_recently_searched_users():
+    features = RowFeatures(max_users=2)
+    rows = conversations(6)
+    for user_id, user_rows in (("a", [0, 1]), ("b", [2, 3]), ("a", [0, 1]), ("c", [4, 5])):
+        counts, times = features.get(user_id, user_rows, user_rows, rows, 0)
+        assert counts.shape[0] == len(times) == 2
+    assert list(features._users) == ["a", "c"]
+
+
+def test_row_features_invalidate():
+    features = RowFeatures()
+    rows = conversations(4)
+    features.get("a", [0, 1], [1], rows, 0)
+    features.get("b", [2, 3], [2], rows, 0)
+    features.invalidate("a")
+    assert list(features._users) == ["b"]
+    features.invalidate()
+    assert not features._users
@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from config import Config
+from utils.segment_log import SegmentLog
+
+DIM = 4
+
+
+def turn(i, user_id="u0"):
+    conversation = {"id": f"c{i}", "user_id": user_id, "timestamp": f"2024-05-01T12:00:{i:02d}",
+                    "user_message": f"m{i}", "assistant_response": f"r{i}", "text": f"m{i} r{i}"}
+    meta = {"id": conversation["id"], "user_id": user_id, "timestamp": conversation["timestamp"]}
+    return conversation, meta, np.full(DIM, i, dtype=np.float32)
+
+
+def opened(path):
+    log = SegmentLog(str(path), DIM)
+    conversations, metadata = log.load()
+    return log, conversations
+
+
+def test_append_roll_and_reload(tmp_path):
+    log, _ = opened(tmp_path)
+    with log.locked():
+        log.append_many([turn(i) for i in range(3)])
+        log.roll([turn(i)[0] for i in range(3)], [turn(i)[1] for i in range(3)])
+        log.append_many([turn(i) for i in range(3, 5)])
+
+    reopened, conversations = opened(tmp_path)
+    assert [c["id"] for c in conversations] == [f"c{i}" for i in range(5)]
+    assert reopened.segment_row_count() == 3
+    assert np.array_equal(reopened.embeddings.rows[:, 0], np.arange(5))
+
+
+def test_merge_segments(tmp_path):
+    log, _ = opened(tmp_path)
+    rows = [turn(i) for i in range(6)]
+    with log.locked():
+        for start in (0, 3):
+            log.append_many(rows[start:start + 3])
+            log.roll([c for c, _, _ in rows[start:start + 3]], [m for _, m, _ in rows[start:start + 3]])
+        log.compact([c for c, _, _ in rows], [m for _, m, _ in rows])
+    assert len(log.manifest["segments"]) == 1
+    assert sorted(os.listdir(log.segments_dir)) == [f"{log.manifest['segments'][0]['id']:06d}.jsonl"]
+    assert [c["id"] for c in opened(tmp_path)[1]] == [f"c{i}" for i in range(6)]
+
+
+def test_torn_log_tail_is_truncated(tmp_path):
+    log, _ = opened(tmp_path)
+    with log.locked():
+        log.append_many([turn(i) for i in range(2)])
+    with open(log._log_path(), 'ab') as f:
+        f.write(b'{"conversation": {"id": "half')
+
+    reopened, conversations = opened(tmp_path)
+    assert [c["id"] for c in conversations] == ["c0", "c1"]
+    assert open(reopened._log_path(), 'rb').read().endswith(b"}\n")
+
+
+def test_embedding_rows_without_a_record_are_dropped(tmp_path):
+    log, _ = opened(tmp_path)
+    with log.locked():
+        log.append_many([turn(0)])
+        # Crash between writing the embedding row and its record line
+        log.embeddings.extend(np.ones((1, DIM), dtype=np.float32))
+
+    reopened, conversations = opened(tmp_path)
+    assert len(conversations) == len(reopened.embeddings) == 1
+
+
+def test_leftovers_removed_only_after_an_interrupted_operation(tmp_path):
+    log, _ = opened(tmp_path)
+    stray = os.path.join(log.segments_dir, "000099.jsonl")
+    with open(stray, 'w') as f:
+        f.write("{}\n")
+    opened(tmp_path)
+    assert os.path.exists(stray)
+
+    with pytest.raises(OSError):
+        with log.locked(), log._may_leave_files():
+            raise OSError("disk full")
+    assert os.path.exists(log.cleanup_file)
+    opened(tmp_path)
+    assert not os.path.exists(stray)
+    assert not os.path.exists(log.cleanup_file)
+
+
+def test_interrupted_compaction_is_cleaned_up(tmp_path):
+    log, _ = opened(tmp_path)
+    rows = [turn(i) for i in range(4)]
+    with log.locked():
+        log.append_many(rows)
+        log.roll([c for c, _, _ in rows], [m for _, m, _ in rows])
+    prepared = log.prepare_compaction([c for c, _, _ in rows[:2]], [m for _, m, _ in rows[:2]],
+                                      [np.zeros((2, DIM))])
+    # The process dies before commit_compaction
+    reopened, conversations = opened(tmp_path)
+    assert not os.path.exists(prepared["segment"]) and not os.path.exists(prepared["embeddings"])
+    assert len(conversations) == 4
+
+
+@pytest.mark.parametrize("fmt", ["dense", "sparse"])
+def test_store_compaction_survives_reopen(open_store, make_turns, monkeypatch, fmt):
+    monkeypatch.setattr(Config, "EMBEDDING_FORMAT", fmt)
+    monkeypatch.setattr(Config, "LOG_ROLL_THRESHOLD", 7)
+    store = open_store("append")
+    store.add_conversations(make_turns(20))
+    store.delete_user("u0")
+    assert store.compact() == 7
+    assert not store.tombstones
+    kept = [c["id"] for c in store.conversations]
+    store.close()
+
+    reopened = open_store("append")
+    assert [c["id"] for c in reopened.conversations] == kept
+    assert reopened.get_conversation_count() == 13
+    with open(reopened.segment_log.tombstones_file) as f:
+        assert [json.loads(line) for line in f] == []
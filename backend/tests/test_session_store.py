@@ -0,0 +1,87 @@
+import sys
+import time
+
+import pytest
+
+from utils.session_store import MemorySessionStore, SqliteSessionStore, _session_bytes
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemorySessionStore(**kwargs)
+        return SqliteSessionStore(str(tmp_path / "sessions.db"), purge_every=1, **kwargs)
+    return make
+
+
+def test_create_get_and_count_turns(make_store):
+    store = make_store()
+    session_id, session = store.create()
+    assert session['message_count'] == 0 and 'conversation_ids' not in session
+    assert store.add_turn(session_id) == 1
+    assert store.add_turn(session_id) == 2
+    store.set(session_id, cache_enabled=False)
+    session = store.get(session_id)
+    assert session['message_count'] == 2 and session['cache_enabled'] is False
+    assert store.delete(session_id) and store.get(session_id) is None
+
+
+def test_expired_session_is_reported_once(make_store):
+    dropped = []
+    store = make_store(idle_ttl=0.05, on_expire=dropped.extend)
+    session_id, _ = store.create()
+    time.sleep(0.1)
+    assert store.get(session_id) is None
+    assert store.get(session_id) is None
+    assert dropped == [session_id]
+
+
+def test_idle_sessions_are_purged_without_being_looked_up(make_store):
+    dropped = []
+    store = make_store(idle_ttl=0.05, on_expire=dropped.extend)
+    idle, _ = store.create()
+    time.sleep(0.1)
+    active, _ = store.create()
+    store.add_turn(active)
+    assert dropped == [idle]
+    assert len(store) == 1
+
+
+def test_evicted_sessions_are_not_reported(make_store):
+    dropped = []
+    store = make_store(max_sessions=2, on_expire=dropped.extend)
+    first, _ = store.create()
+    time.sleep(0.01)
+    store.create()
+    time.sleep(0.01)
+    store.create()
+    # Only the cache is bounded: an evicted session's turns must stay
+    assert dropped == []
+    assert store.get(first) is None
+    assert store.stats()["evictions"] == 1
+
+
+def test_byte_cap_counts_the_cached_sessions():
+    store = MemorySessionStore(max_bytes=10 ** 9)
+    session_id, session = store.create()
+    one = store.stats()["approx_bytes"]
+    assert one >= _session_bytes(session_id, session) > sys.getsizeof(session)
+    store.create()
+    assert store.stats()["approx_bytes"] == 2 * one
+    store.delete(session_id)
+    assert store.stats()["approx_bytes"] == one
+
+    capped = MemorySessionStore(max_bytes=3 * one)
+    for _ in range(10):
+        capped.create()
+    assert len(capped) == 3 and capped.stats()["approx_bytes"] <= 3 * one
+    assert capped.evictions == 7
+
+
+def test_explicit_delete_is_not_reported(make_store):
+    dropped = []
+    store = make_store(on_expire=dropped.extend)
+    session_id, _ = store.create()
+    store.delete(session_id)
+    assert dropped == []
@@ -0,0 +1,136 @@
+import gc
+import os
+import weakref
+
+import pytest
+
+from config import Config
+from rebalance_shards import build, rebalance, spool
+from utils.sharded_store import ShardedVectorStore, create_vector_store, shard_dir, shard_of, shard_root
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    stores = []
+
+    def open_(shards, data_dir=tmp_path / "store", **kwargs):
+        store = ShardedVectorStore(str(data_dir), shards, "append", "hashing", **kwargs)
+        stores.append(store)
+        return store
+    yield open_
+    for store in stores:
+        store.close()
+
+
+def history(store, users):
+    return {f"u{k}": sorted(c["id"] for c in store.get_user_conversations(f"u{k}", 100)) for k in range(users)}
+
+
+def test_shard_of_is_stable_and_spread():
+    assert shard_of("alice", 8) == shard_of("alice", 8)
+    assert len({shard_of(f"user-{i}", 8) for i in range(200)}) == 8
+
+
+def test_users_are_routed_to_their_shard(tmp_path, sharded, make_turns):
+    store = sharded(4)
+    ids = store.add_conversations(make_turns(40, users=8))
+    assert len(ids) == 40 and None not in ids
+    for k in range(8):
+        user_id = f"u{k}"
+        with store._user_shard(user_id) as shard:
+            assert shard.get_conversation_count(user_id) == 5
+            assert os.path.samefile(shard.data_dir, shard_dir(str(tmp_path / "store"), 4, shard_of(user_id, 4)))
+        found = store.search_similar(user_id, "question about topic 1", 3)
+        assert found and all(c["user_id"] == user_id for c in found)
+    assert store.get_conversation_count() == 40
+    assert store.delete_user("u3") == 5
+    assert store.get_conversation_count() == 35
+
+
+def test_idle_shards_are_closed_and_reopened(sharded, make_turns):
+    store = sharded(2, idle_ttl=0)
+    store.add_conversations(make_turns(10, users=4))
+    opened = len(store._open)
+    assert opened and store.evict_idle() == opened and not store._open
+    assert store.get_conversation_count("u1") == 3
+    assert len(store._open) == 1
+
+
+def test_store_with_another_shard_count_is_refused(tmp_path, sharded, make_turns):
+    sharded(2).add_conversations(make_turns(4))
+    with pytest.raises(ValueError, match="rebalance_shards.py"):
+        ShardedVectorStore(str(tmp_path / "store"), 3, "append", "hashing")
+    with pytest.raises(ValueError, match="VECTOR_STORE_SHARDS=2"):
+        create_vector_store(str(tmp_path / "store"), 1)
+
+
+def test_rebalance_moves_every_live_turn(tmp_path, monkeypatch, sharded, make_turns):
+    monkeypatch.setattr(Config, "VECTOR_STORE_MODE", "append")
+    monkeypatch.setattr(Config, "EMBEDDER", "hashing")
+    data_dir = str(tmp_path / "store")
+    before = sharded(2)
+    before.add_conversations(make_turns(60, users=10))
+    before.delete_user("u4")
+    expected = history(before, 10)
+    before.close()
+
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    moved = spool(data_dir, 2, 3, str(spool_dir))
+    assert moved == 54
+    building = shard_root(data_dir, 3) + ".tmp"
+    built = sum(build(str(spool_dir / f"{shard:03d}.jsonl"), os.path.join(building, f"{shard:03d}"))
+                for shard in range(3))
+    assert built == moved
+    os.rename(building, shard_root(data_dir, 3))
+
+    after = sharded(3)
+    assert history(after, 10) == expected
+    assert expected["u4"] == []
+    for k in range(10):
+        with after._user_shard(f"u{k}") as shard:
+            assert shard.get_conversation_count(f"u{k}") == len(expected[f"u{k}"])
+
+
+def test_evicted_shards_are_released(monkeypatch, sharded, make_turns):
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    store = sharded(2, idle_ttl=0)
+    store.add_conversations(make_turns(4, users=2))
+    store.add_conversation("u0", "queued", "ok")
+    shards = [weakref.ref(shard) for shard in store._open.values()]
+    assert store.evict_idle() == len(shards)
+    gc.collect()
+    # Not even the write-behind queue's exit hook keeps a closed shard alive
+    assert all(ref() is None for ref in shards)
+    assert [c["user_message"] for c in store.get_user_conversations("u0", 1)] == ["queued"]
+
+
+def test_rebalance_back_to_a_plain_store(tmp_path, monkeypatch, sharded, make_turns):
+    monkeypatch.setattr(Config, "VECTOR_STORE_MODE", "append")
+    monkeypatch.setattr(Config, "EMBEDDER", "hashing")
+    data_dir = str(tmp_path / "store")
+    before = sharded(2)
+    before.add_conversations(make_turns(20, users=4))
+    expected = history(before, 4)
+    before.close()
+
+    assert rebalance(data_dir, 2, 1) == 20
+    assert not os.path.exists(shard_root(data_dir, 1) + ".tmp")
+    after = create_vector_store(data_dir, 1)
+    assert not isinstance(after, ShardedVectorStore)
+    assert history(after, 4) == expected
+    after.close()
+    with pytest.raises(SystemExit, match="already holds"):
+        rebalance(data_dir, 2, 1)
+
+
+def test_batched_search_is_routed_per_shard(monkeypatch, sharded, make_turns):
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(Config, "WRITE_BEHIND_INTERVAL", 60)
+    store = sharded(3)
+    store.add_conversations(make_turns(40, users=8))
+    store.add_conversation("u5", "pending question about topic 9", "queued answer")
+    queries = [(f"u{k}", f"question about topic {k % 5}") for k in range(9)] + [("u5", "pending question")]
+    batched = store.search_many(queries, 2)
+    assert batched == [store.search_similar(user_id, query, 2) for user_id, query in queries]
+    assert batched[-1][0]["assistant_response"] == "queued answer" and batched[8] == []
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from config import Config
+from utils.snapshot import Snapshot, snapshot_rows, write_snapshot
+
+MODES = ["append", "sqlite", "json"]
+
+
+def live_rows(store):
+    rows = sorted(row for rows in store.user_index.values() for row in rows)
+    return [store.conversations[row] for row in rows]
+
+
+def test_write_snapshot_of_no_rows(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    columns = snapshot_rows([], [])
+    write_snapshot(path, 0, 8, {"rows": 0}, columns, embeddings=np.empty((0, 8), dtype=np.float32))
+    snapshot = Snapshot.open(path)
+    assert snapshot.rows == 0
+    assert snapshot.embeddings().shape == (0, 8)
+    assert snapshot.ids() == [] and snapshot.user_rows() == {}
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_round_trip(open_store, make_turns, mode):
+    store = open_store(mode)
+    store.add_conversations(make_turns(30))
+    store.delete_user("u1")
+    expected = live_rows(store)
+    assert store.save_snapshot()
+    store.close()
+
+    warm = open_store(mode)
+    assert warm.warm_start
+    assert live_rows(warm) == expected
+    assert warm.get_conversation_count() == len(expected)
+    assert warm.search_similar("u0", "question 3", 1)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_empty_store_snapshot(open_store, mode):
+    store = open_store(mode)
+    store.save_snapshot()
+    store.close()
+    assert os.path.exists(store.snapshot_file)
+
+    warm = open_store(mode)
+    assert warm.get_conversation_count() == 0
+    assert warm.search_similar("u0", "anything") == []
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_all_rows_deleted_snapshot(open_store, make_turns, mode):
+    store = open_store(mode)
+    store.add_conversations(make_turns(12, users=2))
+    store.delete_user("u0")
+    store.delete_user("u1")
+    store.close()
+    assert os.path.exists(store.snapshot_file)
+
+    warm = open_store(mode)
+    assert warm.get_conversation_count() == 0
+    assert live_rows(warm) == []
+    warm.add_conversation("u0", "hello again", "hi")
+    assert [c["user_message"] for c in warm.search_similar("u0", "hello")] == ["hello again"]
+
+
+def test_corrupt_snapshot_falls_back_to_storage(open_store, make_turns):
+    store = open_store("append")
+    store.add_conversations(make_turns(10))
+    store.close()
+    with open(store.snapshot_file, 'r+b') as f:
+        f.seek(-3, os.SEEK_END)
+        f.write(b"xyz")
+
+    cold = open_store("append")
+    assert not cold.warm_start
+    assert cold.get_conversation_count() == 10
+
+
+def test_snapshot_disabled(open_store, make_turns, monkeypatch):
+    monkeypatch.setattr(Config, "SNAPSHOT", False)
+    store = open_store("append")
+    store.add_conversations(make_turns(5))
+    store.close()
+    assert not os.path.exists(store.snapshot_file)
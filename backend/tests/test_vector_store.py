@@ -0,0 +1,97 @@
+import pytest
+
+from config import Config
+
+MODES = ("json", "sqlite", "append")
+
+
+def fixed_turns(make_turns, n, tag="turn"):
+    # Ids and timestamps given, so stores in different modes hold the same rows
+    return [dict(turn, id=f"{tag}-{i:03d}", timestamp=f"2024-05-01T12:{i // 60:02d}:{i % 60:02d}")
+            for i, turn in enumerate(make_turns(n, users=4, tag=tag))]
+
+
+def state(store):
+    users = [f"u{k}" for k in range(4)]
+    return {
+        "count": store.get_conversation_count(),
+        "counts": [store.get_conversation_count(user_id) for user_id in users],
+        "recent": [[c["id"] for c in store.get_user_conversations(user_id, 5)] for user_id in users],
+        "search": [[c["id"] for c in store.search_similar(user_id, "question about topic 2", 3)]
+                   for user_id in users],
+    }
+
+
+def test_storage_modes_agree(tmp_path, open_store, make_turns):
+    states = {}
+    for mode in MODES:
+        store = open_store(mode, data_dir=tmp_path / mode)
+        store.add_conversations(fixed_turns(make_turns, 30))
+        store.add_conversations([{"user_id": "u1", "message": "one more question about topic 2",
+                                  "response": "sure", "id": "extra", "timestamp": "2024-05-02T00:00:00"}])
+        store.delete_user("u2")
+        states[mode] = state(store)
+        store.compact()
+        assert state(store) == states[mode]
+        store.close()
+        # Reopened (warm from the snapshot or cold from storage) it still agrees
+        assert state(open_store(mode, data_dir=tmp_path / mode)) == states[mode]
+    reference = states["sqlite"]
+    assert reference["counts"][2] == 0 and reference["count"] == 31 - 7
+    assert reference["recent"][1][0] == "extra"
+    assert states["json"] == states["append"] == reference
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_deleted_turns_leave_search_at_once(open_store, make_turns, mode):
+    store = open_store(mode)
+    store.add_conversations(fixed_turns(make_turns, 20))
+    assert store.search_similar("u1", "question about topic 1", 3)
+    assert store.delete_user("u1") == 5
+    assert store.search_similar("u1", "question about topic 1", 3) == []
+    assert store.get_user_conversations("u1") == []
+    assert store.get_conversation_count("u1") == 0
+    assert store.delete_user("u1") == 0
+    # Other users are untouched, before and after the rows are reclaimed
+    assert store.get_conversation_count() == 15
+    store.compact()
+    assert store.get_conversation_count() == 15
+    assert len(store.search_similar("u0", "question about topic 0", 10)) == 5
+
+
+@pytest.mark.parametrize("mode", ("sqlite", "append"))
+def test_deletes_reach_other_workers(open_store, make_turns, mode):
+    store = open_store(mode)
+    other = open_store(mode)
+    store.add_conversations(fixed_turns(make_turns, 20))
+    other.refresh()
+    assert other.get_conversation_count("u3") == 5
+    store.delete_user("u3")
+    other.refresh()
+    assert other.get_conversation_count("u3") == 0
+    assert other.search_similar("u3", "question about topic 3", 3) == []
+    # A new turn of the deleted user is kept
+    other.add_conversation("u3", "starting over", "welcome back")
+    store.refresh()
+    assert [c["user_message"] for c in store.get_user_conversations("u3")] == ["starting over"]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_batched_search_matches_single_searches(open_store, monkeypatch, make_turns, mode):
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(Config, "WRITE_BEHIND_INTERVAL", 60)
+    store = open_store(mode)
+    store.add_conversations(fixed_turns(make_turns, 40))
+    # Still queued: one user with stored turns too, one with nothing else
+    store.add_conversation("u1", "pending question about topic 2", "queued answer")
+    store.add_conversation("fresh", "brand new question about topic 4", "queued too")
+    assert len(store.write_queue.pending()) == 2
+    queries = [(user_id, f"question about topic {t}") for user_id in ("u0", "u1", "fresh", "nobody")
+               for t in (2, 4)] + [("u1", "pending question"), ("u3", "answer 7")]
+    batched = store.search_many(queries, 3)
+    assert batched == [store.search_similar(user_id, query, 3) for user_id, query in queries]
+    assert ["\n\n".join(c["text"] for c in found) for found in batched] == [
+        store.search_similar_conversations(user_id, query, 3) for user_id, query in queries]
+    assert batched[queries.index(("u1", "pending question"))][0]["assistant_response"] == "queued answer"
+    assert batched[queries.index(("fresh", "question about topic 4"))][0]["user_id"] == "fresh"
+    assert batched[queries.index(("nobody", "question about topic 2"))] == []
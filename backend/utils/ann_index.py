@@ -0,0 +1,116 @@
+import os
+import threading
+import numpy as np
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class IVFIndex:
+    """Inverted-file ANN index over one user's rows, in pure NumPy.
+
+    Rows are clustered with spherical k-means into ~sqrt(n) lists. A
+    query is compared with the centroids, and only rows in the
+    ``n_probe`` closest lists are returned as candidates for exact
+    scoring, which touches roughly n_probe / n_lists of the user's rows.
+    New rows are assigned to their nearest centroid on insert; the
+    centroids themselves are retrained once the user has doubled in size.
+    """
+
+    def __init__(self, dim, n_probe=8):
+        self.dim = dim
+        self.n_probe = n_probe
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self.row_ids = np.empty(0, dtype=np.int64)
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self._lists = None
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @property
+    def max_row(self):
+        return int(self.row_ids.max()) if len(self.row_ids) else -1
+
+    def needs_retrain(self):
+        return len(self) >= 2 * self.trained_rows
+
+    def train(self, vectors, row_ids, iterations=10, seed=0):
+        """Fit centroids on ``vectors`` and index them under ``row_ids``"""
+        vectors = _normalize(vectors)
+        rng = np.random.default_rng(seed)
+        n_lists = max(1, int(np.sqrt(len(vectors))))
+        sample = vectors
+        if len(vectors) > 256 * n_lists:
+            sample = vectors[rng.choice(len(vectors), 256 * n_lists, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            # Re-seed empty lists from random points so none stay dead
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.row_ids = np.asarray(row_ids, dtype=np.int64)
+        self.assignments = self._assign(vectors)
+        self.trained_rows = len(vectors)
+        self._lists = None
+
+    def _assign(self, vectors, chunk=8192):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk]
+            labels[start:start + chunk] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, vectors, row_ids):
+        """Assign new rows to their nearest existing centroid"""
+        vectors = _normalize(np.asarray(vectors).reshape(-1, self.dim))
+        self.row_ids = np.concatenate([self.row_ids, np.asarray(row_ids, dtype=np.int64)])
+        self.assignments = np.concatenate([self.assignments, self._assign(vectors)])
+        self._lists = None
+
+    def remap(self, new_rows):
+        """Renumber rows after compaction; ``new_rows[old]`` is -1 for dropped rows"""
+        mapped = new_rows[self.row_ids] if len(self.row_ids) else self.row_ids
+        keep = mapped >= 0
+        self.row_ids = mapped[keep].astype(np.int64)
+        self.assignments = self.assignments[keep]
+        self._lists = None
+
+    def candidates(self, query):
+        """Row ids in the ``n_probe`` lists closest to ``query``"""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, bounds)
+        order, bounds = self._lists
+        scores = self.centroids @ _normalize(query).reshape(-1)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe = np.argpartition(-scores, n_probe - 1)[:n_probe]
+        picked = np.concatenate([order[bounds[c]:bounds[c + 1]] for c in probe])
+        return np.sort(self.row_ids[picked])
+
+    def save(self, path):
+        # Per-thread temp name: concurrent searches may save the same user's index
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp.npz"
+        np.savez(tmp, centroids=self.centroids, row_ids=self.row_ids,
+                 assignments=self.assignments, trained_rows=self.trained_rows)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, dim, n_probe=8):
+        index = cls(dim, n_probe)
+        with np.load(path) as data:
+            index.centroids = data["centroids"]
+            index.row_ids = data["row_ids"]
+            index.assignments = data["assignments"]
+            index.trained_rows = int(data["trained_rows"])
+        return index
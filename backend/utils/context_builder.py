@@ -0,0 +1,94 @@
+import re
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def estimate_tokens(text):
+    """Cheap local token count: words and punctuation marks, no tokenizer needed"""
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+def _words(text):
+    return set(re.findall(r"\w+", (text or "").lower()))
+
+
+class ContextBuilder:
+    """Assembles the memory context for a prompt within a token budget.
+
+    Candidates are the session's last ``recent_turns`` turns plus the
+    retrieved similar turns. Turns that repeat one another are dropped,
+    long assistant replies are cut down to their sentences that share
+    the most words with the query, and turns are added (most recent
+    first, then by retrieval rank) until ``budget`` tokens are used.
+    """
+
+    def __init__(self, budget=1000, recent_turns=2, reply_tokens=120, overlap=0.8):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self.reply_tokens = reply_tokens
+        self.overlap = overlap
+
+    def _duplicate(self, conv, kept):
+        words = _words(conv["user_message"])
+        for other in kept:
+            if conv["id"] == other["id"]:
+                return True
+            other_words = _words(other["user_message"])
+            union = words | other_words
+            if union and len(words & other_words) / len(union) >= self.overlap:
+                return True
+        return False
+
+    def _trim_reply(self, reply, query_words):
+        """The reply's most query-relevant sentences (in original order) within reply_tokens"""
+        if estimate_tokens(reply) <= self.reply_tokens:
+            return reply
+        sentences = [s for s in _SENTENCE_RE.split(reply) if s.strip()]
+        scores = [len(_words(sentence) & query_words) for sentence in sentences]
+        ranked = sorted(range(len(sentences)), key=lambda i: (-scores[i], i))
+        if scores and max(scores) > 0:
+            # Sentences unrelated to the query aren't worth their tokens
+            ranked = [i for i in ranked if scores[i] > 0]
+        chosen, used = [], 0
+        for i in ranked:
+            tokens = estimate_tokens(sentences[i])
+            if used + tokens > self.reply_tokens:
+                continue
+            chosen.append(i)
+            used += tokens
+        if not chosen:
+            # A single huge sentence: keep its head
+            return " ".join(reply.split()[:self.reply_tokens]) + " ..."
+        return " ".join(sentences[i] for i in sorted(chosen)) + " ..."
+
+    def build(self, query, retrieved, recent=()):
+        """Returns (context, stats); ``recent`` is newest first, ``retrieved`` best first"""
+        recent = list(recent)[:self.recent_turns]
+        # What joining every candidate verbatim would have cost
+        raw_tokens = sum(estimate_tokens(conv["text"])
+                         for conv in {c["id"]: c for c in recent + list(retrieved)}.values())
+        query_words = _words(query)
+
+        kept, parts, used = [], {}, 0
+        for conv in recent + list(retrieved):
+            if self._duplicate(conv, kept):
+                continue
+            text = (f"User: {conv['user_message']}\n"
+                    f"Assistant: {self._trim_reply(conv['assistant_response'], query_words)}")
+            tokens = estimate_tokens(text)
+            if used + tokens > self.budget:
+                continue
+            kept.append(conv)
+            parts[conv["id"]] = text
+            used += tokens
+
+        # Relevant older turns first, then the latest exchange in chronological order
+        recent_ids = [conv["id"] for conv in reversed(recent)]
+        order = [conv["id"] for conv in retrieved if conv["id"] not in recent_ids] + recent_ids
+        context = "\n\n".join(parts[i] for i in order if i in parts)
+        return context, {
+            "context_tokens": estimate_tokens(context),
+            "tokens_saved": max(0, raw_tokens - estimate_tokens(context)),
+            "turns_used": len(parts),
+        }
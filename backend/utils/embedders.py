@@ -0,0 +1,243 @@
+import json
+import os
+import numpy as np
+import scipy.sparse as sp
+from config import Config
+
+# sklearn is imported on first use, not at startup: it takes about a second to import
+
+
+def _tfidf_vectorizer(**kwargs):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(stop_words='english', **kwargs)
+
+
+class HashingEmbedder:
+    """Stateless embedder: hashed term counts, L2-normalised.
+
+    There is nothing to fit or persist, so startup is constant-time and
+    every process (and every restart) maps the same text to the same
+    vector.
+    """
+
+    name = "hashing"
+    stateful = False
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._vectorizer = None
+
+    @property
+    def vectorizer(self):
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(n_features=self.dim, alternate_sign=False,
+                                                 norm='l2', stop_words='english')
+        return self._vectorizer
+
+    def load(self, texts_fn):
+        pass
+
+    def fit(self, texts):
+        pass
+
+    def refresh(self):
+        return False
+
+    def observe(self, texts):
+        pass
+
+    def needs_refit(self, rows):
+        return False
+
+    def state(self):
+        return None
+
+    def load_state(self, state):
+        pass
+
+    def embed(self, texts):
+        return self.embed_sparse(texts).toarray()
+
+    def embed_sparse(self, texts):
+        return self.vectorizer.transform(texts).astype(np.float32).tocsr()
+
+
+class TfidfEmbedder:
+    """TF-IDF embedder whose fitted vocabulary and idf weights are persisted.
+
+    It is only ever fitted on stored turns, never on a query: until the
+    first fit every text embeds to zeros. The owning store calls
+    ``needs_refit()`` as turns arrive and refits (and re-embeds) once the
+    corpus has grown ``refit_growth`` times since the last fit, or the
+    share of out-of-vocabulary words in newly stored text exceeds the
+    fit corpus's own share by ``refit_oov``. Growing geometrically keeps
+    the re-embedding cost amortized O(1) per turn.
+
+    The state is written to ``state_file`` when fitted and reloaded on
+    startup (and when another worker refits), so query embeddings keep
+    using the vocabulary the stored embeddings were built with.
+    """
+
+    name = "tfidf"
+    stateful = True
+    # Newly stored words to see before the out-of-vocabulary share is trusted
+    OOV_MIN_TOKENS = 500
+
+    def __init__(self, dim, state_file, refit_growth=2.0, refit_oov=0.2):
+        self.dim = dim
+        self.state_file = state_file
+        self.refit_growth = refit_growth
+        self.refit_oov = refit_oov
+        self.vectorizer = None
+        self.fitted = False
+        self.fitted_rows = 0
+        self.fitted_oov = 0.0
+        self._texts_fn = None
+        self._stamp = None
+        self._seen_tokens = 0
+        self._oov_tokens = 0
+
+    def load(self, texts_fn):
+        """Remember where the corpus comes from; the state is restored on first embed"""
+        self._texts_fn = texts_fn
+
+    def _restore(self):
+        """Restore the persisted vocabulary, or fit once on the corpus and persist it"""
+        texts_fn, self._texts_fn = self._texts_fn, None
+        if self._read_state():
+            return
+        texts = texts_fn() if texts_fn else []
+        if texts:
+            self.fit(texts)
+
+    def _read_state(self):
+        if not os.path.exists(self.state_file):
+            return False
+        try:
+            stamp = self._file_stamp()
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self._set_state(json.load(f))
+            self._stamp = stamp
+            return True
+        except Exception as e:
+            print(f"Error loading {self.state_file}: {e}")
+            return False
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.state_file)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def refresh(self):
+        """Reload the state if another worker refitted since; returns whether it changed"""
+        if self._texts_fn is not None or self._file_stamp() in (None, self._stamp):
+            return False
+        return self._read_state()
+
+    def fit(self, texts, save=True):
+        """Fit on stored texts (the whole corpus) and persist the state (or leave that to save())"""
+        self._texts_fn = None
+        self.vectorizer = _tfidf_vectorizer(max_features=self.dim)
+        self.vectorizer.fit(texts)
+        self.fitted = True
+        self.fitted_rows = len(texts)
+        self.fitted_oov = self._oov_share(texts)[0]
+        self._seen_tokens = self._oov_tokens = 0
+        if save:
+            self.save()
+
+    def _oov_share(self, texts):
+        """(share of ``texts``' words outside the vocabulary, number of words)"""
+        analyze = self.vectorizer.build_analyzer()
+        vocabulary = self.vectorizer.vocabulary_
+        tokens = oov = 0
+        for text in texts:
+            for token in analyze(text):
+                tokens += 1
+                oov += token not in vocabulary
+        return (oov / tokens if tokens else 0.0), tokens
+
+    def observe(self, texts):
+        """Count the out-of-vocabulary words of turns about to be stored"""
+        if self._texts_fn is not None:
+            self._restore()
+        if not self.fitted:
+            return
+        share, tokens = self._oov_share(texts)
+        self._seen_tokens += tokens
+        self._oov_tokens += share * tokens
+
+    def needs_refit(self, rows):
+        """Whether a corpus of ``rows`` stored turns should be refitted and re-embedded"""
+        if self._texts_fn is not None:
+            self._restore()
+        if not self.fitted:
+            return rows > 0
+        if rows >= self.refit_growth * max(self.fitted_rows, 1):
+            return True
+        return (self._seen_tokens >= self.OOV_MIN_TOKENS
+                and self._oov_tokens / self._seen_tokens > self.fitted_oov + self.refit_oov)
+
+    def _set_state(self, state):
+        self.vectorizer = _tfidf_vectorizer(vocabulary=state["vocabulary"])
+        self.vectorizer.idf_ = np.array(state["idf"])
+        self.fitted = True
+        # States written before refitting existed don't record their corpus: refit on the next check
+        self.fitted_rows = state.get("rows", 0)
+        self.fitted_oov = state.get("oov", 0.0)
+        self._seen_tokens = self._oov_tokens = 0
+
+    def state(self):
+        """The fitted vocabulary and idf weights (None before the first fit)"""
+        if not self.fitted:
+            return None
+        return {
+            "vocabulary": {term: int(i) for term, i in self.vectorizer.vocabulary_.items()},
+            "idf": self.vectorizer.idf_.tolist(),
+            "rows": self.fitted_rows,
+            "oov": self.fitted_oov,
+        }
+
+    def load_state(self, state):
+        """Use ``state`` (e.g. from a snapshot) if the state file is missing, instead of refitting"""
+        if state is None or self.fitted or os.path.exists(self.state_file):
+            return
+        self._texts_fn = None
+        self._set_state(state)
+        self.save()
+
+    def save(self):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state(), f, ensure_ascii=False)
+        os.replace(tmp, self.state_file)
+        self._stamp = self._file_stamp()
+
+    def embed(self, texts):
+        return self.embed_sparse(texts).toarray()
+
+    def embed_sparse(self, texts):
+        if self._texts_fn is not None:
+            self._restore()
+        if not self.fitted:
+            # Nothing stored to fit on yet; the store refits once turns arrive
+            return sp.csr_matrix((len(texts), self.dim), dtype=np.float32)
+        embeddings = self.vectorizer.transform(texts).astype(np.float32).tocsr()
+
+        # Ensure consistent dimensions (vocabulary may be smaller than dim)
+        embeddings = embeddings[:, :self.dim]
+        embeddings.resize((embeddings.shape[0], self.dim))
+        return embeddings
+
+
+def create_embedder(name, dim, data_dir):
+    """Build the embedder selected by ``name`` ("hashing" or "tfidf")"""
+    if name == "hashing":
+        return HashingEmbedder(dim)
+    if name == "tfidf":
+        return TfidfEmbedder(dim, os.path.join(data_dir, "tfidf_state.json"),
+                             Config.TFIDF_REFIT_GROWTH, Config.TFIDF_REFIT_OOV)
+    raise ValueError(f"Unknown embedder: {name}")
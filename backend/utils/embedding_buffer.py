@@ -0,0 +1,294 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+
+
+class EmbeddingBuffer:
+    """Row-appendable embedding matrix with amortized O(1) growth.
+
+    Rows live in a preallocated array whose capacity doubles when full, so
+    appending a turn no longer copies the whole matrix the way np.vstack
+    did. Only the first ``len(self)`` rows are live; ``rows`` returns a
+    view of them. Capacity never exceeds max(min_capacity, 2 * rows), which
+    bounds the slack memory.
+    """
+
+    def __init__(self, dim, initial=None, min_capacity=1024, dtype=np.float64):
+        self.dim = dim
+        self.min_capacity = min_capacity
+        self.dtype = np.dtype(dtype)
+        initial = np.empty((0, dim), dtype=self.dtype) if initial is None else initial
+        initial = np.asarray(initial, dtype=self.dtype).reshape(-1, dim)
+        self._length = initial.shape[0]
+        self._data = np.empty((self._capacity_for(self._length), dim), dtype=self.dtype)
+        self._data[:self._length] = initial
+        self.grow_count = 0
+
+    def _capacity_for(self, rows):
+        capacity = self.min_capacity
+        while capacity < rows:
+            capacity *= 2
+        return capacity
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def rows(self):
+        """View of the live rows (no copy)"""
+        return self._data[:self._length]
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    def _reserve(self, rows):
+        if rows <= self.capacity:
+            return
+        data = np.empty((self._capacity_for(rows), self.dim), dtype=self.dtype)
+        data[:self._length] = self._data[:self._length]
+        self._data = data
+        self.grow_count += 1
+
+    def append(self, row):
+        self.extend(np.asarray(row).reshape(1, self.dim))
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.dim)
+        end = self._length + rows.shape[0]
+        self._reserve(end)
+        self._data[self._length:end] = rows
+        self._length = end
+
+    def stats(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        used = self._length * row_bytes
+        allocated = self.capacity * row_bytes
+        return {
+            "rows": self._length,
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "dtype": str(self.dtype),
+            "bytes_used": used,
+            "bytes_allocated": allocated,
+            "overhead_bytes": allocated - used,
+            "grow_count": self.grow_count,
+        }
+
+
+class MappedEmbeddings:
+    """Append-only float32 embedding file read through a memory map.
+
+    Row i of the file belongs to row i of the store. Opening costs no
+    reads: pages are faulted in on demand and shared through the OS page
+    cache by every worker mapping the same file. Appends go straight to
+    the file; ``refresh()`` picks up rows written by other processes by
+    checking the file size, and the map is rebuilt lazily on next access.
+    """
+
+    def __init__(self, path, dim, dtype=np.float32):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = dim * self.dtype.itemsize
+        self._map = None
+        self._mapped_length = -1
+        self.remap_count = 0
+        if not os.path.exists(path):
+            open(path, 'ab').close()
+        self._inode = os.stat(path).st_ino
+        self._length = os.path.getsize(path) // self.row_bytes
+
+    def __len__(self):
+        return self._length
+
+    def refresh(self):
+        """Pick up rows appended (or a file replaced) by other processes; returns the row count"""
+        stat = os.stat(self.path)
+        if stat.st_ino != self._inode:
+            self._inode = stat.st_ino
+            self._mapped_length = -1
+            self._length = stat.st_size // self.row_bytes
+        else:
+            self._length = max(self._length, stat.st_size // self.row_bytes)
+        return self._length
+
+    def replace(self, blocks):
+        """Atomically swap in a new file built from an iterable of row blocks"""
+        tmp = self.path + ".tmp"
+        rows = 0
+        with open(tmp, 'wb') as f:
+            for block in blocks:
+                block = np.ascontiguousarray(block, dtype=self.dtype).reshape(-1, self.dim)
+                f.write(block.tobytes())
+                rows += block.shape[0]
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._inode = os.stat(self.path).st_ino
+        self._mapped_length = -1
+        self._length = rows
+
+    def truncate(self, rows):
+        """Drop rows past ``rows`` (e.g. written before a crash, without their record)"""
+        self._map = None
+        self._mapped_length = -1
+        with open(self.path, 'r+b') as f:
+            f.truncate(rows * self.row_bytes)
+        self._length = rows
+
+    @property
+    def rows(self):
+        """Read-only mapped view of the live rows"""
+        # Read the length once and check the map's own size: an append from
+        # another thread mustn't leave (or hand out) a short map as current
+        length, mapped = self._length, self._map
+        if self._mapped_length != length or mapped is None or len(mapped) != length:
+            if length == 0:
+                mapped = np.empty((0, self.dim), dtype=self.dtype)
+            else:
+                mapped = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(length, self.dim))
+            self._map, self._mapped_length = mapped, length
+            self.remap_count += 1
+        return mapped
+
+    def append(self, row):
+        self.extend(np.asarray(row).reshape(1, self.dim))
+
+    def extend(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape(-1, self.dim)
+        with open(self.path, 'ab') as f:
+            f.write(rows.tobytes())
+        self._length += rows.shape[0]
+
+    def stats(self):
+        return {
+            "rows": self._length,
+            "dim": self.dim,
+            "dtype": str(self.dtype),
+            "bytes_on_disk": os.path.getsize(self.path),
+            "bytes_used": self._length * self.row_bytes,
+            "bytes_allocated": 0,  # pages live in the shared OS page cache
+            "overhead_bytes": 0,
+            "memory_mapped": True,
+            "remap_count": self.remap_count,
+        }
+
+
+class SparseEmbeddings:
+    """Embedding rows kept as a CSR matrix.
+
+    TF-IDF/hashing vectors for a chat turn touch only a handful of terms,
+    so storing (data, indices, indptr) costs a few dozen bytes per row
+    instead of ``dim`` floats. The three arrays grow by doubling like
+    EmbeddingBuffer, so appends are amortized O(nnz) and ``rows`` builds
+    a CSR view over them without copying. Sealed rows are persisted to
+    ``path`` as a scipy .npz in one batch (when the segment log rolls).
+    """
+
+    def __init__(self, path, dim, dtype=np.float32):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._reset()
+
+    def _reset(self):
+        self._data = np.empty(4096, dtype=self.dtype)
+        self._indices = np.empty(4096, dtype=np.int32)
+        self._indptr = np.zeros(1025, dtype=np.int64)
+        self._length = 0
+        self.grow_count = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def nnz(self):
+        return int(self._indptr[self._length])
+
+    @property
+    def rows(self):
+        """CSR view of the live rows"""
+        nnz = self.nnz
+        return sp.csr_matrix((self._data[:nnz], self._indices[:nnz],
+                              self._indptr[:self._length + 1]),
+                             shape=(self._length, self.dim), copy=False)
+
+    def _grow(self, array, needed):
+        if needed <= len(array):
+            return array
+        size = len(array)
+        while size < needed:
+            size *= 2
+        grown = np.empty(size, dtype=array.dtype)
+        grown[:len(array)] = array
+        self.grow_count += 1
+        return grown
+
+    def append(self, row):
+        self.extend(row)
+
+    def extend(self, rows):
+        rows = rows if sp.issparse(rows) else np.asarray(rows).reshape(-1, self.dim)
+        rows = sp.csr_matrix(rows, dtype=self.dtype)
+        rows.sum_duplicates()
+        nnz, end = self.nnz, self._length + rows.shape[0]
+        self._data = self._grow(self._data, nnz + rows.nnz)
+        self._indices = self._grow(self._indices, nnz + rows.nnz)
+        self._indptr = self._grow(self._indptr, end + 1)
+        self._data[nnz:nnz + rows.nnz] = rows.data
+        self._indices[nnz:nnz + rows.nnz] = rows.indices
+        self._indptr[self._length + 1:end + 1] = nnz + rows.indptr[1:]
+        self._length = end
+
+    def append_record(self, record):
+        """Append a row stored inline in a log record as {"indices", "values"}"""
+        row = sp.csr_matrix((record["values"], record["indices"], [0, len(record["indices"])]),
+                            shape=(1, self.dim))
+        self.extend(row)
+
+    @staticmethod
+    def to_record(row):
+        row = sp.csr_matrix(row)
+        return {"indices": row.indices.tolist(), "values": row.data.tolist()}
+
+    def load(self, upto):
+        """Fill rows ``len(self):upto`` from the persisted .npz"""
+        if upto <= self._length or not os.path.exists(self.path):
+            return
+        matrix = sp.load_npz(self.path).tocsr()
+        self.extend(matrix[self._length:upto])
+
+    def save(self):
+        tmp = self.path[:-len(".npz")] + ".tmp.npz"
+        sp.save_npz(tmp, self.rows, compressed=False)
+        os.replace(tmp, self.path)
+
+    def refresh(self):
+        # Rows arrive through log records or load(); nothing to poll
+        return self._length
+
+    def truncate(self, rows):
+        self._length = min(rows, self._length)
+
+    def replace(self, blocks):
+        self._reset()
+        for block in blocks:
+            self.extend(block)
+        self.save()
+
+    def stats(self):
+        used = self.nnz * (self.dtype.itemsize + 4) + (self._length + 1) * 8
+        allocated = (self._data.nbytes + self._indices.nbytes + self._indptr.nbytes)
+        return {
+            "rows": self._length,
+            "dim": self.dim,
+            "dtype": str(self.dtype),
+            "format": "csr",
+            "nnz": self.nnz,
+            "bytes_used": used,
+            "bytes_allocated": allocated,
+            "overhead_bytes": allocated - used,
+            "dense_equivalent_bytes": self._length * self.dim * self.dtype.itemsize,
+            "grow_count": self.grow_count,
+        }
@@ -1,7 +1,34 @@
-import google.generativeai as genai
+import asyncio
+import json
+import os
+import threading
 import time
 import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
 from config import Config
+from utils.context_builder import estimate_tokens
+from utils.log import get_logger
+from utils.metrics import metrics
+from utils.rate_limiter import QuotaRejected, QuotaScheduler, is_quota_error
+from utils.response_cache import ResponseCache, cache_key
+
+log = get_logger('gemini')
+metrics.describe('gemini_call_seconds', 'Latency of successful Gemini calls per model')
+metrics.describe('gemini_fallbacks_total', 'Demo/quota fallback responses by reason')
+metrics.describe('gemini_cache_hits_total', 'Responses served from the response cache')
+metrics.describe('gemini_quota_errors_total', 'Quota errors returned by the Gemini API')
+
+# Free tier models (usually have higher quotas), in order of preference
+FREE_TIER_MODELS = [
+    'gemini-2.0-flash-001',      # Stable free tier model
+    'gemini-2.0-flash-lite-001', # Lightweight free tier
+    'gemini-1.5-flash',          # If available
+    'gemini-1.5-pro',            # If available
+]
+
+class DeadlineExceeded(TimeoutError):
+    """No model answered within GEMINI_CALL_DEADLINE"""
 
 class GeminiClient:
     def __init__(self):
@@ -10,68 +37,603 @@ class GeminiClient:
         if not self.api_key or self.api_key == 'your_google_gemini_api_key_here':
             raise Exception("Please set GOOGLE_API_KEY in your .env file")
         
-        genai.configure(api_key=self.api_key)
-        self.model = self._setup_free_tier_model()
-    
-    def _setup_free_tier_model(self):
-        """Setup a model that works with free tier quotas"""
-        # Free tier models (usually have higher quotas)
-        free_tier_models = [
-            'gemini-2.0-flash-001',      # Stable free tier model
-            'gemini-2.0-flash-lite-001', # Lightweight free tier
-            'gemini-1.5-flash',          # If available
-            'gemini-1.5-pro',            # If available
-        ]
+        # Model selection is lazy: nothing is imported or probed until the first request
+        self.cache_file = Config.MODEL_CACHE_FILE
+        self._genai = None
+        self._model = None
+        self._model_name = None
+        self._selected = False
+        self._probed_at = 0
+        self._select_lock = threading.Lock()
+        self._reprobe_thread = None
+        self._demoted = {}
+        
+        # Calls run on a small pool so they can be bounded by a deadline and hedged
+        self._executor = None
+        self._models = {}
+        self.latency = {}  # model name -> LatencyHistogram of successful calls
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.deadline_exceeded = 0
+        
+        # Client-side RPM/TPM budget, retry policy and single-flight for API calls
+        self.scheduler = QuotaScheduler(
+            rpm=Config.GEMINI_RPM,
+            tpm=Config.GEMINI_TPM,
+            max_wait=Config.GEMINI_MAX_QUEUE_WAIT,
+            max_retries=Config.GEMINI_MAX_RETRIES,
+        )
+        
+        # Cache of real model answers keyed by normalized prompt + context
+        self.cache = None
+        if Config.RESPONSE_CACHE_ENABLED:
+            self.cache = ResponseCache(
+                max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+                max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+                ttl=Config.RESPONSE_CACHE_TTL,
+                disk_path=Config.RESPONSE_CACHE_DISK_PATH or None,
+            )
+    
+    def _get_genai(self):
+        """Import and configure google.generativeai on first use"""
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+    
+    @property
+    def model(self):
+        """The selected model (None in demo mode), chosen on first access"""
+        if not self._selected:
+            with self._select_lock:
+                if not self._selected:
+                    self._select_model()
+                    self._selected = True
+        elif self._model is None and time.time() - self._probed_at >= Config.MODEL_RETRY_BACKOFF:
+            # Demo mode: look for a working model again, without holding up this request
+            self._reprobe()
+        return self._model
+    
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"model": None, "checked_at": 0, "demoted": {}}
+    
+    def _save_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            tmp = self.cache_file + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            log.warning(f"Error saving model cache: {e}")
+    
+    def _select_model(self):
+        self._use_model(self._choose_model())
+    
+    def _choose_model(self):
+        """The cached probe result while it is fresh, otherwise probe; returns a model name.
+        
+        A cached "no model works" is only fresh for MODEL_RETRY_BACKOFF.
+        """
+        cache = self._load_cache()
+        ttl = Config.MODEL_PROBE_TTL if cache.get("model") else Config.MODEL_RETRY_BACKOFF
+        if time.time() - cache.get("checked_at", 0) < ttl:
+            self._demoted = cache.get("demoted", {})
+            self._probed_at = cache.get("checked_at", 0)
+            log.info(f"Using cached model choice: {cache.get('model') or 'demo mode'}")
+            return cache.get("model")
+        return self._setup_free_tier_model(cache)
+    
+    def _use_model(self, model_name):
+        self._model_name = model_name
+        self._model = self._get_genai().GenerativeModel(model_name) if model_name else None
+    
+    def _setup_free_tier_model(self, cache):
+        """Probe candidates in order, skipping recently demoted ones; returns a model name"""
+        now = time.time()
+        demoted = {name: at for name, at in cache.get("demoted", {}).items()
+                   if now - at < Config.MODEL_RETRY_BACKOFF}
+        chosen = None
         
         # Try each model
-        for model_name in free_tier_models:
+        for model_name in FREE_TIER_MODELS:
+            if model_name in demoted:
+                continue
             try:
-                model = genai.GenerativeModel(model_name)
-                # Quick test
-                test_response = model.generate_content("Say 'OK'")
-                print(f"SUCCESS: Using free-tier model: {model_name}")
-                return model
+                model = self._get_genai().GenerativeModel(model_name)
+                # Quick test, capped so the probe costs almost no quota
+                model.generate_content("Say 'OK'", generation_config={"max_output_tokens": 5})
+                log.info(f"✅ Using free-tier model: {model_name}")
+                chosen = model_name
+                break
             except Exception as e:
-                print(f"Model {model_name} failed: {e}")
+                log.warning(f"Model {model_name} failed: {e}")
+                demoted[model_name] = now
                 continue
         
-        # If no free tier models work, use demo mode
-        print("WARNING: No free-tier models available. Using demo mode.")
+        if chosen is None:
+            # If no free tier models work, use demo mode
+            log.warning("⚠️ No free-tier models available. Using demo mode.")
+        self._demoted = demoted
+        self._probed_at = now
+        self._save_cache({"model": chosen, "checked_at": now, "demoted": demoted})
+        return chosen
+    
+    def _demote_current_model(self):
+        """Mark the current model as failed and pick a replacement in the background.
+        
+        Requests keep using the current model (falling back to demo text on
+        errors) until the background probe has found the next working one.
+        The failed model is skipped for MODEL_RETRY_BACKOFF seconds.
+        """
+        self._reprobe(self._model_name)
+    
+    def _reprobe(self, failed=None):
+        """Pick a model again in the background, demoting ``failed`` first"""
+        if self._reprobe_thread is not None and self._reprobe_thread.is_alive():
+            return
+        
+        def reprobe():
+            if failed is None:
+                # Another worker may have found a model since
+                model_name = self._choose_model()
+            else:
+                cache = self._load_cache()
+                cache.setdefault("demoted", {})[failed] = time.time()
+                model_name = self._setup_free_tier_model(cache)
+            with self._select_lock:
+                self._use_model(model_name)
+        
+        self._reprobe_thread = threading.Thread(target=reprobe, name="model-reprobe", daemon=True)
+        self._reprobe_thread.start()
+    
+    def _get_model(self, model_name):
+        if model_name == self._model_name and self._model is not None:
+            return self._model
+        if model_name not in self._models:
+            self._models[model_name] = self._get_genai().GenerativeModel(model_name)
+        return self._models[model_name]
+    
+    def _pool(self):
+        if self._executor is None:
+            with self._select_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gemini")
+        return self._executor
+    
+    def _histogram(self, model_name):
+        histogram = self.latency.get(model_name)
+        if histogram is None:
+            # Shared with /metrics as gemini_call_seconds{model=...}
+            histogram = self.latency.setdefault(model_name,
+                                                metrics.histogram('gemini_call_seconds', model=model_name))
+        return histogram
+    
+    def _hedge_model_name(self, primary):
+        """Next model after ``primary`` in preference order that isn't demoted"""
+        if not Config.GEMINI_HEDGE or primary not in FREE_TIER_MODELS:
+            return None
+        now = time.time()
+        for model_name in FREE_TIER_MODELS[FREE_TIER_MODELS.index(primary) + 1:]:
+            if now - self._demoted.get(model_name, 0) >= Config.MODEL_RETRY_BACKOFF:
+                return model_name
         return None
     
-    def generate_response(self, prompt, context=""):
-        # If we have a real model, try to use it
-        if self.model:
-            try:
-                if context:
-                    full_prompt = f"""Based on our previous conversation:
+    def _hedge_delay(self, model_name):
+        """The model's observed p95 latency, or the configured default until there's enough data"""
+        histogram = self.latency.get(model_name)
+        if histogram is None or histogram.count < Config.GEMINI_HEDGE_MIN_SAMPLES:
+            return Config.GEMINI_HEDGE_DELAY
+        return max(Config.GEMINI_HEDGE_MIN_DELAY, histogram.quantile(0.95))
+    
+    def _timed_generate(self, model_name, full_prompt):
+        started = time.monotonic()
+        response = self._get_model(model_name).generate_content(full_prompt)
+        self._histogram(model_name).observe(time.monotonic() - started)
+        return model_name, response
+    
+    def _generate_hedged(self, full_prompt, tokens):
+        """Call the current model; if it is slower than its p95, also ask the next one.
+        
+        Returns ``(model_name, response)`` from whichever answers first, and
+        raises DeadlineExceeded if neither answers within the deadline. A
+        hedge costs a second request, so it is only sent when the quota
+        budget allows it right away. The losing call is left to finish in
+        the background.
+        """
+        primary = self._model_name
+        deadline = time.monotonic() + Config.GEMINI_CALL_DEADLINE
+        pending = {self._pool().submit(self._timed_generate, primary, full_prompt)}
+        hedge_name = self._hedge_model_name(primary)
+        hedge_at = time.monotonic() + self._hedge_delay(primary) if hedge_name else None
+        error = None
+        
+        while pending or hedge_at is not None:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    model_name, response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if model_name != primary:
+                    self.hedges_won += 1
+                    metrics.inc('gemini_hedges_won_total')
+                return model_name, response
+            
+            # Primary is slow (or already failed): send the same request to the next model
+            if hedge_at is not None and (done or time.monotonic() >= hedge_at):
+                hedge_at = None
+                try:
+                    self.scheduler.acquire(tokens, max_wait=0)
+                except QuotaRejected:
+                    continue
+                self.hedges_fired += 1
+                metrics.inc('gemini_hedges_total')
+                pending.add(self._pool().submit(self._timed_generate, hedge_name, full_prompt))
+        
+        if error is not None and not pending:
+            raise error
+        self.deadline_exceeded += 1
+        raise DeadlineExceeded(f"No response within {Config.GEMINI_CALL_DEADLINE:.0f}s")
+    
+    def latency_stats(self):
+        return {
+            "models": {name: histogram.stats() for name, histogram in list(self.latency.items())},
+            "hedge_delay_s": self._hedge_delay(self._model_name) if self._model_name else None,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "deadline_exceeded": self.deadline_exceeded,
+        }
+    
+    def _build_prompt(self, prompt, context=""):
+        if context:
+            return f"""Based on our previous conversation:
 
 {context}
 
 Current question: {prompt}
 
 Please provide a helpful response that considers our previous discussion."""
-                else:
-                    full_prompt = f"""User: {prompt}
+        return f"""User: {prompt}
 
 Please provide a helpful and friendly response."""
-                
-                response = self.model.generate_content(full_prompt)
+    
+    def _get_fallback_response(self, prompt, context, error):
+        """Demo text for a failed API call (quota-specific if it was a quota error)"""
+        error_msg = str(error)
+        log.warning(f"Gemini API Error: {error_msg}")
+        
+        # Our own budget ran out: the model is fine, don't demote it
+        if isinstance(error, QuotaRejected):
+            metrics.inc('gemini_fallbacks_total', reason='local_quota')
+            return self._get_quota_exceeded_response(prompt, context)
+        # The server's quota ran out: backpressure, not a broken model. The
+        # scheduler already retried it and now holds back the next calls.
+        if is_quota_error(error):
+            metrics.inc('gemini_quota_errors_total')
+            metrics.inc('gemini_fallbacks_total', reason='quota')
+            return self._get_quota_exceeded_response(prompt, context)
+        # Slow, not broken: hedging already tried the next model
+        if isinstance(error, DeadlineExceeded):
+            metrics.inc('gemini_fallbacks_total', reason='deadline')
+            return self._get_demo_response(prompt, context, f"API Error: {error_msg}")
+        self._demote_current_model()
+        metrics.inc('gemini_fallbacks_total', reason='error')
+        return self._get_demo_response(prompt, context, f"API Error: {error_msg}")
+    
+    def _estimate_tokens(self, full_prompt):
+        """Cheap local token estimate of the prompt plus the expected reply"""
+        return estimate_tokens(full_prompt) + Config.GEMINI_EXPECTED_OUTPUT_TOKENS
+    
+    def _record_usage(self, response, estimated):
+        usage = getattr(response, 'usage_metadata', None)
+        self.scheduler.record_usage(estimated, getattr(usage, 'total_token_count', None))
+    
+    def scheduler_stats(self):
+        return self.scheduler.stats()
+    
+    def _cache_key(self, prompt, context, use_cache):
+        if self.cache is None or not use_cache:
+            return None
+        return cache_key(prompt, context)
+    
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+    
+    def generate_response(self, prompt, context="", use_cache=True):
+        key = self._cache_key(prompt, context, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc('gemini_cache_hits_total')
+                return cached
+        
+        # If we have a real model, try to use it
+        if self.model:
+            try:
+                full_prompt = self._build_prompt(prompt, context)
+                tokens = self._estimate_tokens(full_prompt)
+                generate = lambda: self._generate_hedged(full_prompt, tokens)
+                if use_cache:
+                    # Identical concurrent prompts share one upstream call
+                    _, response = self.scheduler.call(cache_key(prompt, context), generate, tokens)
+                else:
+                    # Opted out of shared answers, including a concurrent caller's
+                    _, response = self.scheduler.run(generate, tokens)
+                self._record_usage(response, tokens)
+                # Only real model answers are cached, never demo/quota fallbacks
+                if key is not None:
+                    self.cache.put(key, response.text)
                 return response.text
-                
             except Exception as e:
-                error_msg = str(e)
-                print(f"Gemini API Error: {error_msg}")
+                return self._get_fallback_response(prompt, context, e)
+        
+        # No model available, use demo mode
+        metrics.inc('gemini_fallbacks_total', reason='no_model')
+        return self._get_demo_response(prompt, context)
+    
+    def generate_response_stream(self, prompt, context="", use_cache=True):
+        """Yield the response as text chunks as soon as Gemini produces them.
+        
+        Demo and quota fallbacks (and cache hits) are streamed word by word
+        so callers handle every path the same way.
+        """
+        key = self._cache_key(prompt, context, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc('gemini_cache_hits_total')
+                yield from self._stream_text(cached)
+                return
+        
+        if self.model:
+            sent_any = False
+            parts = []
+            try:
+                full_prompt = self._build_prompt(prompt, context)
+                tokens = self._estimate_tokens(full_prompt)
+                # Streams aren't hedged, but opening one and every later chunk are bounded by the deadline
+                response = self.scheduler.run(lambda: self._open_stream(full_prompt), tokens)
+                for chunk in self._iterate_with_deadline(response):
+                    text = chunk.text
+                    if text:
+                        sent_any = True
+                        parts.append(text)
+                        yield text
+                if key is not None:
+                    self.cache.put(key, "".join(parts))
+                return
+            except Exception as e:
+                if sent_any:
+                    # Part of the answer is already out; don't append a canned reply to it
+                    log.warning(f"Gemini stream interrupted: {e}")
+                    return
+                fallback = self._get_fallback_response(prompt, context, e)
+        else:
+            metrics.inc('gemini_fallbacks_total', reason='no_model')
+            fallback = self._get_demo_response(prompt, context)
+        
+        yield from self._stream_text(fallback)
+    
+    def _open_stream(self, full_prompt):
+        # Not timed: opening a stream says nothing about full-response latency
+        future = self._pool().submit(self.model.generate_content, full_prompt, stream=True)
+        try:
+            return future.result(timeout=Config.GEMINI_CALL_DEADLINE)
+        except FutureTimeout:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"No response within {Config.GEMINI_CALL_DEADLINE:.0f}s")
+    
+    def _iterate_with_deadline(self, stream):
+        """Yield the chunks of a stream, waiting at most GEMINI_CALL_DEADLINE for each one"""
+        iterator = iter(stream)
+        done = object()
+        while True:
+            future = self._pool().submit(next, iterator, done)
+            try:
+                chunk = future.result(timeout=Config.GEMINI_CALL_DEADLINE)
+            except FutureTimeout:
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded(f"No chunk within {Config.GEMINI_CALL_DEADLINE:.0f}s")
+            if chunk is done:
+                return
+            yield chunk
+    
+    # --- asyncio path: the same policy, but waiting on Gemini doesn't hold a thread ---
+    
+    async def _ensure_model_async(self):
+        """The selected model; the first selection may probe, so it runs in a thread.
+        
+        Later calls go through ``model`` too, which only starts the demo-mode
+        re-probe on its own thread.
+        """
+        if not self._selected:
+            return await asyncio.get_running_loop().run_in_executor(None, lambda: self.model)
+        return self.model
+    
+    async def _timed_generate_async(self, model_name, full_prompt):
+        model = self._get_model(model_name)
+        started = time.monotonic()
+        if hasattr(model, 'generate_content_async'):
+            response = await model.generate_content_async(full_prompt)
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self._pool(), model.generate_content, full_prompt)
+        self._histogram(model_name).observe(time.monotonic() - started)
+        return model_name, response
+    
+    async def _generate_hedged_async(self, full_prompt, tokens):
+        """``_generate_hedged`` on the event loop; the losing call is cancelled"""
+        loop = asyncio.get_running_loop()
+        primary = self._model_name
+        deadline = loop.time() + Config.GEMINI_CALL_DEADLINE
+        pending = {asyncio.ensure_future(self._timed_generate_async(primary, full_prompt))}
+        hedge_name = self._hedge_model_name(primary)
+        hedge_at = loop.time() + self._hedge_delay(primary) if hedge_name else None
+        error = None
+        
+        try:
+            while pending or hedge_at is not None:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                timeout = deadline - now
+                if hedge_at is not None:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+                done = set()
+                if pending:
+                    done, pending = await asyncio.wait(pending, timeout=timeout,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        model_name, response = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if model_name != primary:
+                        self.hedges_won += 1
+                        metrics.inc('gemini_hedges_won_total')
+                    return model_name, response
                 
-                # Check if it's a quota error
-                if "quota" in error_msg.lower() or "429" in error_msg:
-                    return self._get_quota_exceeded_response(prompt, context)
+                if hedge_at is not None and (done or not pending or loop.time() >= hedge_at):
+                    hedge_at = None
+                    try:
+                        await self.scheduler.acquire_async(tokens, max_wait=0)
+                    except QuotaRejected:
+                        continue
+                    self.hedges_fired += 1
+                    metrics.inc('gemini_hedges_total')
+                    pending.add(asyncio.ensure_future(
+                        self._timed_generate_async(hedge_name, full_prompt)))
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        if error is not None and not pending:
+            raise error
+        self.deadline_exceeded += 1
+        raise DeadlineExceeded(f"No response within {Config.GEMINI_CALL_DEADLINE:.0f}s")
+    
+    async def generate_response_async(self, prompt, context="", use_cache=True):
+        """``generate_response`` for asyncio servers (same cache, budget, hedging, fallbacks)"""
+        key = self._cache_key(prompt, context, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc('gemini_cache_hits_total')
+                return cached
+        
+        if await self._ensure_model_async():
+            try:
+                full_prompt = self._build_prompt(prompt, context)
+                tokens = self._estimate_tokens(full_prompt)
+                generate = lambda: self._generate_hedged_async(full_prompt, tokens)
+                if use_cache:
+                    _, response = await self.scheduler.call_async(cache_key(prompt, context), generate, tokens)
                 else:
-                    return self._get_demo_response(prompt, context, f"API Error: {error_msg}")
+                    _, response = await self.scheduler.run_async(generate, tokens)
+                self._record_usage(response, tokens)
+                if key is not None:
+                    self.cache.put(key, response.text)
+                return response.text
+            except Exception as e:
+                return self._get_fallback_response(prompt, context, e)
         
-        # No model available, use demo mode
+        metrics.inc('gemini_fallbacks_total', reason='no_model')
         return self._get_demo_response(prompt, context)
     
+    async def generate_response_stream_async(self, prompt, context="", use_cache=True):
+        """``generate_response_stream`` as an async generator"""
+        key = self._cache_key(prompt, context, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc('gemini_cache_hits_total')
+                for chunk in self._stream_text(cached):
+                    yield chunk
+                return
+        
+        if await self._ensure_model_async():
+            sent_any = False
+            parts = []
+            try:
+                full_prompt = self._build_prompt(prompt, context)
+                tokens = self._estimate_tokens(full_prompt)
+                response = await self.scheduler.run_async(
+                    lambda: self._open_stream_async(full_prompt), tokens)
+                async for chunk in self._iterate_with_deadline_async(response):
+                    text = chunk.text
+                    if text:
+                        sent_any = True
+                        parts.append(text)
+                        yield text
+                if key is not None:
+                    self.cache.put(key, "".join(parts))
+                return
+            except Exception as e:
+                if sent_any:
+                    log.warning(f"Gemini stream interrupted: {e}")
+                    return
+                fallback = self._get_fallback_response(prompt, context, e)
+        else:
+            metrics.inc('gemini_fallbacks_total', reason='no_model')
+            fallback = self._get_demo_response(prompt, context)
+        
+        for chunk in self._stream_text(fallback):
+            yield chunk
+    
+    async def _open_stream_async(self, full_prompt):
+        model = self._model
+        if not hasattr(model, 'generate_content_async'):
+            # Older SDK: open the sync stream on the pool (and drain it there too)
+            return await asyncio.get_running_loop().run_in_executor(None, self._open_stream, full_prompt)
+        try:
+            return await asyncio.wait_for(model.generate_content_async(full_prompt, stream=True),
+                                          Config.GEMINI_CALL_DEADLINE)
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"No response within {Config.GEMINI_CALL_DEADLINE:.0f}s")
+    
+    async def _iterate_with_deadline_async(self, stream):
+        """``_iterate_with_deadline`` for async streams, or sync ones read on the pool"""
+        loop = asyncio.get_running_loop()
+        done = object()
+        if hasattr(stream, '__aiter__'):
+            iterator = stream.__aiter__()
+            next_chunk = iterator.__anext__
+        else:
+            iterator = iter(stream)
+            next_chunk = lambda: loop.run_in_executor(self._pool(), next, iterator, done)
+        while True:
+            try:
+                chunk = await asyncio.wait_for(next_chunk(), Config.GEMINI_CALL_DEADLINE)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded(f"No chunk within {Config.GEMINI_CALL_DEADLINE:.0f}s")
+            if chunk is done:
+                return
+            yield chunk
+    
+    def _stream_text(self, text):
+        """Split canned text into word-sized chunks"""
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+    
     def _get_quota_exceeded_response(self, prompt, context):
         """Provide helpful response when quota is exceeded"""
         base_responses = [
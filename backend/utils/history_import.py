@@ -0,0 +1,78 @@
+import json
+from datetime import datetime
+
+# Per-line problems reported back; the rest are only counted
+MAX_ERRORS = 20
+
+
+def parse_turn(record):
+    """add_conversations turn from one history record; raises ValueError if unusable"""
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object")
+    turn = {
+        "user_id": record.get("user_id") or record.get("session_id"),
+        "message": record.get("message"),
+        "response": record.get("response"),
+    }
+    for name, value in turn.items():
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{name} is required")
+    if record.get("timestamp") is not None:
+        # Stored like datetime.now().isoformat(): naive local time
+        timestamp = datetime.fromisoformat(str(record["timestamp"]))
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        turn["timestamp"] = timestamp.isoformat()
+    return turn
+
+
+class HistoryImporter:
+    """Loads JSONL chat history into a VectorStore, ``chunk_size`` turns at a time.
+
+    One turn per line: {"user_id", "message", "response", "timestamp"}
+    ("session_id" is accepted for "user_id"; "timestamp" is optional).
+    Only the current chunk is held in memory, so a file of any size
+    imports in bounded memory, and each chunk is one add_conversations
+    call. Bad lines are skipped and reported with their line number.
+    """
+
+    def __init__(self, store, chunk_size=1000):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.lines = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def add_line(self, line):
+        """Parse one line; returns True once a full chunk is waiting for flush()"""
+        self.lines += 1
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if line.strip():
+                self.chunk.append(parse_turn(json.loads(line)))
+        except ValueError as e:
+            self.skipped += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(f"line {self.lines}: {e}")
+        return len(self.chunk) >= self.chunk_size
+
+    def flush(self):
+        """Store the waiting chunk"""
+        if self.chunk:
+            self.store.add_conversations(self.chunk)
+            self.imported += len(self.chunk)
+            self.chunk = []
+
+    def import_lines(self, lines):
+        """Import an iterable of lines (e.g. an open file); returns stats()"""
+        for line in lines:
+            if self.add_line(line):
+                self.flush()
+        self.flush()
+        return self.stats()
+
+    def stats(self):
+        return {'imported': self.imported, 'skipped': self.skipped, 'errors': self.errors}
@@ -0,0 +1,33 @@
+import logging
+import random
+import sys
+from config import Config
+
+# Pass as extra= on hot-path records: they are kept at LOG_SAMPLE_RATE
+SAMPLED = {"sampled": True}
+
+
+class SampleFilter(logging.Filter):
+    """Keeps a ``rate`` fraction of records marked SAMPLED; warnings and errors always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def get_logger(name):
+    """Logger under the shared "ai_chat" root, configured from LOG_LEVEL/LOG_SAMPLE_RATE once"""
+    root = logging.getLogger("ai_chat")
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+        handler.addFilter(SampleFilter(Config.LOG_SAMPLE_RATE))
+        root.addHandler(handler)
+        root.setLevel(Config.LOG_LEVEL.upper())
+        root.propagate = False
+    return root.getChild(name)
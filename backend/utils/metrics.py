@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+from utils.latency import LatencyHistogram
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels) + "}"
+
+
+def _number(value):
+    return "+Inf" if value == float('inf') else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Process-local histograms, counters and gauges rendered as Prometheus text.
+
+    Each gunicorn worker keeps its own numbers; Prometheus sums them
+    across scrape targets.
+    """
+
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> LatencyHistogram
+        self._counters = {}    # (name, labels) -> value
+        self._gauges = {}      # name -> fn returning a number or {labels: number}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the ``with`` body into histogram ``name`` (also when it raises)"""
+        histogram = self.histogram(name, **labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name, fn, help_text=None):
+        """Register ``fn`` to be called at scrape time"""
+        self._gauges[name] = fn
+        if help_text:
+            self._help[name] = help_text
+
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            counts, count, total = histogram.snapshot()
+            cumulative = 0
+            for bound, n in zip(histogram.buckets + (float('inf'),), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name, "gauge")
+            if isinstance(value, dict):
+                for labels, v in sorted(value.items()):
+                    lines.append(f"{name}{_label_text(labels)} {_number(v)}")
+            else:
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the app, the Gemini client and the vector store
+metrics = Metrics()
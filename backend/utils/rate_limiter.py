@@ -0,0 +1,215 @@
+import asyncio
+import random
+import re
+import threading
+import time
+
+
+class QuotaRejected(Exception):
+    """The call would have to wait longer than the scheduler allows"""
+
+
+def is_quota_error(error):
+    message = str(error).lower()
+    return ("quota" in message or "429" in message or "resource_exhausted" in message
+            or type(error).__name__ == "ResourceExhausted")
+
+
+def parse_retry_delay(error):
+    """Server-suggested retry delay in seconds, if the error carries one"""
+    message = str(error)
+    match = re.search(r"retry in ([\d.]+)\s*s", message, re.IGNORECASE)
+    if match is None:
+        match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", message)
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    """Budget of ``per_minute`` units refilled continuously.
+
+    ``reserve`` always debits and may drive the balance negative; the
+    returned wait is how long until the debt is repaid, so concurrent
+    callers queue up in arrival order.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class QuotaScheduler:
+    """Client-side requests/tokens-per-minute budget with retries and single-flight.
+
+    Calls wait (up to ``max_wait`` seconds) for budget instead of hitting
+    the API and getting a 429. Quota errors from the server are retried
+    after the server's suggested delay (or exponential backoff) with
+    jitter, and that delay also holds back every other call (even once
+    the retries are used up). Concurrent
+    calls with the same key share one upstream request.
+    """
+
+    def __init__(self, rpm=15, tpm=1000000, max_wait=10.0, max_retries=2, backoff=1.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> [event, result, error]
+        self._async_inflight = {}  # id(event loop) -> {key: future}
+        self.calls = 0
+        self.rejections = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _reserve(self, tokens, max_wait):
+        """Debit the budget and return how long to wait, or raise QuotaRejected"""
+        if max_wait is None:
+            max_wait = self.max_wait
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now),
+                       self.blocked_until - now)
+            if wait > max_wait:
+                self.requests.refund(1)
+                self.tokens.refund(tokens)
+                self.rejections += 1
+                raise QuotaRejected(f"Local quota budget exhausted (would wait {wait:.1f}s)")
+            self.calls += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.waiting += 1
+        return wait
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, tokens, max_wait=None):
+        """Block until the budget allows a call of ~``tokens`` tokens, or raise QuotaRejected"""
+        wait = self._reserve(tokens, max_wait)
+        try:
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            self._done_waiting()
+
+    async def acquire_async(self, tokens, max_wait=None):
+        """``acquire`` for coroutines: waits without holding a thread"""
+        wait = self._reserve(tokens, max_wait)
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+        finally:
+            self._done_waiting()
+
+    def record_usage(self, estimated, actual):
+        """Correct the token bucket once the real token count is known"""
+        if actual is not None:
+            with self._lock:
+                self.tokens.tokens -= actual - estimated
+
+    def _retry_delay(self, error, attempt):
+        """Hold back all calls for the retry delay; re-raises when not retryable"""
+        if not is_quota_error(error):
+            raise error
+        delay = parse_retry_delay(error) or self.backoff * (2 ** attempt)
+        delay *= random.uniform(1.0, 1.25)
+        with self._lock:
+            # Also when giving up: the server is out of quota, so back off all the same
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            if attempt >= self.max_retries or delay > self.max_wait:
+                raise error
+            self.retries += 1
+
+    def run(self, fn, tokens):
+        """Call ``fn`` within budget, retrying quota errors with backoff + jitter"""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return fn()
+            except Exception as e:
+                self._retry_delay(e, attempt)
+                attempt += 1
+
+    async def run_async(self, fn, tokens):
+        """``run`` for a coroutine function ``fn``"""
+        attempt = 0
+        while True:
+            await self.acquire_async(tokens)
+            try:
+                return await fn()
+            except Exception as e:
+                self._retry_delay(e, attempt)
+                attempt += 1
+
+    def call(self, key, fn, tokens):
+        """``run`` with single-flight: identical concurrent calls share one result"""
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = [threading.Event(), None, None]
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+        try:
+            flight[1] = self.run(fn, tokens)
+            return flight[1]
+        except Exception as e:
+            flight[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight[0].set()
+
+    async def call_async(self, key, fn, tokens):
+        """``call`` for coroutines; flights are shared within one event loop"""
+        flights = self._async_inflight.setdefault(id(asyncio.get_running_loop()), {})
+        flight = flights.get(key)
+        if flight is None:
+            flight = flights[key] = asyncio.ensure_future(self.run_async(fn, tokens))
+            flight.add_done_callback(lambda _: flights.pop(key, None))
+        else:
+            with self._lock:
+                self.coalesced += 1
+        # A cancelled caller doesn't cancel the call others are waiting on
+        return await asyncio.shield(flight)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "calls": self.calls,
+                "waiting": self.waiting,
+                "avg_wait_s": round(self.wait_total / self.calls, 3) if self.calls else 0.0,
+                "max_wait_s": round(self.wait_max, 3),
+                "rejections": self.rejections,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "blocked_for_s": round(max(0.0, self.blocked_until - now), 3),
+            }
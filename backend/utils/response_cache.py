@@ -0,0 +1,125 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(prompt, context=""):
+    """Hash of prompt + context after case/whitespace/trailing-punctuation normalization"""
+    def normalize(text):
+        text = re.sub(r"\s+", " ", (text or "").lower()).strip()
+        return text.rstrip("?!. ")
+    raw = normalize(prompt) + "\x00" + normalize(context)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of generated responses.
+
+    The memory tier is bounded both by entry count and by the total size
+    of the cached texts. With ``disk_path`` set, entries are also written
+    to a small SQLite table so they survive worker recycles and are shared
+    between workers; a memory miss falls through to disk.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=8 * 1024 * 1024, ttl=3600, disk_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (created_at, text)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_path = disk_path
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            with self._connect() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS responses "
+                           "(key TEXT PRIMARY KEY, created_at REAL, text TEXT)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.disk_path, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+        text = self._disk_get(key, now)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._put_memory(key, text, now)
+        return text
+
+    def put(self, key, text):
+        now = time.time()
+        self._put_memory(key, text, now)
+        if self.disk_path:
+            try:
+                with self._connect() as db:
+                    db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, now, text))
+                    # Keep the disk tier bounded too
+                    db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            except sqlite3.Error as e:
+                print(f"Response cache disk write failed: {e}")
+
+    def _disk_get(self, key, now):
+        if not self.disk_path:
+            return None
+        try:
+            with self._connect() as db:
+                row = db.execute("SELECT created_at, text FROM responses WHERE key = ?",
+                                 (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Response cache disk read failed: {e}")
+            return None
+        if row is None or now - row[0] >= self.ttl:
+            return None
+        return row[1]
+
+    def _put_memory(self, key, text, now):
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now, text)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, text = self._entries.pop(key)
+        self._bytes -= len(text.encode('utf-8'))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "disk_tier": bool(self.disk_path),
+            }
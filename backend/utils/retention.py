@@ -0,0 +1,92 @@
+import bisect
+import os
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+
+
+class RetentionPolicy:
+    """Which turns have outlived the configured limits (0 disables a limit).
+
+    The count limits drop a prefix of a user's rows, because ``user_index``
+    lists them in the order they were stored: the per-user cap keeps the
+    newest ``max_turns_per_user`` and the global cap drops the oldest rows
+    store-wide. The age limit compares each row's own timestamp, since
+    imported history (add_conversations) can be older than rows stored
+    before it.
+    """
+
+    def __init__(self, max_turns_per_user=0, max_turns=0, max_age_days=0):
+        self.max_turns_per_user = max_turns_per_user
+        self.max_turns = max_turns
+        self.max_age_days = max_age_days
+
+    @property
+    def enabled(self):
+        return bool(self.max_turns_per_user or self.max_turns or self.max_age_days)
+
+    def expired(self, user_index, times, now=None):
+        """{user_id: rows to delete} for live rows in ``user_index``; ``times`` holds every row's datetime64 timestamp"""
+        if not self.enabled:
+            return {}
+        too_old = None
+        if self.max_age_days:
+            cutoff = np.datetime64((now or datetime.now()) - timedelta(days=self.max_age_days), 's')
+            too_old = times < cutoff
+        global_row = 0
+        live = sum(len(rows) for rows in user_index.values())
+        if self.max_turns and live > self.max_turns:
+            all_rows = np.sort(np.concatenate([np.asarray(rows) for rows in user_index.values()]))
+            global_row = int(all_rows[live - self.max_turns])
+
+        expired = {}
+        for user_id, rows in user_index.items():
+            drop = bisect.bisect_left(rows, global_row)
+            if self.max_turns_per_user:
+                drop = max(drop, len(rows) - self.max_turns_per_user)
+            dropped = list(rows[:drop])
+            if too_old is not None and drop < len(rows):
+                rest = np.asarray(rows[drop:])
+                dropped += rest[too_old[rest]].tolist()
+            if dropped:
+                expired[user_id] = dropped
+        return expired
+
+
+class PeriodicTask:
+    """Runs ``fn`` every ``interval`` seconds on a daemon thread.
+
+    Started lazily with ``ensure_started()`` and restarted after a fork,
+    like the write-behind flusher, so it works with gunicorn's preload.
+    """
+
+    def __init__(self, fn, interval, name="maintenance"):
+        self.fn = fn
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.runs = 0
+        self.errors = 0
+
+    def ensure_started(self):
+        if self.interval <= 0 or self._stop.is_set():
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.fn()
+                self.runs += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name} pass failed: {e}")
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,147 @@
+import bisect
+import numbers
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import scipy.sparse as sp
+
+# Hashed vocabulary for keyword scoring; wide enough that collisions are rare
+TERM_FEATURES = 2 ** 18
+
+
+class ScoreWeights:
+    """How search_similar ranks a user's turns.
+
+        score = (similarity * cosine + keyword * bm25) * (1 - recency + recency * decay)
+
+    ``bm25`` is scaled to 0..1 over the scored rows and ``decay`` halves
+    every ``half_life_hours``, so with ``recency=0.5`` a turn one half-life
+    old keeps 75% of its relevance. Recency only scales relevance: an
+    unrelated turn doesn't qualify just by being new. Turns scoring at or
+    below ``threshold`` are dropped.
+    """
+
+    FIELDS = ("similarity", "keyword", "recency", "half_life_hours", "threshold")
+
+    def __init__(self, similarity=1.0, keyword=0.0, recency=0.0, half_life_hours=168.0, threshold=0.1):
+        self.similarity = similarity
+        self.keyword = keyword
+        self.recency = recency
+        self.half_life_hours = half_life_hours
+        self.threshold = threshold
+        self._validate()
+
+    def _validate(self):
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, bool) or not isinstance(value, numbers.Real) or value < 0:
+                raise ValueError(f"{name} must be a non-negative number")
+        if self.recency > 1:
+            raise ValueError("recency must be between 0 and 1")
+        if self.half_life_hours <= 0:
+            raise ValueError("half_life_hours must be positive")
+        if self.similarity + self.keyword <= 0:
+            raise ValueError("similarity and keyword can't both be 0")
+
+    def override(self, values):
+        """Copy with the fields set in ``values`` (a request's "retrieval" object)"""
+        if not values:
+            return self
+        if not isinstance(values, dict):
+            raise ValueError("retrieval must be an object")
+        unknown = sorted(set(values) - set(self.FIELDS))
+        if unknown:
+            raise ValueError(f"unknown fields {', '.join(unknown)}")
+        fields = {name: getattr(self, name) for name in self.FIELDS}
+        fields.update(values)
+        return ScoreWeights(**fields)
+
+
+def bm25(counts, queries, k1=1.2, b=0.75):
+    """BM25 of each row of ``counts`` for each query (rows of term counts), scaled so each query's best row is 1"""
+    scores = np.zeros((queries.shape[0], counts.shape[0]))
+    if counts.shape[0] == 0 or queries.nnz == 0:
+        return scores
+    terms = np.unique(queries.indices)
+    tf = counts[:, terms].toarray()
+    lengths = np.asarray(counts.sum(axis=1)).ravel()
+    norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1.0))
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((counts.shape[0] - df + 0.5) / (df + 0.5))
+    term_scores = idf * tf * (k1 + 1) / (tf + norm[:, None])
+    # A query term counts once however often the query repeats it
+    scores = np.asarray((queries[:, terms] > 0).astype(np.float64) @ term_scores.T)
+    best = scores.max(axis=1, keepdims=True)
+    return np.divide(scores, best, out=np.zeros_like(scores), where=best > 0)
+
+
+def hybrid_scores(weights, similarities, counts=None, queries=None, times=None, now=None):
+    """(queries x rows) scores in one vectorized pass; see ScoreWeights for the formula"""
+    scores = weights.similarity * similarities
+    if weights.keyword and counts is not None:
+        scores = scores + weights.keyword * bm25(counts, queries)
+    if weights.recency and times is not None:
+        now = np.datetime64(now or datetime.now(), 's')
+        age_hours = np.maximum((now - times) / np.timedelta64(1, 'h'), 0)
+        scores = scores * (1 - weights.recency + weights.recency * np.exp2(-age_hours / weights.half_life_hours))
+    return scores
+
+
+def parse_times(timestamps):
+    return np.array(timestamps, dtype='datetime64[s]')
+
+
+class RowFeatures:
+    """Hashed term counts and timestamps of stored rows, for keyword and recency scoring.
+
+    Built per user on that user's first search and extended as new rows
+    arrive, so no request pays for tokenizing the whole store. Only the
+    ``max_users`` most recently searched users are kept. The store calls
+    ``invalidate()`` when it deletes or renumbers rows; a new ``version``
+    also drops the cache, for a search that raced with compaction.
+    """
+
+    def __init__(self, max_users=1000):
+        self.max_users = max_users
+        self._vectorizer = None
+        self._users = OrderedDict()  # user_id -> (row numbers, term counts, timestamps)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self, user_id=None):
+        """Forget one user's features, or everyone's"""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    def term_counts(self, texts):
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(n_features=TERM_FEATURES, alternate_sign=False,
+                                                 norm=None, stop_words='english', dtype=np.float32)
+        return self._vectorizer.transform(texts).tocsr()
+
+    def get(self, user_id, user_rows, rows, conversations, version):
+        """(term counts, timestamps) for ``rows``, a subset of the user's ``user_rows`` (ascending)"""
+        with self._lock:
+            if version != self._version:
+                self._users.clear()
+                self._version = version
+            known, counts, times = self._users.pop(user_id, None) or (
+                np.empty(0, dtype=np.int64), sp.csr_matrix((0, TERM_FEATURES), dtype=np.float32),
+                np.empty(0, dtype='datetime64[s]'))
+            # Rows only ever arrive at the end, so catching up is a suffix of user_rows
+            new = user_rows[bisect.bisect_right(user_rows, known[-1]):] if len(known) else user_rows
+            if len(new):
+                added = [conversations[row] for row in new]
+                known = np.concatenate([known, np.asarray(new, dtype=np.int64)])
+                counts = sp.vstack([counts, self.term_counts([conv["text"] for conv in added])], format='csr')
+                times = np.concatenate([times, parse_times([conv["timestamp"] for conv in added])])
+            self._users[user_id] = (known, counts, times)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        positions = np.searchsorted(known, rows)
+        return counts[positions], times[positions]
@@ -0,0 +1,535 @@
+import contextlib
+import fcntl
+import json
+import os
+import re
+import threading
+import numpy as np
+import scipy.sparse as sp
+from utils.embedding_buffer import MappedEmbeddings, SparseEmbeddings
+
+MANIFEST_VERSION = 2
+# Embedding files the manifest may point at (plus temp files left by an interrupted write)
+EMBEDDING_FILE = re.compile(r"^embeddings(-\d+)?\.(f32|npz)$|^embeddings.*\.tmp(\.npz)?$")
+
+
+class SegmentLog:
+    """Append-only persistence: immutable segments plus an active log.
+
+    Layout inside ``data_dir``:
+      manifest.json        - live segments (id + row count) and the active log id
+      segments/<id>.jsonl  - one {"conversation", "metadata"} record per line
+      log-<id>.jsonl       - active log, one record appended per turn
+      embeddings.f32       - float32 rows for every record, in record order
+      tombstones.jsonl     - {"user_id", "ids"} per deletion; the rows stay
+                             until compaction rewrites the segments
+
+    With ``embedding_format="sparse"`` embeddings are CSR rows instead:
+    each log record carries its row inline and the rows of sealed
+    segments are written to embeddings.npz in one batch when the log
+    rolls.
+
+    Each turn appends one line and one embedding row, so a write costs
+    O(turn) instead of O(corpus). The manifest is only ever replaced
+    atomically, so files it does not reference are leftovers from an
+    interrupted roll/compaction. Those operations leave ``.cleanup`` in
+    place until they finish, and only then (after a crash or failure)
+    does loading look for and remove such files.
+
+    Several processes may share one directory: writers serialize on
+    ``.lock`` and readers call ``read_new()`` to pick up turns appended by
+    the others. Compaction renumbers rows; it bumps the manifest's
+    ``generation`` (and writes a new embedding file) so the other
+    processes know to reload instead of reading on.
+    """
+
+    def __init__(self, data_dir, dim, embedding_format="dense"):
+        self.data_dir = data_dir
+        self.dim = dim
+        self.sparse = embedding_format == "sparse"
+        self.segments_dir = os.path.join(data_dir, "segments")
+        self.manifest_file = os.path.join(data_dir, "manifest.json")
+        self.lock_file = os.path.join(data_dir, ".lock")
+        self.tombstones_file = os.path.join(data_dir, "tombstones.jsonl")
+        self.cleanup_file = os.path.join(data_dir, ".cleanup")
+        os.makedirs(self.segments_dir, exist_ok=True)
+
+        self.manifest = self._empty_manifest()
+        self._manifest_stamp = None
+        self.embeddings = None
+        self.rows_read = 0
+        self.log_offset = 0
+        self._log_read_id = None
+        self.generation = 0
+        self.tombstone_offset = 0
+        self._tombstone_inode = None
+        self.thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_handle = None
+
+    def _empty_manifest(self):
+        return {"version": MANIFEST_VERSION, "segments": [], "log": 1, "next_id": 2}
+
+    # ---- paths -------------------------------------------------------
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.segments_dir, f"{segment_id:06d}.jsonl")
+
+    def _log_path(self, log_id=None):
+        log_id = self.manifest["log"] if log_id is None else log_id
+        return os.path.join(self.data_dir, f"log-{log_id:06d}.jsonl")
+
+    def exists(self):
+        return os.path.exists(self.manifest_file)
+
+    @property
+    def log_count(self):
+        return self.rows_read - self.segment_row_count()
+
+    def segment_row_count(self):
+        return sum(segment["rows"] for segment in self.manifest["segments"])
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Exclusive, re-entrant lock shared by every thread and process writing this directory"""
+        with self.thread_lock:
+            if self._lock_depth == 0:
+                self._lock_handle = open(self.lock_file, 'a')
+                fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+                    self._lock_handle.close()
+
+    @contextlib.contextmanager
+    def _may_leave_files(self):
+        """Mark the directory while an operation that writes files before the manifest runs.
+
+        The mark is only cleared on success, so the next load after a
+        crash or error removes what the operation left behind.
+        """
+        with open(self.cleanup_file, 'w'):
+            pass
+        yield
+        if os.path.exists(self.cleanup_file):
+            os.remove(self.cleanup_file)
+
+    # ---- loading -----------------------------------------------------
+
+    def load(self):
+        """Read all segments, replay the log and map the embedding file.
+
+        Returns (conversations, metadata); embedding rows are available
+        through ``self.embeddings``.
+        """
+        with self.locked():
+            self._open()
+            conversations, metadata = self._read_from(0, truncate_torn=True)
+            self._truncate_embeddings()
+        return conversations, metadata
+
+    def resume(self, rows, generation):
+        """Load only what follows the first ``rows`` rows, e.g. those held by a snapshot.
+
+        Returns (start, conversations, metadata) with the rows from
+        ``start`` on: ``rows`` capped at the sealed segments, so the
+        active log is always replayed from its start. Returns None if the
+        store was compacted since (``generation`` moved on): the rows
+        were renumbered and the caller must ``load()`` instead.
+        """
+        with self.locked():
+            self._open()
+            if self.generation != generation:
+                return None
+            start = min(rows, self.segment_row_count())
+            conversations, metadata = self._read_from(start, truncate_torn=True)
+            self._truncate_embeddings()
+        return start, conversations, metadata
+
+    def _open(self):
+        if self.exists():
+            self._read_manifest()
+        else:
+            self._write_manifest()
+        if os.path.exists(self.cleanup_file):
+            self._remove_orphans()
+            os.remove(self.cleanup_file)
+
+        self.embeddings = self._open_embeddings()
+        self.generation = self.manifest.get("generation", 0)
+        self.tombstone_offset = 0
+        self._log_read_id = None
+
+    def _truncate_embeddings(self):
+        if len(self.embeddings) != self.rows_read:
+            print(f"Truncating embeddings to {self.rows_read} rows")
+            self.embeddings.truncate(self.rows_read)
+
+    def _embeddings_name(self):
+        return self.manifest.get("embeddings", "embeddings.npz" if self.sparse else "embeddings.f32")
+
+    def _open_embeddings(self):
+        path = os.path.join(self.data_dir, self._embeddings_name())
+        if self.sparse:
+            return SparseEmbeddings(path, self.dim)
+        return MappedEmbeddings(path, self.dim)
+
+    def read_new(self):
+        """Return (conversations, metadata) appended by other processes since the last read.
+
+        Returns None when another process has compacted the store in the
+        meantime: rows were renumbered and the caller must ``load()`` again.
+        """
+        changed = self._manifest_changed()
+        if changed:
+            self._read_manifest()
+            if self.manifest.get("generation", 0) != self.generation:
+                return None
+        self.embeddings.refresh()
+        if not changed and self._log_size() == self.log_offset:
+            return [], []
+        return self._read_from(self.rows_read)
+
+    def _log_size(self):
+        try:
+            return os.path.getsize(self._log_path())
+        except OSError:
+            return 0
+
+    def _read_manifest(self):
+        if self.exists():
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            self._manifest_stamp = self._stamp()
+
+    def _stamp(self):
+        stat = os.stat(self.manifest_file)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _manifest_changed(self):
+        return self.exists() and self._stamp() != self._manifest_stamp
+
+    def _read_from(self, row, truncate_torn=False):
+        """Read records from global row ``row`` onwards.
+
+        Sealed segments are skipped by their row counts; within the active
+        log only complete lines whose embedding row is already on disk are
+        consumed, so a concurrent append is never half-read.
+        """
+        conversations, metadata = [], []
+
+        def take(record):
+            conversations.append(record["conversation"])
+            metadata.append(record["metadata"])
+            if self.sparse and "embedding" in record:
+                self.embeddings.append_record(record["embedding"])
+
+        start = 0
+        for segment in self.manifest["segments"]:
+            end = start + segment["rows"]
+            if row < end:
+                with open(self._segment_path(segment["id"]), 'r', encoding='utf-8') as f:
+                    for i, line in enumerate(f):
+                        if start + i >= row:
+                            take(json.loads(line))
+                row = end
+            start = end
+        if self.sparse:
+            self.embeddings.load(upto=row)
+
+        log_path = self._log_path()
+        if not os.path.exists(log_path):
+            self._set_position(row, 0)
+            return conversations, metadata
+        # Resume where the last read stopped unless another process rolled the log since
+        skip, offset = row - start, 0
+        if self._log_read_id == self.manifest["log"] and row == self.rows_read:
+            skip, offset = 0, self.log_offset
+        # Dense rows are written before their record; sparse rows travel inside it
+        available = float('inf') if self.sparse else len(self.embeddings)
+        with open(log_path, 'rb') as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n") or (not skip and row >= available):
+                    break
+                try:
+                    record = json.loads(raw.decode('utf-8'))
+                except ValueError:
+                    break
+                offset += len(raw)
+                if skip:
+                    skip -= 1
+                    continue
+                take(record)
+                row += 1
+        if truncate_torn and offset != os.path.getsize(log_path):
+            print(f"Truncating torn log tail in {log_path}")
+            with open(log_path, 'r+b') as f:
+                f.truncate(offset)
+        self._set_position(row, offset)
+        return conversations, metadata
+
+    def _set_position(self, row, log_offset):
+        self.rows_read = row
+        self.log_offset = log_offset
+        self._log_read_id = self.manifest["log"]
+
+    def _remove_orphans(self):
+        """Delete segment/log/embedding files the manifest does not reference"""
+        live_segments = {f"{segment['id']:06d}" for segment in self.manifest["segments"]}
+        for name in os.listdir(self.segments_dir):
+            if name.endswith(".tmp") or name.split(".")[0] not in live_segments:
+                os.remove(os.path.join(self.segments_dir, name))
+        live_log = os.path.basename(self._log_path())
+        for name in os.listdir(self.data_dir):
+            if name.startswith("log-") and name != live_log:
+                os.remove(os.path.join(self.data_dir, name))
+            elif EMBEDDING_FILE.match(name) and name != self._embeddings_name():
+                os.remove(os.path.join(self.data_dir, name))
+
+    # ---- writing -----------------------------------------------------
+    # Callers hold ``locked()`` and have caught up with ``read_new()``.
+
+    def append(self, conversation, metadata, embedding):
+        """Append one turn: embedding row first, then its record line"""
+        self.append_many([(conversation, metadata, embedding)])
+
+    def append_many(self, turns):
+        """Append (conversation, metadata, embedding) turns with one write per file"""
+        embeddings = [embedding for _, _, embedding in turns]
+        if self.sparse:
+            self.embeddings.extend(sp.vstack([sp.csr_matrix(e) for e in embeddings]))
+        else:
+            self.embeddings.extend(np.vstack([np.ravel(e) for e in embeddings]))
+        lines = []
+        for conversation, metadata, embedding in turns:
+            record = {"conversation": conversation, "metadata": metadata}
+            if self.sparse:
+                record["embedding"] = SparseEmbeddings.to_record(embedding)
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        data = "".join(lines).encode('utf-8')
+        with open(self._log_path(), 'ab') as f:
+            f.write(data)
+        self._set_position(self.rows_read + len(turns), self.log_offset + len(data))
+
+    def sync(self):
+        """fsync the active log (and dense embedding file) to make appended turns durable"""
+        paths = [self._log_path()]
+        if not self.sparse:
+            paths.append(self.embeddings.path)
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, 'rb+') as f:
+                    os.fsync(f.fileno())
+
+    def roll(self, conversations, metadata):
+        """Seal the active log into a new immutable segment.
+
+        ``conversations``/``metadata`` are the log's rows (the tail of
+        the in-memory store).
+        """
+        if not conversations:
+            return
+        with self._may_leave_files():
+            segment_id = self.manifest["log"]
+            self._write_segment(segment_id, conversations, metadata)
+            if self.sparse:
+                # Batch-persist the sealed rows before the manifest points past the log
+                self.embeddings.save()
+            old_log = self._log_path()
+            self.manifest = dict(
+                self.manifest,
+                segments=self.manifest["segments"] + [{"id": segment_id, "rows": len(conversations)}],
+                log=self.manifest["next_id"],
+                next_id=self.manifest["next_id"] + 1,
+            )
+            self._write_manifest()
+            self._set_position(self.rows_read, 0)
+            if os.path.exists(old_log):
+                os.remove(old_log)
+
+    def compact(self, conversations, metadata):
+        """Merge all sealed segments into one.
+
+        Takes the rows currently held in segments (the head of the store,
+        excluding the active log).
+        """
+        if len(self.manifest["segments"]) <= 1:
+            return
+        with self._may_leave_files():
+            segment_id = self.manifest["next_id"]
+            self._write_segment(segment_id, conversations, metadata)
+            old_segments = self.manifest["segments"]
+            self.manifest = dict(
+                self.manifest,
+                segments=[{"id": segment_id, "rows": len(conversations)}],
+                next_id=segment_id + 1,
+            )
+            self._write_manifest()
+            for segment in old_segments:
+                path = self._segment_path(segment["id"])
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def replace_embeddings(self, blocks):
+        """Swap in a new embedding file built from row blocks (re-embedding)"""
+        with self._may_leave_files():
+            self.embeddings.replace(blocks)
+
+    def append_tombstones(self, records):
+        """Record deleted rows as {"user_id", "ids"} lines"""
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with open(self.tombstones_file, 'a', encoding='utf-8') as f:
+            f.write(data)
+
+    def read_tombstones(self):
+        """Tombstone records written (by any process) since the last read"""
+        try:
+            stat = os.stat(self.tombstones_file)
+        except OSError:
+            return []
+        if stat.st_ino != self._tombstone_inode:
+            # Rewritten by a compaction: start over (ids already applied are no-ops)
+            self._tombstone_inode = stat.st_ino
+            self.tombstone_offset = 0
+        if stat.st_size == self.tombstone_offset:
+            return []
+        records = []
+        with open(self.tombstones_file, 'rb') as f:
+            f.seek(self.tombstone_offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                self.tombstone_offset += len(raw)
+                records.append(json.loads(raw.decode('utf-8')))
+        return records
+
+    def prepare_compaction(self, conversations, metadata, blocks=None):
+        """Write the rows that survive compaction to temp files.
+
+        Runs without the lock: it only reads sealed rows, which never
+        change. ``blocks`` are their dense embedding rows (None in sparse
+        mode, where the matrix is rebuilt in memory at commit). The
+        cleanup mark stays until the commit or discard.
+        """
+        with open(self.cleanup_file, 'w'):
+            pass
+        tag = f"{os.getpid()}-{threading.get_ident()}"
+        prepared = {"rows": len(conversations), "embeddings": None,
+                    "segment": os.path.join(self.segments_dir, f"compact-{tag}.tmp")}
+        with open(prepared["segment"], 'w', encoding='utf-8') as f:
+            for conversation, meta in zip(conversations, metadata):
+                f.write(json.dumps({"conversation": conversation, "metadata": meta},
+                                   ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if blocks is not None:
+            prepared["embeddings"] = os.path.join(self.data_dir, f"embeddings-compact-{tag}.tmp")
+            with open(prepared["embeddings"], 'wb') as f:
+                for block in blocks:
+                    f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        return prepared
+
+    def discard_compaction(self, prepared):
+        for path in (prepared["segment"], prepared["embeddings"]):
+            if path and os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.cleanup_file):
+            os.remove(self.cleanup_file)
+
+    def commit_compaction(self, prepared, replaced, tail, tombstones):
+        """Swap prepared rows in for the ``replaced`` segments (caller holds ``locked()``).
+
+        ``tail`` holds the embedding rows after the replaced segments
+        (dense), or the complete new CSR matrix (sparse). ``tombstones``
+        are the records still pending afterwards. Returns False, and
+        discards the prepared files, if the segments were merged by
+        someone else in the meantime.
+        """
+        # A process that started meanwhile may have cleaned up our temp files as orphans
+        files = [prepared["segment"]] + ([prepared["embeddings"]] if not self.sparse else [])
+        if (self.manifest["segments"][:len(replaced)] != replaced
+                or not all(os.path.exists(path) for path in files)):
+            self.discard_compaction(prepared)
+            return False
+        with self._may_leave_files():
+            self._swap_compacted(prepared, replaced, tail, tombstones)
+        return True
+
+    def _swap_compacted(self, prepared, replaced, tail, tombstones):
+        generation = self.manifest.get("generation", 0) + 1
+        old_embeddings = self.embeddings.path
+        name = f"embeddings-{generation:06d}." + ("npz" if self.sparse else "f32")
+        path = os.path.join(self.data_dir, name)
+        if self.sparse:
+            embeddings = SparseEmbeddings(path, self.dim)
+            embeddings.extend(tail)
+            embeddings.save()
+        else:
+            with open(prepared["embeddings"], 'ab') as f:
+                f.write(np.ascontiguousarray(tail, dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(prepared["embeddings"], path)
+        segment_id = self.manifest["next_id"]
+        os.replace(prepared["segment"], self._segment_path(segment_id))
+        self.manifest = dict(
+            self.manifest,
+            segments=[{"id": segment_id, "rows": prepared["rows"]}] + self.manifest["segments"][len(replaced):],
+            next_id=segment_id + 1,
+            generation=generation,
+            embeddings=name,
+        )
+        self._write_manifest()
+        self.generation = generation
+
+        dropped = sum(segment["rows"] for segment in replaced) - prepared["rows"]
+        self._set_position(self.rows_read - dropped, self.log_offset)
+        self.embeddings = embeddings if self.sparse else MappedEmbeddings(path, self.dim)
+        for segment in replaced:
+            if os.path.exists(self._segment_path(segment["id"])):
+                os.remove(self._segment_path(segment["id"]))
+        if os.path.exists(old_embeddings) and old_embeddings != path:
+            os.remove(old_embeddings)
+        tmp = self.tombstones_file + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in tombstones))
+        os.replace(tmp, self.tombstones_file)
+        self._tombstone_inode = os.stat(self.tombstones_file).st_ino
+        self.tombstone_offset = os.path.getsize(self.tombstones_file)
+
+    def initialize(self, conversations, metadata, embeddings):
+        """Create a fresh layout holding ``conversations`` as its first segment"""
+        with self._may_leave_files():
+            self.manifest = self._empty_manifest()
+            self.embeddings = self._open_embeddings()
+            self.embeddings.replace([np.asarray(embeddings).reshape(-1, self.dim)])
+            if conversations:
+                self._write_segment(1, conversations, metadata)
+                self.manifest = dict(self.manifest, segments=[{"id": 1, "rows": len(conversations)}],
+                                     log=2, next_id=3)
+            self._write_manifest()
+
+    def _write_segment(self, segment_id, conversations, metadata):
+        path = self._segment_path(segment_id)
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for conversation, meta in zip(conversations, metadata):
+                f.write(json.dumps({"conversation": conversation, "metadata": meta},
+                                   ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _write_manifest(self):
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_file)
+        self._manifest_stamp = self._stamp()
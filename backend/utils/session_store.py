@@ -0,0 +1,304 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+# Per-entry cost of the OrderedDict links and hash slot, on top of the measured objects
+ENTRY_OVERHEAD_BYTES = 100
+
+
+def _session_bytes(session_id, session):
+    """Measured size of a cached session: its id, its dict and the dict's keys and values"""
+    return (ENTRY_OVERHEAD_BYTES + sys.getsizeof(session_id) + sys.getsizeof(session)
+            + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in session.items()))
+
+
+def _new_session():
+    return {
+        'created_at': datetime.now().isoformat(),
+        'last_seen': time.time(),
+        'message_count': 0,
+        'cache_enabled': True,
+    }
+
+
+class MemorySessionStore:
+    """In-process session store with LRU, idle-TTL and memory-cap eviction.
+
+    Sessions idle for longer than ``idle_ttl`` seconds expire; beyond
+    ``max_sessions`` or ``max_bytes`` (the measured size of the cached
+    sessions) the least recently used ones are evicted. Eviction only
+    frees the cache. The ids of expired sessions are passed to
+    ``on_expire``, outside the lock.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_sessions=10000, idle_ttl=86400, max_bytes=16 * 1024 * 1024, on_expire=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.on_expire = on_expire
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Dropped under the lock, reported to on_expire once it is released
+        self._dropped = []
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, session_id, now):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if now - session['last_seen'] > self.idle_ttl:
+            self._drop(session_id)
+            self.expirations += 1
+            return None
+        session['last_seen'] = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _store(self, session_id, session):
+        self._sessions[session_id] = session
+        self._resize(session_id)
+
+    def _resize(self, session_id):
+        size = _session_bytes(session_id, self._sessions[session_id])
+        self._bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+
+    def _remove(self, session_id):
+        self._sessions.pop(session_id)
+        self._bytes -= self._sizes.pop(session_id)
+
+    def _drop(self, session_id):
+        self._remove(session_id)
+        self._dropped.append(session_id)
+
+    def _evict(self, now):
+        # Least recently seen first, so idle sessions are all at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session['last_seen'] > self.idle_ttl:
+                self.expirations += 1
+                self._drop(session_id)
+            elif len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes:
+                self.evictions += 1
+                self._remove(session_id)
+            else:
+                break
+
+    def _report_dropped(self):
+        with self._lock:
+            dropped, self._dropped = self._dropped, []
+        if dropped and self.on_expire is not None:
+            self.on_expire(dropped)
+
+    def get(self, session_id):
+        """A copy of the session, or None if it doesn't exist or has expired"""
+        with self._lock:
+            session = self._lookup(session_id, time.time())
+            session = dict(session) if session else None
+        self._report_dropped()
+        return session
+
+    def create(self):
+        session_id = str(uuid.uuid4())
+        session = _new_session()
+        with self._lock:
+            self._store(session_id, session)
+            self._evict(session['last_seen'])
+        self._report_dropped()
+        return session_id, dict(session)
+
+    def set(self, session_id, **fields):
+        with self._lock:
+            session = self._lookup(session_id, time.time())
+            if session is not None:
+                session.update(fields)
+                self._resize(session_id)
+        self._report_dropped()
+
+    def add_turn(self, session_id):
+        """Count a stored turn; returns the session's message count"""
+        now = time.time()
+        with self._lock:
+            session = self._lookup(session_id, now)
+            if session is None:
+                # Evicted while the reply was being generated: start its bookkeeping over
+                session = _new_session()
+                self._store(session_id, session)
+            session['message_count'] += 1
+            count = session['message_count']
+            self._evict(now)
+        self._report_dropped()
+        return count
+
+    def delete(self, session_id):
+        """Forget a session; unlike expiry, it isn't reported to on_expire"""
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            return True
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "sessions": len(self._sessions),
+                "approx_bytes": self._bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SqliteSessionStore:
+    """Session store in a SQLite file shared by all workers (WAL mode).
+
+    Sessions survive worker recycles and any worker can serve any session.
+    Expired and excess sessions are purged every ``purge_every`` writes
+    (and an expired one when it is looked up); as in MemorySessionStore,
+    only the expired ones are passed to ``on_expire``.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, max_sessions=10000, idle_ttl=86400, purge_every=100, on_expire=None):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.purge_every = purge_every
+        self.on_expire = on_expire
+        self._local = threading.local()
+        self._writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, created_at TEXT, "
+                       "last_seen REAL, message_count INTEGER, cache_enabled INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+            # Per-session turn ids were never read (the turns are found by user_id)
+            db.execute("DROP TABLE IF EXISTS session_turns")
+
+    def _db(self):
+        # One connection per thread (and per process: connections don't survive a fork)
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def get(self, session_id):
+        now = time.time()
+        expired = False
+        with self._db() as db:
+            row = db.execute("SELECT created_at, last_seen, message_count, cache_enabled "
+                             "FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is not None and now - row[1] > self.idle_ttl:
+                # Unless another worker just used (or already purged) it
+                expired = db.execute("DELETE FROM sessions WHERE id = ? AND last_seen = ?",
+                                     (session_id, row[1])).rowcount > 0
+                row = None
+            elif row is not None:
+                db.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (now, session_id))
+        if expired:
+            self.expirations += 1
+            self._report_dropped([session_id])
+        if row is None:
+            return None
+        return {'created_at': row[0], 'last_seen': now, 'message_count': row[2],
+                'cache_enabled': bool(row[3])}
+
+    def create(self):
+        session_id = str(uuid.uuid4())
+        session = _new_session()
+        with self._db() as db:
+            db.execute("INSERT INTO sessions VALUES (?, ?, ?, 0, 1)",
+                       (session_id, session['created_at'], session['last_seen']))
+        self._maybe_purge()
+        return session_id, session
+
+    def set(self, session_id, **fields):
+        if 'cache_enabled' in fields:
+            with self._db() as db:
+                db.execute("UPDATE sessions SET cache_enabled = ? WHERE id = ?",
+                           (int(bool(fields['cache_enabled'])), session_id))
+
+    def add_turn(self, session_id):
+        now = time.time()
+        with self._db() as db:
+            db.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, 0, 1)",
+                       (session_id, datetime.now().isoformat(), now))
+            db.execute("UPDATE sessions SET message_count = message_count + 1, last_seen = ? "
+                       "WHERE id = ?", (now, session_id))
+            count = db.execute("SELECT message_count FROM sessions WHERE id = ?",
+                               (session_id,)).fetchone()[0]
+        self._maybe_purge()
+        return count
+
+    def delete(self, session_id):
+        with self._db() as db:
+            deleted = db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+        return deleted > 0
+
+    def _maybe_purge(self):
+        self._writes += 1
+        if self._writes % self.purge_every:
+            return
+        with self._db() as db:
+            cutoff = time.time() - self.idle_ttl
+            expired = db.execute("SELECT id, last_seen FROM sessions WHERE last_seen < ?",
+                                 (cutoff,)).fetchall()
+            excess = db.execute("SELECT id, last_seen FROM sessions WHERE last_seen >= ? "
+                                "ORDER BY last_seen DESC LIMIT -1 OFFSET ?",
+                                (cutoff, self.max_sessions)).fetchall()
+
+            def delete(candidates):
+                # A session used since it was selected stays
+                return [session_id for session_id, last_seen in candidates
+                        if db.execute("DELETE FROM sessions WHERE id = ? AND last_seen = ?",
+                                      (session_id, last_seen)).rowcount]
+            expired, excess = delete(expired), delete(excess)
+        self.expirations += len(expired)
+        self.evictions += len(excess)
+        self._report_dropped(expired)
+
+    def _report_dropped(self, session_ids):
+        if session_ids and self.on_expire is not None:
+            self.on_expire(session_ids)
+
+    def __len__(self):
+        with self._db() as db:
+            return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "sessions": len(self),
+            "path": self.path,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def create_session_store(backend, path=None, max_sessions=10000, idle_ttl=86400,
+                         max_bytes=16 * 1024 * 1024, on_expire=None):
+    """Build the session store selected by ``backend`` ("memory" or "sqlite")"""
+    if backend == "memory":
+        return MemorySessionStore(max_sessions, idle_ttl, max_bytes, on_expire)
+    if backend == "sqlite":
+        return SqliteSessionStore(path, max_sessions, idle_ttl, on_expire=on_expire)
+    raise ValueError(f"Unknown session store: {backend}")
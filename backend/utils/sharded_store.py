@@ -0,0 +1,264 @@
+import glob
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+from utils.log import get_logger
+from utils.metrics import metrics
+from utils.retention import PeriodicTask
+from utils.scoring import ScoreWeights
+from utils.vector_store import VectorStore
+
+log = get_logger('sharded_store')
+metrics.describe('store_shard_loads_total', 'Shards opened by this worker')
+metrics.describe('store_shard_evictions_total', 'Idle shards closed by this worker')
+
+# Files that mark an unsharded store in the data directory
+UNSHARDED_FILES = ("manifest.json", "conversations.db", "conversations.json")
+
+
+def shard_of(user_id, shards):
+    """Shard number of ``user_id``; stable across processes and restarts (unlike hash())"""
+    digest = hashlib.sha1(str(user_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def shard_root(data_dir, shards):
+    return os.path.join(data_dir, f"shards-{shards}")
+
+
+def shard_dir(data_dir, shards, shard):
+    return os.path.join(shard_root(data_dir, shards), f"{shard:03d}")
+
+
+def existing_layouts(data_dir):
+    """Shard counts with data under ``data_dir`` (1 = an unsharded store)"""
+    layouts = []
+    if any(os.path.exists(os.path.join(data_dir, name)) for name in UNSHARDED_FILES):
+        layouts.append(1)
+    for path in glob.glob(os.path.join(data_dir, "shards-*")):
+        suffix = os.path.basename(path)[len("shards-"):]
+        if suffix.isdigit() and os.path.isdir(path):
+            layouts.append(int(suffix))
+    return sorted(layouts)
+
+
+class ShardedVectorStore:
+    """VectorStore router over ``shards`` independent stores, partitioned by user.
+
+    A user's turns all live in shard ``shard_of(user_id)`` under
+    ``<data_dir>/shards-<N>/<shard>/``, a complete VectorStore directory
+    of the configured storage mode, so every per-user call is served by
+    one shard. A shard is opened on first use and closed (pending writes
+    flushed) once nobody has used it for ``idle_ttl`` seconds; a worker
+    only holds the shards its traffic touches. Store-wide calls visit
+    every shard and close the ones that weren't open already. Changing
+    the shard count needs rebalance_shards.py.
+    """
+
+    def __init__(self, data_dir=None, shards=None, storage_mode=None, embedder=None, idle_ttl=None):
+        self.data_dir = data_dir or Config.CHROMA_DB_PATH
+        self.shards = shards or Config.VECTOR_STORE_SHARDS
+        self.storage_mode = storage_mode
+        self.embedder = embedder
+        self.idle_ttl = Config.SHARD_IDLE_TTL if idle_ttl is None else idle_ttl
+        self._check_layout()
+        os.makedirs(shard_root(self.data_dir, self.shards), exist_ok=True)
+
+        # shard -> open VectorStore, calls in progress and last use (guarded by the shard's lock)
+        self._open = {}
+        self._in_use = [0] * self.shards
+        self._last_used = [0.0] * self.shards
+        self._locks = [threading.Lock() for _ in range(self.shards)]
+
+        self.weights = ScoreWeights(Config.RETRIEVAL_SIMILARITY_WEIGHT, Config.RETRIEVAL_KEYWORD_WEIGHT,
+                                    Config.RETRIEVAL_RECENCY_WEIGHT, Config.RETRIEVAL_HALF_LIFE_HOURS,
+                                    Config.RETRIEVAL_THRESHOLD)
+        self.evictor = PeriodicTask(self.evict_idle, min(60, self.idle_ttl), "shard-evictor")
+
+    def _check_layout(self):
+        """Refuse to start on an empty layout while the data sits in another shard count"""
+        layouts = existing_layouts(self.data_dir)
+        if layouts and self.shards not in layouts:
+            raise ValueError(f"{self.data_dir} holds a store with {layouts[-1]} shard(s), not "
+                             f"{self.shards}; run rebalance_shards.py --from {layouts[-1]} "
+                             f"--to {self.shards} first")
+
+    def shard_of(self, user_id):
+        return shard_of(user_id, self.shards)
+
+    @contextmanager
+    def _shard(self, shard):
+        """The open store of ``shard``, held open until the block exits"""
+        with self._locks[shard]:
+            store = self._open.get(shard)
+            if store is None:
+                started = time.perf_counter()
+                store = VectorStore(shard_dir(self.data_dir, self.shards, shard), self.storage_mode,
+                                    self.embedder)
+                self._open[shard] = store
+                metrics.inc('store_shard_loads_total')
+                log.info(f"📂 Opened shard {shard} in {(time.perf_counter() - started) * 1000:.0f} ms")
+            self._in_use[shard] += 1
+        self.evictor.ensure_started()
+        try:
+            yield store
+        finally:
+            with self._locks[shard]:
+                self._in_use[shard] -= 1
+                self._last_used[shard] = time.monotonic()
+
+    def _user_shard(self, user_id):
+        return self._shard(self.shard_of(user_id))
+
+    def _close_shard(self, shard, idle_since=None):
+        """Close ``shard`` if nobody is using it (and it has been idle since ``idle_since``)"""
+        with self._locks[shard]:
+            store = self._open.get(shard)
+            if store is None or self._in_use[shard]:
+                return False
+            if idle_since is not None and self._last_used[shard] > idle_since:
+                return False
+            store.close()
+            del self._open[shard]
+            return True
+
+    def evict_idle(self):
+        """Close the shards unused for idle_ttl seconds; returns how many"""
+        idle_since = time.monotonic() - self.idle_ttl
+        evicted = sum(self._close_shard(shard, idle_since) for shard in list(self._open))
+        if evicted:
+            metrics.inc('store_shard_evictions_total', evicted)
+            log.info(f"💤 Closed {evicted} idle shard(s), {len(self._open)} open")
+        return evicted
+
+    def _each_shard(self, fn):
+        """fn(store) for every shard; shards opened just for this are closed again"""
+        results = []
+        for shard in range(self.shards):
+            was_open = shard in self._open
+            with self._shard(shard) as store:
+                results.append(fn(store))
+            if not was_open:
+                self._close_shard(shard)
+        return results
+
+    def _open_stores(self):
+        return list(self._open.values())
+
+    # Per-user calls: served by the user's shard
+
+    def add_conversation(self, user_id, message, response):
+        with self._user_shard(user_id) as store:
+            return store.add_conversation(user_id, message, response)
+
+    def add_conversations(self, turns):
+        """VectorStore.add_conversations, one batch per shard; ids in input order"""
+        turns = list(turns)
+        by_shard = {}
+        for i, turn in enumerate(turns):
+            by_shard.setdefault(self.shard_of(turn["user_id"]), []).append(i)
+        ids = [None] * len(turns)
+        for shard, positions in by_shard.items():
+            with self._shard(shard) as store:
+                for i, conversation_id in zip(positions, store.add_conversations([turns[i] for i in positions])):
+                    ids[i] = conversation_id
+        return ids
+
+    def search_similar_conversations(self, user_id, query, n_results=3, weights=None):
+        with self._user_shard(user_id) as store:
+            return store.search_similar_conversations(user_id, query, n_results, weights or self.weights)
+
+    def search_similar(self, user_id, query, n_results=3, weights=None):
+        with self._user_shard(user_id) as store:
+            return store.search_similar(user_id, query, n_results, weights or self.weights)
+
+    def search_many(self, queries, n_results=3, weights=None):
+        """VectorStore.search_many, one batch per shard; results in input order"""
+        by_shard = {}
+        for i, (user_id, _) in enumerate(queries):
+            by_shard.setdefault(self.shard_of(user_id), []).append(i)
+        results = [[] for _ in queries]
+        for shard, positions in by_shard.items():
+            with self._shard(shard) as store:
+                found = store.search_many([queries[i] for i in positions], n_results, weights or self.weights)
+            for i, conversations in zip(positions, found):
+                results[i] = conversations
+        return results
+
+    def get_user_conversations(self, user_id, limit=10):
+        with self._user_shard(user_id) as store:
+            return store.get_user_conversations(user_id, limit)
+
+    def get_history_page(self, user_id, before=None, limit=20):
+        with self._user_shard(user_id) as store:
+            return store.get_history_page(user_id, before, limit)
+
+    def delete_user(self, user_id):
+        with self._user_shard(user_id) as store:
+            return store.delete_user(user_id)
+
+    def get_conversation_count(self, user_id=None):
+        """Conversations of ``user_id``, or of the whole store (visits every shard)"""
+        if user_id:
+            with self._user_shard(user_id) as store:
+                return store.get_conversation_count(user_id)
+        return sum(self._each_shard(lambda store: store.get_conversation_count()))
+
+    # Store-wide maintenance: every shard (retention limits apply per shard)
+
+    def apply_retention(self):
+        return sum(self._each_shard(lambda store: store.apply_retention()))
+
+    def compact(self):
+        return sum(self._each_shard(lambda store: store.compact()))
+
+    def reembed(self, batch_size=1000):
+        self._each_shard(lambda store: store.reembed(batch_size))
+
+    # Worker state: only the shards this worker has open
+
+    def flush(self):
+        for store in self._open_stores():
+            store.flush()
+
+    def close(self):
+        """Flush and close every open shard (worker shutdown)"""
+        self.evictor.stop()
+        for shard in list(self._open):
+            self._close_shard(shard)
+
+    def persistence_stats(self):
+        stats = {"mode": "write-behind" if Config.WRITE_BEHIND else "sync"}
+        for store in self._open_stores():
+            for key, value in store.persistence_stats().items():
+                if key in ("queue_depth", "flushed_total", "flush_errors"):
+                    stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def get_stats(self):
+        """Sizes summed over the open shards"""
+        stores = self._open_stores()
+        return {
+            "storage_mode": self.storage_mode or Config.VECTOR_STORE_MODE,
+            "conversations": sum(len(store.conversations) for store in stores),
+            "users": sum(len(store.user_index) for store in stores),
+            "deleted_rows": sum(len(store.tombstones) for store in stores),
+            "shards": {"count": self.shards, "open": len(stores)},
+            "persistence": self.persistence_stats(),
+        }
+
+
+def create_vector_store(data_dir=None, shards=None):
+    """The configured store: a plain VectorStore, or a router when VECTOR_STORE_SHARDS > 1"""
+    shards = shards or Config.VECTOR_STORE_SHARDS
+    if shards > 1:
+        return ShardedVectorStore(data_dir, shards)
+    data_dir = data_dir or Config.CHROMA_DB_PATH
+    layouts = existing_layouts(data_dir)
+    if layouts and 1 not in layouts:
+        raise ValueError(f"{data_dir} holds a store with {layouts[-1]} shards; "
+                         f"set VECTOR_STORE_SHARDS={layouts[-1]}")
+    return VectorStore(data_dir)
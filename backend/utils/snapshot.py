@@ -0,0 +1,275 @@
+import glob
+import json
+import mmap
+import os
+import threading
+import time
+import numpy as np
+
+SNAPSHOT_FILE = "snapshot.bin"
+MAGIC = b"ACMSNAP1"
+SNAPSHOT_VERSION = 1
+ALIGN = 64
+# Columns stored as string arenas; user_id is dictionary-encoded instead
+STRING_COLUMNS = ("id", "timestamp", "user_message", "assistant_response")
+CONVERSATION_KEYS = {"id", "user_id", "timestamp", "user_message", "assistant_response", "text"}
+META_KEYS = {"id", "user_id", "timestamp"}
+
+
+def _text(message, response):
+    # Same as VectorStore._new_turn; rows where it holds don't store their text
+    return f"User: {message}\nAssistant: {response}"
+
+
+def _arena(strings):
+    """(offsets, bytes) of utf-8 strings laid end to end; string i is bytes[offsets[i]:offsets[i + 1]]"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def snapshot_rows(conversations, metadata):
+    """Columns for write_snapshot(), or None if some row can't be rebuilt from them exactly"""
+    users, user_codes, texts = {}, [], []
+    for conversation, meta in zip(conversations, metadata):
+        if (conversation.keys() != CONVERSATION_KEYS or meta.keys() != META_KEYS
+                or any(meta[key] != conversation[key] for key in META_KEYS)
+                or not all(isinstance(conversation[key], str) for key in CONVERSATION_KEYS)):
+            return None
+        user_codes.append(users.setdefault(conversation["user_id"], len(users)))
+        text = conversation["text"]
+        if not text:
+            return None
+        texts.append(None if text == _text(conversation["user_message"], conversation["assistant_response"])
+                     else text)
+    columns = {"users": _arena(list(users)), "user_codes": np.array(user_codes, dtype=np.int32)}
+    for column in STRING_COLUMNS:
+        columns[column] = _arena([conversation[column] for conversation in conversations])
+    # Timestamps as epoch seconds, so retention can filter on age without decoding rows
+    columns["times"] = np.array([conversation["timestamp"] for conversation in conversations],
+                                dtype='datetime64[s]').view(np.int64)
+    if any(text is not None for text in texts):
+        columns["text"] = _arena([text or "" for text in texts])
+    return columns
+
+
+def write_snapshot(path, rows, dim, position, columns, tombstones=(), embeddings=None, embedder=None):
+    """Write a snapshot atomically (temp file, fsync, rename) and return its size.
+
+    Layout: 64-byte aligned raw sections, then the JSON header (section
+    offsets, dtypes and shapes, the store ``position`` it was taken at
+    and the embedder state), then the header length and MAGIC again.
+    """
+    sections, arrays = {}, []
+
+    def add(name, array):
+        array = np.ascontiguousarray(array)
+        arrays.append((name, array))
+        sections[name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+
+    for name, value in columns.items():
+        if isinstance(value, tuple):
+            add(f"{name}.offsets", value[0])
+            add(f"{name}.data", value[1])
+        else:
+            add(name, value)
+    tomb_offsets, tomb_data = _arena(sorted(tombstones))
+    add("tombstones.offsets", tomb_offsets)
+    add("tombstones.data", tomb_data)
+    if embeddings is not None:
+        add("embeddings", embeddings)
+
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        for name, array in arrays:
+            f.write(b"\0" * (-f.tell() % ALIGN))
+            sections[name]["offset"] = f.tell()
+            # memoryview.cast() rejects zero-length multi-dimensional arrays (an empty store)
+            if array.size:
+                f.write(memoryview(array).cast('B'))
+        header = json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "rows": rows,
+            "dim": dim,
+            "position": position,
+            "embedder": embedder,
+            "written_at": time.time(),
+            "sections": sections,
+        }).encode('utf-8')
+        f.write(header)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+
+def remove_stale_temp_files(path, max_age=3600):
+    """Temp files of writers that died mid-snapshot"""
+    for tmp in glob.glob(f"{path}.*.tmp"):
+        try:
+            if time.time() - os.path.getmtime(tmp) > max_age:
+                os.remove(tmp)
+        except OSError:
+            pass
+
+
+def read_header(path):
+    """The snapshot's header, or None if there is no readable snapshot"""
+    snapshot = Snapshot.open(path)
+    return snapshot.header if snapshot is not None else None
+
+
+class Snapshot:
+    """A snapshot file mapped read-only; rows are decoded only when accessed.
+
+    Arrays are views straight into the map, so opening costs a header
+    parse plus page faults for whatever is touched. The map stays valid
+    after a newer snapshot replaces the file.
+    """
+
+    def __init__(self, path, mm, header):
+        self.path = path
+        self.header = header
+        self.rows = header["rows"]
+        self.position = header["position"]
+        self._mm = mm
+        self._arrays = {}
+        self.users = self._strings("users")
+        self.user_codes = self.array("user_codes")
+        self._offsets = {column: self.array(f"{column}.offsets") for column in STRING_COLUMNS}
+        self._data = {column: self.array(f"{column}.data") for column in STRING_COLUMNS}
+        self._text = None
+        if "text.offsets" in header["sections"]:
+            self._text = (self.array("text.offsets"), self.array("text.data"))
+
+    @classmethod
+    def open(cls, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:len(MAGIC)] != MAGIC or mm[-len(MAGIC):] != MAGIC:
+                raise ValueError("not a snapshot (or a truncated one)")
+            header_end = len(mm) - len(MAGIC) - 8
+            header_len = int.from_bytes(mm[header_end:header_end + 8], 'little')
+            header = json.loads(mm[header_end - header_len:header_end].decode('utf-8'))
+            if header.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"unsupported version {header.get('version')}")
+            return cls(path, mm, header)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring snapshot {path}: {e}")
+            return None
+
+    def array(self, name):
+        if name not in self._arrays:
+            section = self.header["sections"][name]
+            dtype = np.dtype(section["dtype"])
+            count = int(np.prod(section["shape"], dtype=np.int64))
+            self._arrays[name] = np.frombuffer(self._mm, dtype=dtype, count=count,
+                                               offset=section["offset"]).reshape(section["shape"])
+        return self._arrays[name]
+
+    def _strings(self, column):
+        offsets, data = self.array(f"{column}.offsets"), self.array(f"{column}.data")
+        raw = data.tobytes()
+        return [raw[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def _string(self, column, row):
+        offsets, data = self._offsets[column], self._data[column]
+        return data[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def conversation(self, row):
+        conversation = {
+            "id": self._string("id", row),
+            "user_id": self.users[self.user_codes[row]],
+            "timestamp": self._string("timestamp", row),
+            "user_message": self._string("user_message", row),
+            "assistant_response": self._string("assistant_response", row),
+        }
+        text = None
+        if self._text is not None:
+            offsets, data = self._text
+            text = data[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+        conversation["text"] = text or _text(conversation["user_message"], conversation["assistant_response"])
+        return conversation
+
+    def metadata(self, row):
+        return {"id": self._string("id", row), "user_id": self.users[self.user_codes[row]],
+                "timestamp": self._string("timestamp", row)}
+
+    def ids(self, rows=None):
+        offsets = self.array("id.offsets")[:(self.rows if rows is None else rows) + 1]
+        raw = self.array("id.data")[:offsets[-1]].tobytes()
+        return [raw[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def tombstones(self):
+        return set(self._strings("tombstones"))
+
+    def times(self, rows=None):
+        """Timestamps of the first ``rows`` rows as datetime64[s], or None in older snapshots"""
+        if "times" not in self.header["sections"]:
+            return None
+        return self.array("times")[:self.rows if rows is None else rows].view('datetime64[s]')
+
+    def user_rows(self, rows=None):
+        """{user_id: rows in order} for the first ``rows`` rows, grouped without decoding them"""
+        codes = self.user_codes[:self.rows if rows is None else rows]
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(self.users) + 1))
+        return {user_id: order[bounds[code]:bounds[code + 1]].tolist()
+                for code, user_id in enumerate(self.users) if bounds[code + 1] > bounds[code]}
+
+    def embeddings(self):
+        """The embedding rows (a view into the map), or None if they weren't stored"""
+        if "embeddings" not in self.header["sections"]:
+            return None
+        return self.array("embeddings")
+
+    def embedder_state(self, name):
+        embedder = self.header.get("embedder") or {}
+        return embedder.get("state") if embedder.get("name") == name else None
+
+
+class SnapshotRows:
+    """List-like rows: the first ``base`` rows of a snapshot, decoded on access, then a plain list.
+
+    Stands in for the ``conversations``/``metadata`` lists after a warm
+    start; slicing returns plain lists.
+    """
+
+    def __init__(self, snapshot, decode, base, tail=None):
+        self.snapshot = snapshot
+        self.base = base
+        self._decode = decode
+        self._tail = tail if tail is not None else []
+
+    def __len__(self):
+        return self.base + len(self._tail)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < self.base:
+            if index < 0:
+                raise IndexError(index)
+            return self._decode(index)
+        return self._tail[index - self.base]
+
+    def __iter__(self):
+        for i in range(self.base):
+            yield self._decode(i)
+        yield from self._tail
+
+    def append(self, row):
+        self._tail.append(row)
+
+    def extend(self, rows):
+        self._tail.extend(rows)
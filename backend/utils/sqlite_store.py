@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+CONVERSATION_COLUMNS = ("id", "user_id", "timestamp", "user_message", "assistant_response", "text")
+
+
+class SqliteStore:
+    """Conversations, metadata and float32 embeddings in one SQLite file.
+
+    Rows are indexed on (user_id, timestamp), and a trigger-maintained
+    per-user count table makes counts O(1). The file is opened in WAL
+    mode so several worker processes can share it: each write runs in an
+    IMMEDIATE transaction that first returns the rows other workers have
+    added since this process last looked, so every process sees the rows
+    in the same order. Deleted rows are removed at once and their ids
+    logged in ``tombstones`` so the other processes drop them from memory
+    too.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.last_row = 0
+        self.last_tombstone = 0
+        # Serializes this process's reads-then-appends of new rows
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        db = self._db()
+        # Lets compaction hand freed pages back to the OS (only takes effect on a new file)
+        db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        db.execute("CREATE TABLE IF NOT EXISTS conversations ("
+                   "row INTEGER PRIMARY KEY, id TEXT UNIQUE, user_id TEXT, timestamp TEXT, "
+                   "user_message TEXT, assistant_response TEXT, text TEXT, embedding BLOB)")
+        db.execute("CREATE INDEX IF NOT EXISTS conversations_user_time "
+                   "ON conversations (user_id, timestamp)")
+        # Counts kept by trigger; the '' row holds the total
+        db.execute("CREATE TABLE IF NOT EXISTS user_counts (user_id TEXT PRIMARY KEY, n INTEGER)")
+        db.execute("CREATE TRIGGER IF NOT EXISTS conversations_count AFTER INSERT ON conversations "
+                   "BEGIN INSERT INTO user_counts VALUES (NEW.user_id, 1), ('', 1) "
+                   "ON CONFLICT(user_id) DO UPDATE SET n = n + 1; END")
+        db.execute("CREATE TRIGGER IF NOT EXISTS conversations_uncount AFTER DELETE ON conversations "
+                   "BEGIN UPDATE user_counts SET n = n - 1 WHERE user_id IN (OLD.user_id, ''); END")
+        # Highest row number ever used. SQLite hands the largest rowid out again once its row
+        # is deleted, and read_new() (row > last_row) would never see the reused one
+        db.execute("CREATE TABLE IF NOT EXISTS row_seq (n INTEGER)")
+        db.execute("INSERT INTO row_seq SELECT COALESCE(MAX(row), 0) FROM conversations "
+                   "WHERE NOT EXISTS (SELECT 1 FROM row_seq)")
+        db.execute("CREATE TRIGGER IF NOT EXISTS conversations_seq AFTER INSERT ON conversations "
+                   "BEGIN UPDATE row_seq SET n = MAX(n, NEW.row); END")
+        db.execute("CREATE TABLE IF NOT EXISTS tombstones ("
+                   "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, id TEXT, deleted_at REAL)")
+
+    def _db(self):
+        # One connection per thread (and per process: connections don't survive a fork)
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            # Autocommit; multi-statement writes use explicit transactions
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def exists(self):
+        return self._db().execute("SELECT 1 FROM conversations LIMIT 1").fetchone() is not None
+
+    def _rows_after(self, db, row):
+        turns = []
+        for record in db.execute("SELECT row, " + ", ".join(CONVERSATION_COLUMNS) + ", embedding "
+                                 "FROM conversations WHERE row > ? ORDER BY row", (row,)):
+            conversation = dict(zip(CONVERSATION_COLUMNS, record[1:7]))
+            meta = {"id": conversation["id"], "user_id": conversation["user_id"],
+                    "timestamp": conversation["timestamp"]}
+            turns.append((conversation, meta, np.frombuffer(record[7], dtype=np.float32)))
+            self.last_row = record[0]
+        return turns
+
+    def read_new(self):
+        """Turns added (by any process) since the last read or append"""
+        with self.lock:
+            return self._rows_after(self._db(), self.last_row)
+
+    def load(self):
+        """All stored turns as (conversations, metadata, embedding matrix)"""
+        with self.lock:
+            self.last_row = 0
+            db = self._db()
+            # Deleted rows are already gone; only later deletions need replaying
+            self.last_tombstone = db.execute("SELECT COALESCE(MAX(seq), 0) FROM tombstones").fetchone()[0]
+            turns = self._rows_after(db, 0)
+        embeddings = (np.vstack([e for _, _, e in turns]) if turns
+                      else np.empty((0, self.dim), dtype=np.float32))
+        return [c for c, _, _ in turns], [m for _, m, _ in turns], embeddings
+
+    def resume(self, last_row, last_tombstone):
+        """Continue from a snapshot taken at (last_row, last_tombstone) instead of load().
+
+        read_new() and read_tombstones() then return what changed since.
+        Returns False if tombstones written after the snapshot were
+        already pruned by vacuum(): those deletions can't be replayed.
+        """
+        with self.lock:
+            db = self._db()
+            written = db.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence "
+                                 "WHERE name = 'tombstones'").fetchone()[0]
+            kept = db.execute("SELECT COUNT(*) FROM tombstones WHERE seq > ?", (last_tombstone,)).fetchone()[0]
+            if written < last_tombstone or kept != written - last_tombstone:
+                return False
+            self.last_row, self.last_tombstone = last_row, last_tombstone
+        return True
+
+    def append_many(self, turns):
+        """Insert turns; returns the other processes' newer turns that precede them"""
+        db = self._db()
+        with self.lock:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                newer = self._rows_after(db, self.last_row)
+                db.executemany(
+                    "INSERT INTO conversations (row, " + ", ".join(CONVERSATION_COLUMNS) + ", embedding) "
+                    "VALUES ((SELECT n + 1 FROM row_seq), ?, ?, ?, ?, ?, ?, ?)",
+                    [tuple(conversation.get(c) for c in CONVERSATION_COLUMNS)
+                     + (np.asarray(embedding, dtype=np.float32).reshape(-1).tobytes(),)
+                     for conversation, _, embedding in turns])
+                self.last_row = db.execute("SELECT MAX(row) FROM conversations").fetchone()[0]
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return newer
+
+    def delete(self, records):
+        """Delete the rows in {"user_id", "ids"} records and log them; returns rows deleted"""
+        db = self._db()
+        now = time.time()
+        with self.lock:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                pairs = [(record["user_id"], conversation_id)
+                         for record in records for conversation_id in record["ids"]]
+                deleted = db.executemany("DELETE FROM conversations WHERE id = ?",
+                                         [(i,) for _, i in pairs]).rowcount
+                db.executemany("INSERT INTO tombstones (user_id, id, deleted_at) VALUES (?, ?, ?)",
+                               [(user_id, i, now) for user_id, i in pairs])
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def read_tombstones(self):
+        """{"user_id", "ids"} records deleted (by any process) since the last read"""
+        with self.lock:
+            by_user = {}
+            for seq, user_id, conversation_id in self._db().execute(
+                    "SELECT seq, user_id, id FROM tombstones WHERE seq > ? ORDER BY seq",
+                    (self.last_tombstone,)):
+                by_user.setdefault(user_id, []).append(conversation_id)
+                self.last_tombstone = seq
+        return [{"user_id": user_id, "ids": ids} for user_id, ids in by_user.items()]
+
+    def vacuum(self, tombstone_ttl=86400, pages=1000):
+        """Forget old tombstones and return up to ``pages`` free pages to the OS"""
+        db = self._db()
+        db.execute("DELETE FROM tombstones WHERE deleted_at < ?", (time.time() - tombstone_ttl,))
+        db.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+
+    def replace_embeddings(self, conversation_ids, blocks):
+        """Overwrite the embeddings of ``conversation_ids`` with the rows of ``blocks``"""
+        ids = iter(conversation_ids)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for block in blocks:
+                db.executemany("UPDATE conversations SET embedding = ? WHERE id = ?",
+                               [(np.asarray(row, dtype=np.float32).tobytes(), next(ids))
+                                for row in block])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def existing(self, conversation_ids):
+        """The subset of ``conversation_ids`` that are stored"""
+        conversation_ids = list(conversation_ids)
+        found = set()
+        # Chunked to stay under SQLite's bound-parameter limit
+        for start in range(0, len(conversation_ids), 500):
+            chunk = conversation_ids[start:start + 500]
+            found.update(i for i, in self._db().execute(
+                "SELECT id FROM conversations WHERE id IN (" + ", ".join("?" * len(chunk)) + ")", chunk))
+        return found
+    
+    def count(self, user_id=None):
+        row = self._db().execute("SELECT n FROM user_counts WHERE user_id = ?",
+                                 (user_id or '',)).fetchone()
+        return row[0] if row else 0
+
+    def recent(self, user_id, limit, before=None):
+        """A user's newest turns, newest first, straight off the (user_id, timestamp) index.
+        
+        Ties on timestamp go by id, descending; ``before`` is a (timestamp, id)
+        key and only turns ordered after it are returned.
+        """
+        where, args = "user_id = ?", (user_id,)
+        if before is not None:
+            where, args = "user_id = ? AND (timestamp, id) < (?, ?)", (user_id, *before)
+        records = self._db().execute(
+            "SELECT " + ", ".join(CONVERSATION_COLUMNS) + " FROM conversations "
+            "WHERE " + where + " ORDER BY timestamp DESC, id DESC LIMIT ?", args + (limit,))
+        return [dict(zip(CONVERSATION_COLUMNS, record)) for record in records]
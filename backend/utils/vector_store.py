@@ -1,14 +1,41 @@
+import heapq
+import hashlib
 import json
+import threading
+import time
 import uuid
 import numpy as np
+import scipy.sparse as sp
 import os
 from datetime import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from config import Config
+from utils.ann_index import IVFIndex
+from utils.embedders import create_embedder
+from utils.embedding_buffer import EmbeddingBuffer
+from utils.log import get_logger
+from utils.metrics import metrics
+from utils.retention import PeriodicTask, RetentionPolicy
+from utils.scoring import RowFeatures, ScoreWeights, hybrid_scores, parse_times
+from utils.segment_log import SegmentLog
+from utils.snapshot import (SNAPSHOT_FILE, Snapshot, SnapshotRows, read_header, remove_stale_temp_files,
+                            snapshot_rows, write_snapshot)
+from utils.sqlite_store import SqliteStore
+from utils.write_behind import WriteBehindQueue
+
+log = get_logger('vector_store')
+metrics.describe('store_persist_seconds', 'Time to write a batch of turns to storage')
+metrics.describe('store_compact_seconds', 'Time per compaction pass')
+metrics.describe('store_deleted_rows_total', 'Conversations deleted (session deletion or retention)')
+metrics.describe('store_compacted_rows_total', 'Deleted conversations reclaimed by compaction')
+metrics.describe('store_snapshot_seconds', 'Time to write a warm-start snapshot')
 
 class VectorStore:
-    def __init__(self):
-        self.data_dir = "./chroma_db"
+    def __init__(self, data_dir=None, storage_mode=None, embedder=None):
+        self.data_dir = data_dir or Config.CHROMA_DB_PATH
+        self.storage_mode = storage_mode or Config.VECTOR_STORE_MODE
+        # Sparse CSR embeddings need the segment log (rows are persisted in batches on roll)
+        self.sparse = self.storage_mode == "append" and Config.EMBEDDING_FORMAT == "sparse"
+        self.dim = Config.EMBEDDING_DIM
         self.data_file = os.path.join(self.data_dir, "conversations.json")
         self.embeddings_file = os.path.join(self.data_dir, "embeddings.npy")
         self.metadata_file = os.path.join(self.data_dir, "metadata.json")
@@ -16,18 +43,307 @@ class VectorStore:
         # Create directory if it doesn't exist
         os.makedirs(self.data_dir, exist_ok=True)
         
+        # Ids of deleted rows still held in memory/segments (dropped by compact())
+        self.tombstones = set()
+        # Bumped to odd before and to even after rows are renumbered (see _read_consistent)
+        self._version = 0
+        self._json_lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        # One re-embed at a time; automatic refits run on their own thread
+        self._reembed_lock = threading.Lock()
+        self._refit_start_lock = threading.Lock()
+        self._refit_thread = None
+        self.embedder_file = os.path.join(self.data_dir, "embedder.json")
+        
+        # Warm start: rows the snapshot holds are mapped from it instead of parsed,
+        # so only what was written after it is read from storage
+        self.snapshot_file = os.path.join(self.data_dir, SNAPSHOT_FILE)
+        snapshot = self._open_snapshot()
+        self._snapshot_key = None
+        
         # Initialize storage
+        self.segment_log = None
+        self.sqlite_store = None
+        if self.storage_mode == "append":
+            self.segment_log = SegmentLog(self.data_dir, self.dim,
+                                          "sparse" if self.sparse else "dense")
+            self.warm_start = self._load_append_only(snapshot)
+        elif self.storage_mode == "sqlite":
+            self.sqlite_store = SqliteStore(os.path.join(self.data_dir, "conversations.db"), self.dim)
+            self.warm_start = self._load_sqlite(snapshot)
+        else:
+            self.warm_start = self._load_json_files(snapshot)
+        if self.warm_start:
+            log.info(f"⚡ Warm start: {snapshot.rows} conversations mapped from {self.snapshot_file}, "
+                     f"{len(self.conversations) - self.conversations.base} read from storage")
+        
+        # user_id -> row indices into conversations/metadata/embeddings
+        self._rebuild_user_index()
+        
+        # Optional write-behind: turns are queued and flushed in batches by a background thread
+        self._unsynced_turns = 0
+        self.write_queue = None
+        if Config.WRITE_BEHIND:
+            self.write_queue = WriteBehindQueue(self._persist, Config.WRITE_BEHIND_INTERVAL,
+                                                Config.WRITE_BEHIND_BATCH)
+        
+        # Per-user ANN indexes, built lazily once a user passes ANN_MIN_ROWS
+        self.ann_dir = os.path.join(self.data_dir, "ann")
+        os.makedirs(self.ann_dir, exist_ok=True)
+        self.ann_indexes = {}
+        self._ann_dirty = set()
+        
+        # Initialize embedder (hashing needs no fit; tfidf reloads its persisted vocabulary,
+        # or the copy in the snapshot if that file is gone)
+        self.embedder = create_embedder(embedder or Config.EMBEDDER, self.dim, self.data_dir)
+        self.embedder.load(lambda: [conv["text"] for conv in self.conversations])
+        if self.warm_start:
+            self.embedder.load_state(snapshot.embedder_state(self.embedder.name))
+        
+        # Retention and compaction run on a background thread, started with the first write
+        self.retention = RetentionPolicy(Config.RETENTION_MAX_TURNS_PER_USER,
+                                         Config.RETENTION_MAX_TURNS, Config.RETENTION_MAX_AGE_DAYS)
+        self.maintenance = PeriodicTask(self.maintain, Config.MAINTENANCE_INTERVAL, "store-maintenance")
+        self.snapshotter = PeriodicTask(self.save_snapshot, Config.SNAPSHOT_INTERVAL if Config.SNAPSHOT else 0,
+                                        "store-snapshot")
+        
+        # Default ranking for search_similar, and the per-user term counts/timestamps it scores with
+        self.weights = ScoreWeights(Config.RETRIEVAL_SIMILARITY_WEIGHT, Config.RETRIEVAL_KEYWORD_WEIGHT,
+                                    Config.RETRIEVAL_RECENCY_WEIGHT, Config.RETRIEVAL_HALF_LIFE_HOURS,
+                                    Config.RETRIEVAL_THRESHOLD)
+        self.row_features = RowFeatures(Config.RETRIEVAL_FEATURE_USERS)
+        # Every row's timestamp as datetime64, for retention (see _row_times)
+        self._times = np.empty(0, dtype='datetime64[s]')
+        self._times_version = None
+        
+        # Last: a store from before embedder.json is re-embedded here, which needs all of the above
+        self._check_embedder()
+    
+    def _load_append_only(self, snapshot=None):
+        """Load segments + replay the log, migrating the legacy three-file layout.
+        
+        With a ``snapshot`` of the same generation only the rows after it
+        (and the active log) are read; returns whether it was used.
+        """
+        if not self.segment_log.exists() and os.path.exists(self.data_file):
+            log.info(f"📦 Migrating {self.data_file} to append-only segments")
+            conversations = self._load_json(self.data_file, [])
+            metadata = self._load_json(self.metadata_file, [])
+            embeddings = self._load_embeddings()
+            rows = min(len(conversations), len(metadata), embeddings.shape[0])
+            self.segment_log.initialize(conversations[:rows], metadata[:rows], embeddings[:rows])
+            for path in (self.data_file, self.metadata_file, self.embeddings_file):
+                if os.path.exists(path):
+                    os.replace(path, path + ".migrated")
+        resumed = None
+        if snapshot is not None:
+            resumed = self.segment_log.resume(snapshot.position["rows"], snapshot.position["generation"])
+        if resumed is None:
+            self.conversations, self.metadata = self.segment_log.load()
+        else:
+            start, conversations, metadata = resumed
+            self.conversations = SnapshotRows(snapshot, snapshot.conversation, start, conversations)
+            self.metadata = SnapshotRows(snapshot, snapshot.metadata, start, metadata)
+        self._embeddings = self.segment_log.embeddings
+        self.tombstones = {i for record in self.segment_log.read_tombstones() for i in record["ids"]}
+        return resumed is not None
+    
+    def _reload(self):
+        """Another process compacted or re-embedded the store: start over from disk"""
+        self._version += 1
+        try:
+            if self.sqlite_store is not None:
+                self._load_sqlite()
+            else:
+                self._load_append_only()
+            self.embedder.refresh()
+            self._embedder_stamp = self._file_stamp(self.embedder_file)
+            self._rebuild_user_index()
+            self.row_features.invalidate()
+            self.ann_indexes = {}
+            self._ann_dirty.clear()
+        finally:
+            self._version += 1
+    
+    def _load_sqlite(self, snapshot=None):
+        """Load every row from SQLite, importing the legacy three-file layout once.
+        
+        With a ``snapshot`` only the rows and deletions logged after it are
+        read; returns whether it was used.
+        """
+        if not self.sqlite_store.exists() and os.path.exists(self.data_file):
+            log.info(f"📦 Migrating {self.data_file} to {self.sqlite_store.path}")
+            conversations = self._load_json(self.data_file, [])
+            metadata = self._load_json(self.metadata_file, [])
+            embeddings = self._load_embeddings()
+            rows = min(len(conversations), len(metadata), embeddings.shape[0])
+            self.sqlite_store.append_many(list(zip(conversations[:rows], metadata[:rows],
+                                                   embeddings[:rows])))
+            for path in (self.data_file, self.metadata_file, self.embeddings_file):
+                if os.path.exists(path):
+                    os.replace(path, path + ".migrated")
+        position = snapshot.position if snapshot is not None else None
+        # Re-embedding rewrites every stored vector (and embedder.json), so it retires the snapshot
+        if (position is None or position["embedder"] != self._file_stamp(self.embedder_file)
+                or not self.sqlite_store.resume(position["last_row"], position["last_tombstone"])):
+            self.conversations, self.metadata, embeddings = self.sqlite_store.load()
+            self._embeddings = EmbeddingBuffer(self.dim, embeddings, dtype=np.float32)
+            return False
+        self.conversations = SnapshotRows(snapshot, snapshot.conversation, snapshot.rows)
+        self.metadata = SnapshotRows(snapshot, snapshot.metadata, snapshot.rows)
+        self._embeddings = EmbeddingBuffer(self.dim, snapshot.embeddings(), dtype=np.float32)
+        self.tombstones = snapshot.tombstones()
+        turns = self.sqlite_store.read_new()
+        if turns:
+            self._embeddings.extend(np.vstack([e for _, _, e in turns]))
+            self.conversations.extend([c for c, _, _ in turns])
+            self.metadata.extend([m for _, m, _ in turns])
+        self.tombstones.update(i for record in self.sqlite_store.read_tombstones() for i in record["ids"])
+        return True
+    
+    def _load_json_files(self, snapshot=None):
+        """Load the three JSON-mode files, or take the rows from a ``snapshot`` of exactly these files"""
+        if snapshot is not None and snapshot.position["files"] == self._json_stamps():
+            self.conversations = SnapshotRows(snapshot, snapshot.conversation, snapshot.rows)
+            self.metadata = SnapshotRows(snapshot, snapshot.metadata, snapshot.rows)
+            self.embeddings = self._load_embeddings()
+            return True
         self.conversations = self._load_json(self.data_file, [])
         self.metadata = self._load_json(self.metadata_file, [])
         self.embeddings = self._load_embeddings()
+        return False
+    
+    def _check_embedder(self):
+        """Record which embedder built the stored vectors; warn if it differs from the configured one.
         
-        # Initialize vectorizer
-        self.vectorizer = TfidfVectorizer(max_features=384, stop_words='english')
+        Rows without an embedder.json were written before it existed, by the
+        original store, which fitted TF-IDF at startup. Their vectors mean
+        nothing to any embedder now, so they are recorded as legacy tfidf
+        and re-embedded with the configured one (again on the next start if
+        this is interrupted).
+        """
+        stored = self._load_json(self.embedder_file, None)
+        if stored is None and len(self.conversations):
+            stored = {"name": "tfidf", "dim": self.dim, "legacy": True}
+            self._save_json(stored, self.embedder_file)
+        if stored is None:
+            self._save_json({"name": self.embedder.name, "dim": self.dim}, self.embedder_file)
+        elif stored.get("legacy"):
+            log.warning(f"⚠️ {self.data_dir} holds {len(self.conversations)} conversations embedded by "
+                        f"the original TF-IDF store; re-embedding them with '{self.embedder.name}'")
+            self._embedder_stamp = self._file_stamp(self.embedder_file)
+            self.reembed()
+            return
+        elif stored.get("name") != self.embedder.name:
+            log.warning(f"⚠️ Stored embeddings were built with '{stored.get('name')}' "
+                        f"but the '{self.embedder.name}' embedder is configured. Run reembed.py.")
+        self._embedder_stamp = self._file_stamp(self.embedder_file)
+    
+    def refresh(self, blocking=True):
+        """Pick up turns appended to the shared store by other worker processes"""
+        # Another process refitted the embedder and rewrote every stored embedding
+        refitted = (self.sqlite_store is not None or self.segment_log is not None) and \
+            self._file_stamp(self.embedder_file) != self._embedder_stamp
+        if self.sqlite_store is not None:
+            if not self.sqlite_store.lock.acquire(blocking=blocking):
+                return
+            try:
+                if refitted:
+                    self._reload()
+                    return
+                for conversation, meta, embedding in self.sqlite_store.read_new():
+                    self._embeddings.append(embedding)
+                    self._append_in_memory(conversation, meta)
+                self._apply_tombstones(self.sqlite_store.read_tombstones())
+            finally:
+                self.sqlite_store.lock.release()
+            return
+        if self.segment_log is None:
+            return
+        if not self.segment_log.thread_lock.acquire(blocking=blocking):
+            return
+        try:
+            new = self.segment_log.read_new()
+            if new is None or refitted:
+                self._reload()
+            else:
+                for conversation, meta in zip(*new):
+                    self._append_in_memory(conversation, meta)
+            self._apply_tombstones(self.segment_log.read_tombstones())
+        finally:
+            self.segment_log.thread_lock.release()
+    
+    @property
+    def embeddings(self):
+        """Live embedding rows, one per conversation"""
+        return self._embeddings.rows
+    
+    @embeddings.setter
+    def embeddings(self, value):
+        self._embeddings = EmbeddingBuffer(self.dim, value)
+    
+    def _append_in_memory(self, conversation, meta):
+        self.conversations.append(conversation)
+        self.metadata.append(meta)
+        self.user_index.setdefault(meta.get("user_id"), []).append(len(self.conversations) - 1)
+    
+    def _rebuild_user_index(self):
+        """Group live row indices by user_id so searches only touch one user's rows"""
+        user_index = {}
+        deleted = set()
+        start = 0
+        if isinstance(self.metadata, SnapshotRows):
+            # Snapshot rows are grouped off its user column without decoding them
+            snapshot, start = self.metadata.snapshot, self.metadata.base
+            user_index = snapshot.user_rows(start)
+            dead = set()
+            if self.tombstones:
+                for i, conversation_id in enumerate(snapshot.ids(start)):
+                    if conversation_id in self.tombstones:
+                        deleted.add(conversation_id)
+                        dead.add(i)
+            if dead:
+                user_index = {user_id: live for user_id, live in
+                              ((user_id, [row for row in rows if row not in dead])
+                               for user_id, rows in user_index.items()) if live}
+        for i, meta in enumerate(self.metadata[start:len(self.conversations)], start):
+            if meta.get("id") in self.tombstones:
+                deleted.add(meta["id"])
+                continue
+            user_index.setdefault(meta.get("user_id"), []).append(i)
+        self.user_index = user_index
+        # Forget tombstones whose rows are already gone
+        self.tombstones = deleted
+    
+    def _write_lock(self):
+        """The lock writers of this storage mode serialize on"""
+        if self.segment_log is not None:
+            return self.segment_log.locked()
+        if self.sqlite_store is not None:
+            return self.sqlite_store.lock
+        return self._json_lock
+    
+    def _read_consistent(self, fn):
+        """Run the read ``fn`` against one version of the rows.
         
-        # Fit vectorizer if we have existing data
-        if self.conversations:
-            texts = [conv["text"] for conv in self.conversations]
-            self.vectorizer.fit(texts)
+        Compaction swaps conversations, embeddings and ``user_index`` for
+        renumbered ones; a read that overlapped the swap (the version moved)
+        is retried instead of mixing old row numbers with new rows.
+        """
+        for _ in range(3):
+            version = self._version
+            if version % 2 == 0:
+                try:
+                    result = fn()
+                except Exception:
+                    if self._version == version:
+                        raise
+                    continue
+                if self._version == version:
+                    return result
+            time.sleep(0.001)
+        with self._write_lock():
+            return fn()
     
     def _load_json(self, filepath, default):
         """Load JSON file or return default if not exists"""
@@ -46,7 +362,7 @@ class VectorStore:
                 return np.load(self.embeddings_file)
             except Exception as e:
                 print(f"Error loading embeddings: {e}")
-        return np.array([]).reshape(0, 384)
+        return np.array([]).reshape(0, self.dim)
     
     def _save_json(self, data, filepath):
         """Save data to JSON file"""
@@ -64,32 +380,165 @@ class VectorStore:
             print(f"Error saving embeddings: {e}")
     
     def _get_embedding(self, text):
-        """Generate TF-IDF embedding for text"""
+        """Generate embedding for text with the configured embedder"""
+        embeddings = self._get_embeddings([text])
+        return embeddings if self.sparse else embeddings[0]
+    
+    def _get_embeddings(self, texts):
+        """Embeddings of ``texts`` as one matrix (CSR in sparse mode), in one embedder call"""
         try:
-            if hasattr(self.vectorizer, 'vocabulary_'):
-                # Vectorizer is already fitted
-                embedding = self.vectorizer.transform([text]).toarray()[0]
-            else:
-                # First time - fit the vectorizer
-                embedding = self.vectorizer.fit_transform([text]).toarray()[0]
+            with metrics.timer('chat_stage_seconds', stage='embed'):
+                if self.sparse:
+                    return self.embedder.embed_sparse(texts)
+                return self.embedder.embed(texts)
+        except Exception as e:
+            metrics.inc('embedding_errors_total')
+            log.warning(f"Embedding generation error: {e}")
+            # Return random embeddings as fallback
+            embeddings = np.random.rand(len(texts), self.dim)
+            return sp.csr_matrix(embeddings) if self.sparse else embeddings
+    
+    def reembed(self, batch_size=1000, only_if_needed=False):
+        """Rebuild every stored embedding with the configured embedder.
+        
+        A stateful embedder (tfidf) is refitted on the whole corpus first.
+        In append mode the new embedding file is swapped in atomically and
+        other workers pick it up on their next refresh. With
+        ``only_if_needed`` (an automatic refit) nothing happens if another
+        worker refitted first. ANN indexes are dropped and retrained on
+        demand.
+        
+        A stateful embedder is refitted as a new instance, and the rows
+        stored so far are embedded without the write lock, so searches keep
+        using the current vocabulary and vectors and writers only wait for
+        the rows added meanwhile and the swap.
+        """
+        with self._reembed_lock:
+            # Queued turns were embedded with the old vocabulary; store them first
+            self.flush()
+            self.refresh()
+            stamp, version = self._embedder_stamp, self._version
+            if only_if_needed and not self.embedder.needs_refit(len(self.conversations)):
+                return False
+            embedder = self.embedder
+            texts = [conv["text"] for conv in self.conversations]
+            if embedder.stateful:
+                embedder = create_embedder(embedder.name, self.dim, self.data_dir)
+                if texts:
+                    embedder.fit(texts, save=False)
+            done = list(self._embed_blocks(embedder, texts, batch_size))
             
-            # Ensure consistent dimensions (384)
-            if len(embedding) < 384:
-                embedding = np.pad(embedding, (0, 384 - len(embedding)))
-            elif len(embedding) > 384:
-                embedding = embedding[:384]
-                
-            return embedding
+            with self._write_lock():
+                self.refresh()
+                if only_if_needed and self._embedder_stamp != stamp:
+                    return False
+                if self._version != version:
+                    # Rows were renumbered (compaction, or a reload) meanwhile: start over
+                    texts, done = [], []
+                tail = [conv["text"] for conv in self.conversations[len(texts):]]
+                blocks = done + list(self._embed_blocks(embedder, tail, batch_size))
+                self._swap_embeddings(blocks)
+                if embedder is not self.embedder:
+                    embedder.save()
+                    self.embedder = embedder
+                self._save_json({"name": self.embedder.name, "dim": self.dim}, self.embedder_file)
+                self._embedder_stamp = self._file_stamp(self.embedder_file)
+                self._drop_all_ann()
+        log.info(f"Re-embedded {len(self.conversations)} conversations with '{self.embedder.name}'")
+        return True
+    
+    def _embed_blocks(self, embedder, texts, batch_size):
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            yield embedder.embed_sparse(batch) if self.sparse else embedder.embed(batch)
+    
+    def _swap_embeddings(self, blocks):
+        """Store ``blocks`` (one row per conversation) as the embeddings; under the write lock"""
+        if self.segment_log is not None:
+            # Seal the log first so no record keeps an inline (stale) sparse row
+            start = self.segment_log.segment_row_count()
+            self.segment_log.roll(self.conversations[start:], self.metadata[start:])
+            self.segment_log.replace_embeddings(iter(blocks))
+        elif self.sqlite_store is not None:
+            self.sqlite_store.replace_embeddings([conv["id"] for conv in self.conversations], blocks)
+            self._embeddings = EmbeddingBuffer(self.dim, np.vstack(blocks) if blocks else None,
+                                               dtype=np.float32)
+        else:
+            self.embeddings = np.vstack(blocks) if blocks else None
+            self._save_embeddings()
+    
+    def _maybe_refit(self):
+        """Refit a stateful embedder once it has outgrown its vocabulary, on a background thread"""
+        if not self.embedder.needs_refit(len(self.conversations)):
+            return
+        with self._refit_start_lock:
+            if self._refit_thread is not None and self._refit_thread.is_alive():
+                return
+            self._refit_thread = threading.Thread(target=self._refit, name="embedder-refit", daemon=True)
+            self._refit_thread.start()
+    
+    def _refit(self):
+        try:
+            self.reembed(only_if_needed=True)
         except Exception as e:
-            print(f"Embedding generation error: {e}")
-            # Return random embedding as fallback
-            return np.random.rand(384)
+            log.exception(f"❌ Embedder refit failed: {e}")
+    
+    def wait_for_refit(self):
+        """Block until a background refit (if one is running) has finished"""
+        if self._refit_thread is not None:
+            self._refit_thread.join()
     
     def add_conversation(self, user_id, message, response):
         """Store conversation in vector database"""
-        conversation_id = str(uuid.uuid4())
-        text = f"User: {message}\nAssistant: {response}"
-        timestamp = datetime.now().isoformat()
+        conversation_data, meta = self._new_turn(user_id, message, response)
+        
+        # Generate embedding
+        self.embedder.observe([conversation_data["text"]])
+        embedding = self._get_embedding(conversation_data["text"])
+        
+        self.maintenance.ensure_started()
+        self.snapshotter.ensure_started()
+        if self.write_queue is not None:
+            # Write-behind: visible to searches now, persisted by the flusher thread
+            self.write_queue.put((conversation_data, meta, embedding))
+        else:
+            self._persist([(conversation_data, meta, embedding)])
+        self._maybe_refit()
+        
+        log.debug(f"Stored conversation {conversation_data['id']} for user {user_id}")
+        return conversation_data["id"]
+    
+    def add_conversations(self, turns):
+        """Store many turns at once: one embedder call and one persist for the batch.
+        
+        ``turns`` are dicts with user_id, message, response and optionally
+        an ISO timestamp and id (imported or rebalanced history keeps its
+        own). Returns the ids.
+        """
+        turns = list(turns)
+        if not turns:
+            return []
+        records = [self._new_turn(turn["user_id"], turn["message"], turn["response"], turn.get("timestamp"),
+                                  turn.get("id")) for turn in turns]
+        texts = [conversation["text"] for conversation, _ in records]
+        self.embedder.observe(texts)
+        embeddings = self._get_embeddings(texts)
+        batch = [(conversation, meta, embeddings[i]) for i, (conversation, meta) in enumerate(records)]
+        
+        self.maintenance.ensure_started()
+        self.snapshotter.ensure_started()
+        # Bypasses the write-behind queue; flush it first so rows keep arrival order
+        self.flush()
+        self._persist(batch)
+        self._maybe_refit()
+        
+        log.debug(f"Stored {len(batch)} conversations")
+        return [conversation["id"] for conversation, _ in records]
+    
+    def _new_turn(self, user_id, message, response, timestamp=None, conversation_id=None):
+        """(conversation, metadata) records for a new turn"""
+        conversation_id = conversation_id or str(uuid.uuid4())
+        timestamp = timestamp or datetime.now().isoformat()
         
         # Create conversation data
         conversation_data = {
@@ -98,88 +547,643 @@ class VectorStore:
             "timestamp": timestamp,
             "user_message": message,
             "assistant_response": response,
-            "text": text
+            "text": f"User: {message}\nAssistant: {response}"
         }
-        
-        # Generate embedding
-        embedding = self._get_embedding(text)
-        
-        # Update conversations list
-        self.conversations.append(conversation_data)
-        
-        # Update metadata
-        self.metadata.append({
+        meta = {
             "id": conversation_id,
             "user_id": user_id,
             "timestamp": timestamp
-        })
-        
-        # Update embeddings matrix
-        if self.embeddings.shape[0] == 0:
-            self.embeddings = embedding.reshape(1, -1)
+        }
+        return conversation_data, meta
+    
+    def _persist(self, turns):
+        """Write (conversation, metadata, embedding) turns to disk and the in-memory index"""
+        with metrics.timer('store_persist_seconds'):
+            self._persist_turns(turns)
+    
+    def _persist_turns(self, turns):
+        if self.segment_log is not None:
+            # Append to the shared log; the embedding rows go to the mapped file
+            with self.segment_log.locked():
+                self.refresh()
+                # Embeddings first: searches don't lock, and must not see a row without one
+                self.segment_log.append_many(turns)
+                for conversation, meta, embedding in turns:
+                    self._append_in_memory(conversation, meta)
+                    self._ann_add(meta["user_id"], len(self.conversations) - 1, embedding)
+                self._maybe_sync(len(turns))
+                self._maybe_roll()
+        elif self.sqlite_store is not None:
+            # One transaction; rows other workers added first are applied before ours
+            with self.sqlite_store.lock:
+                turns = self.sqlite_store.append_many(turns) + list(turns)
+                # Embeddings first: searches don't lock, and must not see a row without one
+                self._embeddings.extend(np.vstack([np.ravel(e) for _, _, e in turns]))
+                for conversation, meta, embedding in turns:
+                    self._append_in_memory(conversation, meta)
+                    self._ann_add(meta["user_id"], len(self.conversations) - 1, embedding)
         else:
-            self.embeddings = np.vstack([self.embeddings, embedding])
-        
-        # Save to disk
-        self._save_json(self.conversations, self.data_file)
-        self._save_json(self.metadata, self.metadata_file)
+            # Under the lock so the files always match the rows in memory (see save_snapshot)
+            with self._json_lock:
+                # Update embeddings matrix (amortized growth, no full copy)
+                self._embeddings.extend(np.vstack([np.ravel(e) for _, _, e in turns]))
+                for conversation, meta, embedding in turns:
+                    self._append_in_memory(conversation, meta)
+                    self._ann_add(meta["user_id"], len(self.conversations) - 1, embedding)
+                self._save_all()
+    
+    def _save_all(self):
+        self._save_json(list(self.conversations), self.data_file)
+        self._save_json(list(self.metadata), self.metadata_file)
         self._save_embeddings()
-        
-        print(f"Stored conversation {conversation_id} for user {user_id}")
-        return conversation_id
     
-    def search_similar_conversations(self, user_id, query, n_results=3):
-        """Search for similar past conversations for a specific user"""
+    def _maybe_sync(self, turns):
+        """fsync the log every FSYNC_EVERY turns (0 leaves it to the OS)"""
+        if Config.FSYNC_EVERY <= 0:
+            return
+        self._unsynced_turns += turns
+        if self._unsynced_turns >= Config.FSYNC_EVERY:
+            self.segment_log.sync()
+            self._unsynced_turns = 0
+    
+    def _pending_turns(self, user_id=None):
+        """Turns accepted but not yet flushed by the write-behind queue"""
+        if self.write_queue is None:
+            return []
+        return [turn for turn in self.write_queue.pending()
+                if user_id is None or turn[1]["user_id"] == user_id]
+    
+    def flush(self):
+        """Persist everything waiting in the write-behind queue"""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+    
+    def close(self):
+        """Flush pending writes and stop the flusher thread (worker shutdown)"""
+        self.wait_for_refit()
+        self.maintenance.stop()
+        self.snapshotter.stop()
+        if self.write_queue is not None:
+            self.write_queue.close()
+        self.save_ann_indexes()
+        self.save_snapshot()
+    
+    def persistence_stats(self):
+        if self.write_queue is None:
+            return {"mode": "sync"}
+        return dict(self.write_queue.stats(), mode="write-behind")
+    
+    def _maybe_roll(self):
+        """Seal the log into a segment once it is large, merge segments when there are many"""
+        if self.segment_log.log_count >= Config.LOG_ROLL_THRESHOLD:
+            start = self.segment_log.segment_row_count()
+            self.segment_log.roll(self.conversations[start:], self.metadata[start:])
+            self.save_ann_indexes()
+        if len(self.segment_log.manifest["segments"]) > Config.MAX_SEGMENTS:
+            self._merge_segments()
+    
+    def _merge_segments(self):
+        """Merge all sealed segments into a single segment (append mode only)"""
+        with self.segment_log.locked():
+            self.refresh()
+            end = self.segment_log.segment_row_count()
+            self.segment_log.compact(self.conversations[:end], self.metadata[:end])
+    
+    # ---- warm-start snapshot ----
+    
+    def _snapshot_mode(self):
+        return self.storage_mode + ("-sparse" if self.sparse else "")
+    
+    def _open_snapshot(self):
+        """The snapshot in data_dir if it was written by this storage mode, else None"""
+        if not Config.SNAPSHOT:
+            return None
+        snapshot = Snapshot.open(self.snapshot_file)
+        if snapshot is None:
+            return None
+        if snapshot.header["dim"] != self.dim or snapshot.position.get("mode") != self._snapshot_mode():
+            log.warning(f"Ignoring {self.snapshot_file}: written by another storage mode or dimension")
+            return None
+        return snapshot
+    
+    @staticmethod
+    def _file_stamp(path):
         try:
-            if len(self.conversations) == 0 or self.embeddings.shape[0] == 0:
-                return ""
-            
-            # Generate query embedding
-            query_embedding = self._get_embedding(query).reshape(1, -1)
-            
-            # Calculate cosine similarities
-            similarities = cosine_similarity(query_embedding, self.embeddings)[0]
-            
-            # Get indices of conversations for this user
-            user_indices = []
-            for i, meta in enumerate(self.metadata):
-                if i < len(self.conversations) and meta.get("user_id") == user_id:
-                    user_indices.append(i)
-            
-            if not user_indices:
-                return ""
-            
-            # Get top N most similar conversations for this user
-            user_similarities = [(idx, similarities[idx]) for idx in user_indices]
-            user_similarities.sort(key=lambda x: x[1], reverse=True)
-            
-            # Build context from top results
-            context_parts = []
-            for idx, similarity_score in user_similarities[:n_results]:
-                if similarity_score > 0.1:  # Only include if somewhat relevant
-                    conv = self.conversations[idx]
-                    context_parts.append(conv["text"])
-            
-            context = "\n\n".join(context_parts)
-            print(f"Found {len(context_parts)} relevant conversations for user {user_id}")
-            return context
-            
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+    
+    def _json_stamps(self):
+        return {os.path.basename(path): self._file_stamp(path)
+                for path in (self.data_file, self.metadata_file, self.embeddings_file)}
+    
+    def _snapshot_position(self, rows):
+        """Where in storage a snapshot of the first ``rows`` in-memory rows stands (caller holds the write lock)"""
+        position = {"mode": self._snapshot_mode(), "rows": rows}
+        if self.segment_log is not None:
+            position.update(generation=self.segment_log.generation)
+        elif self.sqlite_store is not None:
+            position.update(last_row=self.sqlite_store.last_row, last_tombstone=self.sqlite_store.last_tombstone,
+                            embedder=self._embedder_stamp)
+        else:
+            position.update(files=self._json_stamps())
+        return position
+    
+    def save_snapshot(self):
+        """Write the rows to snapshot.bin for the next warm start; returns whether one was written.
+        
+        The write lock is only held to catch up and take references:
+        rows are append-only and compaction swaps in new lists, so the
+        rows are encoded and written outside it. In append mode the
+        embeddings stay in their mapped file; SQLite's are copied in, since
+        reading them back row by row is what makes its cold start slow.
+        Deleted rows are left out except in append mode, where row numbers
+        must match the segments. Nothing is written if the rows haven't
+        changed since the last snapshot, or another worker already wrote
+        this one.
+        """
+        if not Config.SNAPSHOT:
+            return False
+        with self._write_lock():
+            self.refresh()
+            rows = len(self.conversations)
+            conversations, metadata = self.conversations, self.metadata
+            tombstones = set(self.tombstones)
+            position = self._snapshot_position(rows)
+            embeddings = self._embeddings.rows[:rows] if self.sqlite_store is not None else None
+            key = (self._version, rows, len(tombstones), json.dumps(position, sort_keys=True))
+        if key == self._snapshot_key:
+            return False
+        header = read_header(self.snapshot_file)
+        if header is not None and header["position"] == position:
+            self._snapshot_key = key
+            return False
+        
+        start = time.perf_counter()
+        try:
+            with metrics.timer('store_snapshot_seconds'):
+                conversations, metadata = conversations[:rows], metadata[:rows]
+                if self.segment_log is None and tombstones:
+                    # Only append mode keeps deleted rows in storage; a cold start wouldn't load these
+                    keep = np.fromiter((conv["id"] not in tombstones for conv in conversations),
+                                       dtype=bool, count=rows)
+                    conversations = [conv for conv, k in zip(conversations, keep) if k]
+                    metadata = [meta for meta, k in zip(metadata, keep) if k]
+                    embeddings = embeddings[keep] if embeddings is not None else None
+                    tombstones = set()
+                columns = snapshot_rows(conversations, metadata)
+                if columns is None:
+                    log.warning(f"Rows in {self.data_dir} don't fit the snapshot format; not writing one")
+                    self._snapshot_key = key
+                    return False
+                embedder = {"name": self.embedder.name, "state": self.embedder.state()}
+                size = write_snapshot(self.snapshot_file, len(conversations), self.dim,
+                                      position, columns, tombstones, embeddings, embedder)
+            remove_stale_temp_files(self.snapshot_file)
         except Exception as e:
-            print(f"Search error: {e}")
-            return ""
+            log.warning(f"Snapshot error: {e}")
+            return False
+        self._snapshot_key = key
+        log.info(f"📸 Snapshot of {len(conversations)} conversations written ({size / 1e6:.1f} MB) "
+                 f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return True
+    
+    # ---- deletion, retention and compaction ----
+    
+    def delete_user(self, user_id):
+        """Delete every stored turn of ``user_id``; they leave search results at once"""
+        # Queued turns would otherwise be written after the tombstones
+        self.flush()
+        self.refresh()
+        ids = self._read_consistent(lambda: [self.conversations[row]["id"]
+                                             for row in self.user_index.get(user_id, ())])
+        return self._tombstone([{"user_id": user_id, "ids": ids}])
+    
+    def apply_retention(self):
+        """Delete the turns that outlived the retention limits; returns how many"""
+        if not self.retention.enabled:
+            return 0
+        self.refresh()
+        
+        def expired():
+            return [{"user_id": user_id, "ids": [self.conversations[row]["id"] for row in rows]}
+                    for user_id, rows in self.retention.expired(self.user_index, self._row_times()).items()]
+        deleted = self._tombstone(self._read_consistent(expired))
+        if deleted:
+            log.info(f"Retention deleted {deleted} conversations")
+        return deleted
+    
+    def _row_times(self):
+        """Every row's timestamp as datetime64[s], parsed once and extended as rows arrive.
+        
+        After a warm start the snapshot's rows come from its numeric
+        column, so none of them is decoded.
+        """
+        times = self._times if self._times_version == self._version else self._times[:0]
+        rows = len(self.metadata)
+        if len(times) < rows:
+            start = len(times)
+            parts = [times]
+            if isinstance(self.metadata, SnapshotRows) and start < self.metadata.base:
+                mapped = self.metadata.snapshot.times(self.metadata.base)
+                if mapped is not None:
+                    parts.append(mapped[start:])
+                    start = self.metadata.base
+            parts.append(parse_times([meta["timestamp"] for meta in self.metadata[start:rows]]))
+            times = np.concatenate(parts)
+        self._times, self._times_version = times, self._version
+        return times[:rows]
+    
+    def _tombstone(self, records):
+        """Persist and apply deletions given as {"user_id", "ids"} records"""
+        records = [record for record in records if record["ids"]]
+        if not records:
+            return 0
+        with self._write_lock():
+            self.refresh()
+            if self.segment_log is not None:
+                self.segment_log.append_tombstones(records)
+            elif self.sqlite_store is not None:
+                self.sqlite_store.delete(records)
+            deleted = self._apply_tombstones(records)
+        metrics.inc('store_deleted_rows_total', deleted)
+        if self.segment_log is None and self.sqlite_store is None:
+            # The JSON files are rewritten whole anyway; drop the rows right away
+            self.compact()
+        return deleted
+    
+    def _apply_tombstones(self, records):
+        """Take deleted rows out of ``user_index`` (they stay in memory until compaction)"""
+        deleted = 0
+        for record in records:
+            user_id, ids = record["user_id"], set(record["ids"])
+            rows = self.user_index.get(user_id)
+            if not rows:
+                continue
+            live = [row for row in rows if self.conversations[row]["id"] not in ids]
+            if len(live) == len(rows):
+                continue
+            deleted += len(rows) - len(live)
+            self.row_features.invalidate(user_id)
+            self.tombstones.update(self.conversations[row]["id"] for row in rows
+                                   if self.conversations[row]["id"] in ids)
+            if live:
+                self.user_index[user_id] = live
+            else:
+                del self.user_index[user_id]
+                self._drop_ann(user_id)
+        return deleted
+    
+    def maintain(self):
+        """One retention pass, then compaction once enough rows are deleted"""
+        self.apply_retention()
+        if self.tombstones and len(self.tombstones) >= Config.COMPACT_DEAD_RATIO * len(self.conversations):
+            self.compact()
+    
+    def compact(self):
+        """Drop deleted rows from storage and memory; returns how many were reclaimed.
+        
+        Append mode rewrites the sealed segments without the deleted rows;
+        the copy runs outside the write lock, which is only taken to
+        snapshot the rows and to swap the result in. An active log holding
+        deleted rows is rolled into a segment first so they are reclaimed
+        too. SQLite already deleted the rows, so only memory is compacted
+        and free pages are released.
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return 0
+        try:
+            with metrics.timer('store_compact_seconds'):
+                if self.segment_log is not None:
+                    dropped = self._compact_segments()
+                else:
+                    dropped = self._compact_memory()
+        finally:
+            self._compact_lock.release()
+        if dropped:
+            metrics.inc('store_compacted_rows_total', dropped)
+            log.info(f"Compaction reclaimed {dropped} deleted conversations")
+        return dropped
+    
+    def _live_mask(self, rows):
+        return np.fromiter((conv["id"] not in self.tombstones for conv in self.conversations[:rows]),
+                           dtype=bool, count=rows)
+    
+    def _compact_memory(self):
+        with self._write_lock():
+            self.refresh()
+            keep = self._live_mask(len(self.conversations))
+            if keep.all():
+                return 0
+            self._drop_rows(keep, EmbeddingBuffer(self.dim, self.embeddings[keep],
+                                                  dtype=self._embeddings.dtype))
+            if self.sqlite_store is not None:
+                self.sqlite_store.vacuum()
+            else:
+                self._save_all()
+        return int((~keep).sum())
+    
+    def _compact_segments(self):
+        with self.segment_log.locked():
+            self.refresh()
+            start = self.segment_log.segment_row_count()
+            if any(conv["id"] in self.tombstones for conv in self.conversations[start:]):
+                self.segment_log.roll(self.conversations[start:], self.metadata[start:])
+            replaced = list(self.segment_log.manifest["segments"])
+            generation = self.segment_log.generation
+            end = self.segment_log.segment_row_count()
+            keep = self._live_mask(end)
+            if keep.all():
+                return 0
+            conversations = [conv for conv, k in zip(self.conversations[:end], keep) if k]
+            metadata = [meta for meta, k in zip(self.metadata[:end], keep) if k]
+            source = None if self.sparse else self.embeddings
+        
+        # Sealed rows never change, so copying them doesn't hold up writers
+        blocks = None
+        if source is not None:
+            blocks = (source[start:min(start + 10000, end)][keep[start:start + 10000]]
+                      for start in range(0, end, 10000))
+        prepared = self.segment_log.prepare_compaction(conversations, metadata, blocks)
+        
+        with self.segment_log.locked():
+            self.refresh()
+            if self.segment_log.generation != generation:
+                self.segment_log.discard_compaction(prepared)
+                return 0
+            full_keep = np.ones(len(self.conversations), dtype=bool)
+            full_keep[:end] = keep
+            tail = self.embeddings[full_keep] if self.sparse else self.embeddings[end:]
+            # Tombstones for rows that stay (in the log, or deleted since the snapshot)
+            pending = {}
+            for row in np.flatnonzero(full_keep):
+                conv = self.conversations[row]
+                if conv["id"] in self.tombstones:
+                    pending.setdefault(conv["user_id"], []).append(conv["id"])
+            tombstones = [{"user_id": user_id, "ids": ids} for user_id, ids in pending.items()]
+            if not self.segment_log.commit_compaction(prepared, replaced, tail, tombstones):
+                return 0
+            self._drop_rows(full_keep, self.segment_log.embeddings)
+        return int((~keep).sum())
+    
+    def _drop_rows(self, keep, embeddings):
+        """Swap in the rows marked in ``keep``, renumbered (caller holds the write lock)"""
+        new_rows = np.cumsum(keep) - 1
+        new_rows[~keep] = -1
+        conversations = [conv for conv, k in zip(self.conversations, keep) if k]
+        metadata = [meta for meta, k in zip(self.metadata, keep) if k]
+        self._version += 1
+        try:
+            self.conversations, self.metadata, self._embeddings = conversations, metadata, embeddings
+            self._rebuild_user_index()
+            self.row_features.invalidate()
+            for user_id, index in list(self.ann_indexes.items()):
+                index.remap(new_rows)
+                self._ann_dirty.add(user_id)
+        finally:
+            self._version += 1
+        # Indexes not loaded here still use the old row numbers; they are rebuilt on demand
+        loaded = {os.path.basename(self._ann_path(user_id)) for user_id in self.ann_indexes}
+        for name in os.listdir(self.ann_dir):
+            if name not in loaded and ".tmp" not in name:
+                os.remove(os.path.join(self.ann_dir, name))
+        self.save_ann_indexes()
+    
+    def _drop_all_ann(self):
+        self.ann_indexes = {}
+        self._ann_dirty.clear()
+        for name in os.listdir(self.ann_dir):
+            if ".tmp" not in name:
+                os.remove(os.path.join(self.ann_dir, name))
+    
+    def _drop_ann(self, user_id):
+        self.ann_indexes.pop(user_id, None)
+        self._ann_dirty.discard(user_id)
+        if os.path.exists(self._ann_path(user_id)):
+            os.remove(self._ann_path(user_id))
+    
+    def _ann_path(self, user_id):
+        digest = hashlib.sha1(str(user_id).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.ann_dir, f"{digest}.npz")
+    
+    def _ann_candidates(self, user_id, rows, query_embeddings):
+        """Candidate rows from the user's IVF index (union over the queries), or None below ANN_MIN_ROWS"""
+        if self.sparse or Config.ANN_MIN_ROWS <= 0 or len(rows) < Config.ANN_MIN_ROWS:
+            return None
+        index = self.ann_indexes.get(user_id)
+        if index is None and os.path.exists(self._ann_path(user_id)):
+            index = IVFIndex.load(self._ann_path(user_id), self.dim, Config.ANN_PROBE)
+            self.ann_indexes[user_id] = index
+        if index is None or index.needs_retrain():
+            version = self._version
+            index = IVFIndex(self.dim, Config.ANN_PROBE)
+            index.train(self.embeddings[rows], rows)
+            # Trained on rows a compaction has since renumbered: use it once, don't keep it
+            if self._version == version:
+                self.ann_indexes[user_id] = index
+                index.save(self._ann_path(user_id))
+        else:
+            # Rows added by other workers (or before the last save) are caught up here
+            missing = rows[rows > index.max_row]
+            if len(missing):
+                index.add(self.embeddings[missing], missing)
+                self._ann_dirty.add(user_id)
+        candidates = np.unique(np.concatenate([index.candidates(query) for query in query_embeddings]))
+        # The index may still list deleted rows; keep only the user's live ones
+        return candidates[np.isin(candidates, rows, assume_unique=True)]
+    
+    def _ann_add(self, user_id, row, embedding):
+        index = self.ann_indexes.get(user_id)
+        if index is not None:
+            index.add(embedding, [row])
+            self._ann_dirty.add(user_id)
+    
+    def save_ann_indexes(self):
+        """Persist ANN indexes that received inserts since they were last saved"""
+        for user_id in list(self._ann_dirty):
+            self.ann_indexes[user_id].save(self._ann_path(user_id))
+        self._ann_dirty.clear()
+    
+    def search_similar_conversations(self, user_id, query, n_results=3, weights=None):
+        """Search for similar past conversations for a specific user"""
+        return "\n\n".join(conv["text"] for conv in self.search_similar(user_id, query, n_results, weights))
+    
+    def search_similar(self, user_id, query, n_results=3, weights=None):
+        """The user's best-scoring past turns (conversation dicts), best first.
+        
+        ``weights`` (a ScoreWeights) overrides the configured ranking for this call.
+        """
+        return self.search_many([(user_id, query)], n_results, weights)[0]
+    
+    def search_many(self, queries, n_results=3, weights=None):
+        """search_similar for a list of (user_id, query) pairs, in order.
+        
+        Queries of users with nothing stored (or queued) are skipped; the
+        rest are embedded in one call and each user's queries are scored
+        against that user's rows as one similarity matrix.
+        """
+        weights = weights or self.weights
+        results = [[] for _ in queries]
+        # Don't wait on a write-behind flush in progress; it is catching up anyway
+        self.refresh(blocking=False)
+        by_user = {}
+        for i, (user_id, _) in enumerate(queries):
+            by_user.setdefault(user_id, []).append(i)
+        pending_users = {meta["user_id"] for _, meta, _ in self._pending_turns()}
+        by_user = {user_id: positions for user_id, positions in by_user.items()
+                   if self.user_index.get(user_id) or user_id in pending_users}
+        if not by_user:
+            return results
+        searched = [i for positions in by_user.values() for i in positions]
+        embedded = self._get_embeddings([queries[i][1] for i in searched])
+        embedding_row = {i: row for row, i in enumerate(searched)}
+        for user_id, positions in by_user.items():
+            texts = [queries[i][1] for i in positions]
+            query_embeddings = embedded[[embedding_row[i] for i in positions]]
+            try:
+                found = self._read_consistent(lambda: self._search_user(
+                    user_id, texts, query_embeddings, n_results, weights))
+            except Exception as e:
+                log.error(f"Search error: {e}")
+                continue
+            for i, conversations in zip(positions, found):
+                results[i] = conversations
+            log.debug(f"Found {[len(c) for c in found]} relevant conversations for user {user_id}")
+        return results
+    
+    def _search_user(self, user_id, queries, query_embeddings, n_results, weights):
+        # Deferred so startup doesn't pay for importing sklearn
+        from sklearn.metrics.pairwise import cosine_similarity
+        # Don't wait on a write-behind flush in progress; it is catching up anyway
+        self.refresh(blocking=False)
+        pending = self._pending_turns(user_id)
+        user_indices = self.user_index.get(user_id)
+        if not user_indices and not pending:
+            return [[] for _ in queries]
+        
+        # Score only this user's rows (or the ANN candidates among them)
+        rows = np.asarray(user_indices or [], dtype=np.int64)
+        similarities = np.empty((len(queries), 0))
+        if len(rows):
+            candidates = self._ann_candidates(user_id, rows, query_embeddings)
+            if candidates is not None and len(candidates) >= n_results:
+                rows = candidates
+            similarities = cosine_similarity(query_embeddings, self.embeddings[rows])
+        
+        # Turns still waiting in the write-behind queue are scored alongside
+        if pending:
+            if self.sparse:
+                pending_embeddings = sp.vstack([sp.csr_matrix(e) for _, _, e in pending])
+            else:
+                pending_embeddings = np.vstack([e for _, _, e in pending])
+            similarities = np.hstack(
+                [similarities, cosine_similarity(query_embeddings, pending_embeddings)])
+        
+        # Keyword and recency features only when their weights are in play
+        counts = query_terms = times = None
+        if weights.keyword or weights.recency:
+            counts, times = self.row_features.get(user_id, user_indices or [], rows,
+                                                   self.conversations, self._version)
+            if pending:
+                counts = sp.vstack([counts, self.row_features.term_counts([c["text"] for c, _, _ in pending])],
+                                   format='csr')
+                times = np.concatenate([times, parse_times([c["timestamp"] for c, _, _ in pending])])
+            if weights.keyword:
+                query_terms = self.row_features.term_counts(queries)
+        scores = hybrid_scores(weights, similarities, counts, query_terms, times)
+        return [self._top_results(row_scores, rows, pending, n_results, weights.threshold)
+                for row_scores in scores]
+    
+    def _top_results(self, scores, rows, pending, n_results, threshold):
+        # Top N of the turns above the threshold via partial sort, then order
+        # just those N (extra slack for a queued turn that was flushed while
+        # we were reading)
+        relevant = np.flatnonzero(scores > threshold)
+        k = min(n_results + len(pending), len(relevant))
+        if k == 0:
+            return []
+        top = relevant[np.argpartition(-scores[relevant], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        
+        # Collect the top results
+        results = []
+        seen = set()
+        for i in top:
+            conv = self.conversations[rows[i]] if i < len(rows) else pending[i - len(rows)][0]
+            if conv["id"] in seen or len(results) == n_results:
+                continue
+            seen.add(conv["id"])
+            results.append(conv)
+        return results
     
     def get_user_conversations(self, user_id, limit=10):
         """Get recent conversations for a specific user"""
-        user_convos = [
-            conv for conv in self.conversations 
-            if conv.get("user_id") == user_id
-        ]
-        # Sort by timestamp (newest first)
-        user_convos.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        return user_convos[:limit]
+        return self.get_history_page(user_id, limit=limit)[0]
+    
+    def get_history_page(self, user_id, before=None, limit=20):
+        """One page of a user's turns, newest first; returns (conversations, next_before).
+        
+        Every storage mode orders by (timestamp, id) descending, like
+        SqliteStore.recent(). ``before`` is the previous page's
+        ``next_before``, the (timestamp, id) of its last turn, so pages stay
+        stable while the user keeps chatting and across compaction, and
+        imported turns with older timestamps land where they belong. Turns
+        still in the write-behind queue are merged in.
+        """
+        before = tuple(before) if before is not None else None
+        self.refresh(blocking=False)
+        return self._read_consistent(lambda: self._history_page(user_id, before, limit))
+    
+    def _history_page(self, user_id, before, limit):
+        def fits(key):
+            return before is None or key < before
+        
+        # One more than asked for, to know whether there is a next page
+        turns = {conv["id"]: conv for conv, _, _ in self._pending_turns(user_id)
+                 if fits((conv["timestamp"], conv["id"]))}
+        if self.sqlite_store is not None:
+            for conv in self.sqlite_store.recent(user_id, limit + 1, before):
+                turns.setdefault(conv["id"], conv)
+            candidates = turns.values()
+        else:
+            # A user's rows are in insertion order, which imports and other workers can
+            # break, so rank their (timestamp, id) keys and decode only the winners
+            keys = [(self.metadata[row]["timestamp"], self.metadata[row]["id"], row)
+                    for row in self.user_index.get(user_id, ())]
+            keys = heapq.nlargest(limit + 1, (key for key in keys if key[1] not in turns and fits(key[:2])))
+            candidates = list(turns.values()) + [self.conversations[row] for _, _, row in keys]
+        page = heapq.nlargest(limit + 1, candidates, key=lambda conv: (conv["timestamp"], conv["id"]))
+        if len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, (page[-1]["timestamp"], page[-1]["id"])
     
     def get_conversation_count(self, user_id=None):
         """Get total number of conversations (optionally for a specific user)"""
+        if self.sqlite_store is not None:
+            pending = self._pending_turns(user_id)
+            stored = self.sqlite_store.existing(meta["id"] for _, meta, _ in pending) if pending else ()
+            return self.sqlite_store.count(user_id) + len(pending) - len(stored)
+        return self._read_consistent(lambda: self._count(user_id))
+    
+    def _count(self, user_id):
+        # A batch being flushed is already in the rows but still queued; count it once
+        pending = self._pending_turns(user_id)
+        unstored = {meta["id"] for _, meta, _ in pending}
+        for pending_user in {meta["user_id"] for _, meta, _ in pending}:
+            unstored.difference_update(self.metadata[row]["id"] for row in self.user_index.get(pending_user, ()))
         if user_id:
-            return len([conv for conv in self.conversations if conv.get("user_id") == user_id])
-        return len(self.conversations)
\ No newline at end of file
+            return len(self.user_index.get(user_id, ())) + len(unstored)
+        return len(self.conversations) - len(self.tombstones) + len(unstored)
+    
+    def get_stats(self):
+        """Store size and embedding memory usage"""
+        return {
+            "storage_mode": self.storage_mode,
+            "conversations": len(self.conversations),
+            "users": len(self.user_index),
+            "deleted_rows": len(self.tombstones),
+            "embeddings": self._embeddings.stats(),
+            "persistence": self.persistence_stats(),
+        }
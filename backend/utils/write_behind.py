@@ -0,0 +1,102 @@
+import atexit
+import os
+import threading
+import time
+
+
+class WriteBehindQueue:
+    """Buffers writes in memory and flushes them from a background thread.
+
+    ``put()`` returns immediately; a flusher thread hands batches to
+    ``flush_fn`` every ``interval`` seconds, or as soon as ``batch_size``
+    items are waiting (group commit). Items stay in ``pending()`` until
+    ``flush_fn`` has returned, so readers can still see them while they
+    are in flight. A failed flush keeps its items for the next attempt.
+
+    The thread is started lazily and restarted after a fork, so the queue
+    works when gunicorn preloads the app in the master process.
+    """
+
+    def __init__(self, flush_fn, interval=1.0, batch_size=64):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.batch_size = batch_size
+        self._items = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self.last_flush = time.time()
+        self.flushed_total = 0
+        self.flush_errors = 0
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._ensure_thread()
+            if len(self._items) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        """Snapshot of items not yet flushed"""
+        with self._cond:
+            return list(self._items)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._items) < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Flush everything queued so far; safe to call from any thread"""
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._items)
+            if not batch:
+                self.last_flush = time.time()
+                return 0
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"Write-behind flush failed ({len(batch)} items kept): {e}")
+                return 0
+            with self._cond:
+                del self._items[:len(batch)]
+            self.flushed_total += len(batch)
+            self.last_flush = time.time()
+            return len(batch)
+
+    def close(self):
+        """Stop the flusher thread and write out whatever is left"""
+        # Closed stores mustn't stay reachable from the exit hooks
+        atexit.unregister(self.close)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._items)
+        return {
+            "queue_depth": depth,
+            "last_flush_age_s": round(time.time() - self.last_flush, 3),
+            "flushed_total": self.flushed_total,
+            "flush_errors": self.flush_errors,
+        }
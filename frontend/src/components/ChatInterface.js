@@ -25,6 +25,7 @@ const ChatInterface = () => {
   const [sessionId, setSessionId] = useState(null)
   const [isTyping, setIsTyping] = useState(false)
   const [conversationCount, setConversationCount] = useState(0)
+  const [tokensSaved, setTokensSaved] = useState(0)
   const [copiedMessageId, setCopiedMessageId] = useState(null)
   const [soundEnabled, setSoundEnabled] = useState(true)
   const messagesEndRef = useRef(null)
@@ -127,6 +128,7 @@ const ChatInterface = () => {
         response: aiResponse,
         session_id,
         conversation_count,
+        tokens_saved,
       } = response.data
 
       if (session_id && !sessionId) {
@@ -137,6 +139,11 @@ const ChatInterface = () => {
         setConversationCount(conversation_count)
       }
 
+      // Prompt tokens the backend's context trimming saved on this request
+      if (tokens_saved) {
+        setTokensSaved((prev) => prev + tokens_saved)
+      }
+
       // Simulate typing delay for better UX
       setTimeout(() => {
         const aiMessageId = Date.now() + '-ai'
@@ -146,6 +153,7 @@ const ChatInterface = () => {
             id: aiMessageId,
             type: 'assistant',
             content: aiResponse,
+            tokensSaved: tokens_saved || 0,
             timestamp: new Date(),
           },
         ])
@@ -191,6 +199,7 @@ const ChatInterface = () => {
     setMessages([])
     setSessionId(null)
     setConversationCount(0)
+    setTokensSaved(0)
   }
 
   const formatTime = (date) => {
@@ -265,6 +274,15 @@ const ChatInterface = () => {
                     </span>
                   </div>
                 </div>
+                <div className='glass-dark rounded-lg px-3 py-2'>
+                  <div
+                    className='flex items-center space-x-2 text-yellow-300'
+                    title='Prompt tokens saved by context trimming'
+                  >
+                    <Zap className='h-4 w-4' />
+                    <span>{tokensSaved} tokens saved</span>
+                  </div>
+                </div>
               </div>
 
               {/* Control Buttons */}
@@ -478,6 +496,11 @@ const ChatInterface = () => {
                           <p className='text-sm leading-relaxed whitespace-pre-wrap'>
                             {message.content}
                           </p>
+                          {message.tokensSaved > 0 && (
+                            <p className='text-xs text-purple-300 mt-2'>
+                              Context trimmed: {message.tokensSaved} tokens saved
+                            </p>
+                          )}
                         </div>
 
                         {message.type === 'user' && (